@@ -0,0 +1,214 @@
+"""
+Measures the scraping code against a corpus of saved Amazon pages, without hitting Amazon.
+
+    python3 benchmarks/scrape_benchmark.py --capture-corpus B0XXXXXXXX B0YYYYYYYY
+    python3 benchmarks/scrape_benchmark.py
+
+Run it from the directory of main.py, the corpus is kept in corpus/ and the configuration is read from .env as the bot does.
+"""
+import http.server
+import json
+import os
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from selenium.webdriver.common.by import By
+
+import main
+from main import log
+
+# Product fields compared by the corpus benchmark, and the hosts the saved pages must never load anything from
+CORPUS_COMPARED_FIELDS = ["product_name", "items_count", "current_price", "delivery_cost", "sold_by", "ships_from", "is_unavailable", "condition_text", "normalized_state"]
+CORPUS_BLOCKED_URLS = ["*amazon.*", "*media-amazon.com*", "*images-amazon.com*", "*amazon-adsystem.com*", "*cloudfront.net*"]
+
+def load_corpus_expected(corpus_dir):
+    expected_file = os.path.join(corpus_dir, "expected.json")
+    if not os.path.exists(expected_file):
+        return {}
+    with open(expected_file, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def capture_corpus_pages(asins, corpus_dir="corpus"):
+    """
+    Saves the product (or unavailable, or CAPTCHA) page and the AOD page of each ASIN in the benchmark corpus,
+    recording what is scraped from them now as the expected values in corpus/expected.json.
+    """
+    pages_dir = os.path.join(corpus_dir, "pages")
+    os.makedirs(pages_dir, exist_ok=True)
+    expected = load_corpus_expected(corpus_dir)
+
+    def save_page(driver, kind, asin, fields):
+        page_name = f"{kind}_{asin}.html"
+        with open(os.path.join(pages_dir, page_name), "w", encoding="utf-8") as f:
+            f.write(driver.page_source)
+        expected[page_name] = {"kind": kind, "asin": asin, "fields": fields}
+        log(f"Captured {kind} page of {asin} as {page_name}.", "corpus")
+
+    # These pages do come from Amazon, with the bot's limiter and wait points
+    resources = main.default_scrape_resources()
+    with main.driver_pool.lease("corpus") as driver:
+        for asin in asins:
+            resources.limiter.acquire("corpus")
+            driver.get(main.get_product_url(asin))
+            resources.waits.wait("product_page_load", driver, "corpus")
+            if driver.find_elements(By.XPATH, main.CAPTCHA_XPATH):
+                save_page(driver, "captcha", asin, {"captcha": True})
+                main.handle_captcha(driver, "corpus", resources)
+            scraped_data = main.scrape_product_fields(driver, "corpus", asin, resources)
+            save_page(driver, "unavailable" if scraped_data["is_unavailable"] else "product", asin, {field: scraped_data[field] for field in CORPUS_COMPARED_FIELDS})
+            offers = main.get_all_offers(driver, asin, "corpus", resources=resources)
+            save_page(driver, "aod", asin, {"offers": offers})
+
+    tmp_path = os.path.join(corpus_dir, "expected.json.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(expected, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, os.path.join(corpus_dir, "expected.json"))
+    log(f"Corpus now has {len(expected)} pages. Check the expected values in {corpus_dir}/expected.json before relying on them.", "corpus")
+
+def get_code_version():
+    # The git revision of the bot, if it runs from a checkout
+    try:
+        return subprocess.run(["git", "-C", os.path.dirname(os.path.abspath(main.__file__)), "describe", "--always", "--dirty"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ""
+
+def run_scrape_benchmark(corpus_dir="corpus", rounds=3):
+    """
+    Runs scrape_product_data, get_all_offers and handle_captcha against the saved pages of the corpus (and the debug snapshots in logs/),
+    served by a local HTTP server. Reports pages per second, the latency of each scraping step and field, and the differences with the
+    expected values; each run is appended to corpus/results.jsonl and compared with the previous run of the same engine and profile.
+    """
+    pages = [] # (path, kind, asin, expected fields or None)
+    for page_name, page_info in load_corpus_expected(corpus_dir).items():
+        pages.append((os.path.join(corpus_dir, "pages", page_name), page_info["kind"], page_info.get("asin", ""), page_info.get("fields")))
+    if os.path.isdir(main.DEBUG_HTML_DIR):
+        for file_name in sorted(os.listdir(main.DEBUG_HTML_DIR)):
+            match = re.fullmatch(r"debug_(.+)_not_found_(.+)\.html", file_name)
+            if match:
+                pages.append((os.path.join(main.DEBUG_HTML_DIR, file_name), "aod" if match.group(1).startswith("pinned_offer") else "product", match.group(2), None))
+    if not pages:
+        log(f"No pages to benchmark: capture some with --capture-corpus first.")
+        return None
+
+    # Nothing here must be slowed down as if it went to Amazon, and the debug snapshots of the failures must not overwrite the corpus
+    resources = main.scrape_resources(
+        main.amazon_rate_limiter(requests_per_minute=1e9, burst=10**9),
+        main.wait_strategies({name: ({"policy": "none"} if policy.get("policy") == "humanize" else policy) for name, policy in main.waits.policies.items()}),
+        os.path.join(corpus_dir, "debug"))
+
+    page_paths = {f"/{i}/{os.path.basename(path)}": path for i, (path, _, _, _) in enumerate(pages)}
+
+    class corpus_handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            path = page_paths.get(self.path.split("?")[0])
+            if path is None:
+                self.send_error(404)
+                return
+            with open(path, "rb") as f:
+                body = f.read()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), corpus_handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    scrape_engine = main.scrape_engine
+    browser_profile = main.browser_profile
+    driver = main.create_chrome_driver(profile=browser_profile)
+    step_samples = {}
+    mismatches = {}
+    pages_count = 0
+    try:
+        driver.execute_cdp_cmd("Network.enable", {})
+        driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": CORPUS_BLOCKED_URLS + (main.get_lean_blocked_urls() if browser_profile == "lean" else [])})
+        start_time = time.time()
+        for round_number in range(rounds):
+            for i, (path, kind, asin, expected_fields) in enumerate(pages):
+                page_url = f"{base_url}/{i}/{os.path.basename(path)}"
+                page_name = os.path.basename(path)
+                with main.tracer.trace("benchmark", page_name) as trace:
+                    if kind == "captcha":
+                        driver.get(page_url)
+                        actual_fields = {"captcha": main.handle_captcha(driver, page_name, resources)}
+                    elif kind == "aod":
+                        actual_fields = {"offers": main.get_all_offers(driver, asin, page_name, aod_url=page_url, resources=resources)}
+                    else:
+                        scraped_data = main.scrape_product_data(driver, page_url, page_name, asin, resources=resources)
+                        actual_fields = {field: scraped_data[field] for field in CORPUS_COMPARED_FIELDS}
+                pages_count += 1
+                for step, duration in trace["spans"].items():
+                    step_samples.setdefault(step, []).append(duration)
+                for field, expected_value in (expected_fields or {}).items():
+                    # Round trip through JSON, as the expected values were
+                    actual_value = json.loads(json.dumps(actual_fields.get(field)))
+                    if actual_value != expected_value:
+                        mismatches[(page_name, field)] = (expected_value, actual_value)
+        elapsed_time = time.time() - start_time
+    finally:
+        driver.quit()
+        server.shutdown()
+        server.server_close()
+
+    results = {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "version": get_code_version(),
+        "scrape_engine": scrape_engine,
+        "browser_profile": browser_profile,
+        "pages": pages_count,
+        "pages_per_second": pages_count / elapsed_time,
+        "steps": {},
+        "mismatches": len(mismatches),
+    }
+    log(f"Scrape benchmark ({scrape_engine} engine, {browser_profile} profile): {pages_count} pages in {elapsed_time:.2f}s ({results['pages_per_second']:.1f} pages/s)")
+    for step, durations in sorted(step_samples.items()):
+        durations.sort()
+        results["steps"][step] = {"p50": durations[len(durations) // 2], "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))]}
+        log(f"  {step}: p50 {results['steps'][step]['p50'] * 1000:.1f}ms, p95 {results['steps'][step]['p95'] * 1000:.1f}ms")
+    for (page_name, field), (expected_value, actual_value) in sorted(mismatches.items()):
+        log(f"  MISMATCH {page_name} {field}: expected {expected_value!r}, got {actual_value!r}")
+
+    # Compare with the previous run of the same engine and profile, then store this one
+    results_file = os.path.join(corpus_dir, "results.jsonl")
+    previous_results = None
+    if os.path.exists(results_file):
+        with open(results_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    past_results = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if past_results.get("scrape_engine") == scrape_engine and past_results.get("browser_profile") == browser_profile:
+                    previous_results = past_results
+    if previous_results:
+        log(f"Compared to {previous_results['version'] or previous_results['time']}: {previous_results['pages_per_second']:.1f} -> {results['pages_per_second']:.1f} pages/s, {previous_results['mismatches']} -> {results['mismatches']} mismatches")
+        for step, step_results in results["steps"].items():
+            previous_p50 = previous_results["steps"].get(step, {}).get("p50")
+            if previous_p50 and step_results["p50"] > previous_p50 * 1.2:
+                log(f"  REGRESSION {step}: p50 {previous_p50 * 1000:.1f}ms -> {step_results['p50'] * 1000:.1f}ms")
+    os.makedirs(corpus_dir, exist_ok=True)
+    with open(results_file, 'a', encoding='utf-8') as f:
+        f.write(json.dumps(results) + "\n")
+    return results
+
+if __name__ == '__main__':
+    if "--capture-corpus" in sys.argv:
+        # ASINs can be given after the option, otherwise the enabled products are used
+        capture_asins = sys.argv[sys.argv.index("--capture-corpus") + 1:]
+        if not capture_asins:
+            capture_asins = [product['asin'] for product in main.load_products_from_toml() or []]
+        capture_corpus_pages(capture_asins)
+    else:
+        run_scrape_benchmark()
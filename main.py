@@ -4,6 +4,19 @@ import platform
 import subprocess
 import re
 import json
+import contextlib
+import asyncio
+import http.server
+import html
+import heapq
+import itertools
+import concurrent.futures
+import queue
+import collections
+import sqlite3
+import multiprocessing
+import signal
+import zlib
 
 import selenium
 from selenium.webdriver.common.by import By
@@ -14,11 +27,13 @@ import threading
 import os
 import pickle
 from selenium.common.exceptions import NoSuchDriverException, NoSuchElementException, TimeoutException
-from datetime import datetime
+from datetime import datetime, timedelta
 import sys
 import toml
 import random
 import requests
+import lxml.etree
+import lxml.html
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler
 from dotenv import load_dotenv
@@ -27,8 +42,28 @@ load_dotenv()
 
 user_agent_string = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/119.0.0.0 Safari/537.36"
 
-def create_chrome_driver(headless=True):
+# URL patterns that are never needed to read prices and offers: fonts, media, ads and tracking beacons
+LEAN_BLOCKED_URLS = [
+    "*.woff", "*.woff2", "*.ttf", "*.otf",
+    "*.mp4", "*.webm", "*.m3u8",
+    "*.jpg", "*.jpeg", "*.png", "*.gif", "*.webp", "*.svg",
+    "*amazon-adsystem.com*", "*doubleclick.net*", "*googlesyndication.com*",
+    "*fls-eu.amazon.*", "*fls-na.amazon.*", "*fls-fe.amazon.*",
+    "*unagi.amazon.*", "*unagi-eu.amazon.*", "*unagi-na.amazon.*",
+    "*/uedata*", "*/1/batch/1/OE/*", "*/rd/uedata*",
+]
+
+def get_lean_blocked_urls():
+    allowed_urls = set(lean_allowed_urls)
+    return [url for url in LEAN_BLOCKED_URLS + lean_blocked_urls if url not in allowed_urls]
+
+def create_chrome_driver(headless=True, profile="full", log_network=False):
     options = selenium.webdriver.ChromeOptions()
+    if profile == "lean":
+        # Give the control back as soon as the DOM is parsed (or right away with "none"), the wait points take care of the rest
+        options.page_load_strategy = lean_page_load_strategy
+    if log_network:
+        options.set_capability("goog:loggingPrefs", {"performance": "ALL"})
     options.add_argument(f"user-agent={user_agent_string}")
     if headless:
         options.add_argument("--headless=new")
@@ -54,14 +89,509 @@ def create_chrome_driver(headless=True):
     options.add_argument("--silent");
     options.add_argument("--window-size=1920,1080")
     try:
-        return selenium.webdriver.Chrome(options=options)
+        driver = selenium.webdriver.Chrome(options=options)
     except NoSuchDriverException:
-        pass
-    service = selenium.webdriver.chrome.service.Service(executable_path='/usr/bin/chromedriver')
-    return selenium.webdriver.Chrome(service=service, options=options)
+        service = selenium.webdriver.chrome.service.Service(executable_path='/usr/bin/chromedriver')
+        driver = selenium.webdriver.Chrome(service=service, options=options)
+    if profile == "lean":
+        try:
+            driver.execute_cdp_cmd("Network.enable", {})
+            driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": get_lean_blocked_urls()})
+        except Exception:
+            driver.quit()
+            raise
+    return driver
+
+def create_logged_in_chrome_driver(headless=True, profile="full"):
+    driver = create_chrome_driver(headless=headless, profile=profile)
+    try:
+        # Always load cookies, as login is handled externally
+        amazon_cookies.apply_to_driver(driver)
+    except Exception:
+        driver.quit()
+        raise
+    return driver
+
+class amazon_session:
+    """
+    The Amazon login cookies, loaded once from .cookies.pkl and kept in memory.
+    New drivers get them with a single DevTools Network.setCookies call before their first navigation,
+    and the cookies refreshed by Amazon are periodically written back to the file.
+    """
+    def __init__(self, cookies_file=".cookies.pkl", save_interval=600):
+        self.cookies_file = cookies_file
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.cookies = None
+        self.last_save_time = time.time()
+
+    def exists(self):
+        with self.lock:
+            return self.cookies is not None or os.path.exists(self.cookies_file)
+
+    def get_cookies(self):
+        with self.lock:
+            if self.cookies is None:
+                with open(self.cookies_file, "rb") as f:
+                    self.cookies = pickle.load(f)
+            return list(self.cookies)
+
+    def apply_to_driver(self, driver):
+        cookies = []
+        for cookie in self.get_cookies():
+            cdp_cookie = {
+                "name": cookie['name'],
+                "value": cookie['value'],
+                "path": cookie.get('path', '/'),
+                "secure": cookie.get('secure', False),
+                "httpOnly": cookie.get('httpOnly', False),
+            }
+            if cookie.get('domain'):
+                cdp_cookie["domain"] = cookie['domain']
+            else:
+                cdp_cookie["url"] = f"https://{amazon_host}/"
+            if cookie.get('expiry'):
+                cdp_cookie["expires"] = cookie['expiry']
+            if cookie.get('sameSite') in ("Strict", "Lax", "None"):
+                cdp_cookie["sameSite"] = cookie['sameSite']
+            cookies.append(cdp_cookie)
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+
+    def apply_to_http_session(self, session):
+        for cookie in self.get_cookies():
+            session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain', amazon_host), path=cookie.get('path', '/'))
+
+    def validate(self):
+        with driver_pool.lease() as driver:
+            amazon_limiter.acquire()
+            driver.get(f"https://{amazon_host}/gp/css/homepage.html")
+            waits.wait("session_check_redirect", driver)
+            return "signin" not in driver.current_url
+
+    def refresh_from_driver(self, driver):
+        # Write back the cookies refreshed by Amazon, at most once every save_interval seconds
+        with self.lock:
+            if self.cookies is None or time.time() - self.last_save_time < self.save_interval:
+                return
+            self.last_save_time = time.time()
+        if amazon_host not in driver.current_url or "signin" in driver.current_url:
+            return
+        cookies = driver.get_cookies()
+        if cookies:
+            self.save(cookies)
+
+    def save(self, cookies):
+        with self.lock:
+            tmp_file = f"{self.cookies_file}.tmp"
+            with open(tmp_file, "wb") as f:
+                pickle.dump(cookies, f)
+            os.replace(tmp_file, self.cookies_file)
+            self.cookies = list(cookies)
+            self.last_save_time = time.time()
+
+    def invalidate(self):
+        with self.lock:
+            self.cookies = None
+            if os.path.exists(self.cookies_file):
+                os.remove(self.cookies_file)
+        # The pooled drivers are logged in with the old cookies
+        driver_pool.close()
 
 def log(message, product_name=None):
-    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}]{f' [{product_name}]' if product_name else ''} {message}")
+    print(f"[{datetime.now().strftime('%Y-%m-%d %H:%M:%S.%f')[:-3]}]{f' [shard {shard_index}]' if shard_index is not None else ''}{f' [{product_name}]' if product_name else ''} {message}")
+
+class operation_cancelled(Exception):
+    """
+    Raised by a wait point or by the rate limiter when the monitor was stopped, or the bot is shutting down, while waiting.
+    """
+
+cancel_scope = threading.local()
+
+@contextlib.contextmanager
+def cancellable(event):
+    # The waits of the current thread return as soon as event is set, instead of the shutdown only
+    previous_event = getattr(cancel_scope, "event", None)
+    cancel_scope.event = event
+    try:
+        yield event
+    finally:
+        cancel_scope.event = previous_event
+
+def current_cancel_event():
+    return getattr(cancel_scope, "event", None) or shutdown_event
+
+
+class amazon_rate_limiter:
+    """
+    Token bucket shared by every page load and HTTP request to Amazon, from any driver or thread.
+    Each CAPTCHA halves the rate, which then grows back by a tenth of the configured rate every increase_interval seconds without CAPTCHAs (AIMD).
+    """
+    def __init__(self, requests_per_minute, burst, increase_interval=60, min_rate_ratio=1 / 16):
+        self.max_rate = requests_per_minute / 60
+        self.min_rate = self.max_rate * min_rate_ratio
+        self.rate = self.max_rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.increase_interval = increase_interval
+        self.lock = threading.Lock()
+        self.last_refill_time = time.monotonic()
+        self.last_adjust_time = self.last_refill_time
+        self.requests_count = 0
+        self.captchas_count = 0
+        self.captcha_times = collections.deque(maxlen=1000)
+        self.throttled_count = 0
+        self.total_throttled_time = 0.0
+
+    def _refill(self, now):
+        # Called with the lock held
+        if self.rate >= self.max_rate:
+            self.last_adjust_time = now
+        while self.rate < self.max_rate and now - self.last_adjust_time >= self.increase_interval:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+            self.last_adjust_time += self.increase_interval
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill_time) * self.rate)
+        self.last_refill_time = now
+
+    def acquire(self, log_id=None, cancel_event=None):
+        cancel_event = cancel_event or current_cancel_event()
+        start_time = time.monotonic()
+        throttled = False
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.requests_count += 1
+                    throttled_time = now - start_time if throttled else 0.0
+                    if throttled:
+                        self.throttled_count += 1
+                        self.total_throttled_time += throttled_time
+                    break
+                wait_time = (1 - self.tokens) / self.rate
+            throttled = True
+            if cancel_event.wait(wait_time):
+                raise operation_cancelled("Cancelled while waiting for the Amazon rate limit")
+        if throttled_time > 5:
+            log(f"Throttled for {throttled_time:.1f}s by the Amazon rate limit ({self.rate * 60:.1f} requests/min).", log_id)
+        return throttled_time
+
+    def on_captcha(self, log_id=None):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0.0) # Every thread waits, not only the one that got the CAPTCHA
+            self.last_adjust_time = now
+            self.captchas_count += 1
+            self.captcha_times.append(time.time())
+            rate = self.rate
+        log(f"CAPTCHA detected, Amazon rate limit lowered to {rate * 60:.1f} requests/min.", log_id)
+
+    def stats(self):
+        with self.lock:
+            self._refill(time.monotonic())
+            one_hour_ago = time.time() - 3600
+            return {
+                "rate": self.rate * 60,
+                "max_rate": self.max_rate * 60,
+                "tokens": self.tokens,
+                "burst": self.burst,
+                "requests": self.requests_count,
+                "captchas": self.captchas_count,
+                "captchas_last_hour": sum(1 for captcha_time in self.captcha_times if captcha_time >= one_hour_ago),
+                "captcha_rate": self.captchas_count / self.requests_count if self.requests_count else 0.0,
+                "throttled": self.throttled_count,
+                "avg_throttled_time": self.total_throttled_time / self.throttled_count if self.throttled_count else 0.0,
+            }
+
+class chrome_driver_pool:
+    """
+    A bounded pool of logged-in headless Chrome drivers shared by the monitors and the Telegram commands.
+    Drivers are created lazily up to max_size; callers lease one, use it and give it back.
+    """
+    def __init__(self, max_size, headless=True, profile="full"):
+        self.max_size = max(1, max_size)
+        self.headless = headless
+        self.profile = profile
+        self.idle_drivers = []
+        self.size = 0
+        self.in_use = 0
+        self.cond = threading.Condition()
+        self.created_time = time.time()
+        self.leases_count = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self.total_busy_time = 0.0
+        self.discarded_count = 0
+        self.leased_drivers = set()
+        self.closed = False
+
+    def acquire(self, log_id=None):
+        start_time = time.time()
+        driver = None
+        with self.cond:
+            while not self.closed and not self.idle_drivers and self.size >= self.max_size:
+                self.cond.wait()
+            if self.closed:
+                raise operation_cancelled("The Chrome driver pool is shut down")
+            if self.idle_drivers:
+                driver = self.idle_drivers.pop()
+            else:
+                self.size += 1 # Reserve the slot, the driver is created outside the lock
+
+        if driver is None:
+            try:
+                driver = create_logged_in_chrome_driver(headless=self.headless, profile=self.profile)
+            except Exception:
+                with self.cond:
+                    self.size -= 1
+                    self.cond.notify()
+                raise
+            log(f"Created pooled Chrome driver ({self.size}/{self.max_size}).", log_id)
+
+        wait_time = time.time() - start_time
+        with self.cond:
+            self.in_use += 1
+            self.leased_drivers.add(driver)
+            self.leases_count += 1
+            self.total_wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+        if wait_time > 10:
+            log(f"Waited {wait_time:.2f}s to lease a Chrome driver.", log_id)
+        return driver
+
+    def release(self, driver, discard=False, busy_time=0.0):
+        with self.cond:
+            discard = discard or self.closed
+        if discard:
+            try:
+                driver.quit()
+            except Exception:
+                pass
+        else:
+            try:
+                amazon_cookies.refresh_from_driver(driver)
+            except Exception as e:
+                log(f"Could not save the refreshed cookies: {e}")
+        with self.cond:
+            self.in_use -= 1
+            self.leased_drivers.discard(driver)
+            self.total_busy_time += busy_time
+            if discard:
+                self.size -= 1
+                self.discarded_count += 1
+            else:
+                self.idle_drivers.append(driver)
+            self.cond.notify()
+
+    @contextlib.contextmanager
+    def lease(self, log_id=None):
+        with tracer.span("driver_lease"):
+            driver = self.acquire(log_id)
+        lease_start_time = time.time()
+        discard = False
+        try:
+            yield driver
+        except Exception:
+            # Drop the driver if the browser itself died, keep it for page-level errors
+            discard = not is_driver_alive(driver)
+            if discard:
+                log("Pooled Chrome driver is not responding anymore, discarding it.", log_id)
+            raise
+        finally:
+            self.release(driver, discard=discard, busy_time=time.time() - lease_start_time)
+
+    def stats(self):
+        with self.cond:
+            uptime = max(time.time() - self.created_time, 1e-6)
+            return {
+                "max_size": self.max_size,
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": len(self.idle_drivers),
+                "leases": self.leases_count,
+                "discarded": self.discarded_count,
+                "avg_wait_time": self.total_wait_time / self.leases_count if self.leases_count else 0.0,
+                "max_wait_time": self.max_wait_time,
+                "utilization": self.total_busy_time / (self.max_size * uptime),
+            }
+
+    def close(self):
+        # Quits the idle drivers, the pool keeps working and creates new ones when needed
+        with self.cond:
+            drivers = self.idle_drivers
+            self.idle_drivers = []
+            self.size -= len(drivers)
+        quit_drivers(drivers)
+
+    def shutdown(self, timeout):
+        """
+        Quits every driver: the idle ones right away, the leased ones when they are given back,
+        or from here after timeout seconds if their lease didn't end in time.
+        """
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.close()
+        with self.cond:
+            self.cond.wait_for(lambda: self.in_use == 0, timeout=timeout)
+            drivers = list(self.leased_drivers)
+        if drivers:
+            log(f"Quitting {len(drivers)} Chrome driver(s) still leased after {timeout:.1f}s.")
+            quit_drivers(drivers)
+
+def quit_drivers(drivers):
+    # Each quit waits for chromedriver to close the browser, so they are done in parallel
+    def quit_driver(driver):
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    if len(drivers) == 1:
+        quit_driver(drivers[0])
+    elif drivers:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(drivers), thread_name_prefix="driver-quit") as executor:
+            list(executor.map(quit_driver, drivers))
+
+def is_driver_alive(driver):
+    try:
+        driver.current_url
+        return True
+    except Exception:
+        return False
+
+@contextlib.contextmanager
+def lease_command_driver(debug, log_id=None):
+    if not debug:
+        with driver_pool.lease(log_id) as driver:
+            yield driver
+        return
+
+    # Debug sessions need a visible browser, so they never go through the headless pool
+    driver = create_logged_in_chrome_driver(headless=False)
+    try:
+        yield driver
+    finally:
+        driver.quit()
+
+DEFAULT_WAIT_POLICIES = {
+    # Product and AOD pages: wait for the document to be fully loaded
+    "product_page_load": {"policy": "dom", "condition": "return document.readyState == 'complete'", "timeout": 30},
+    "aod_page_load": {"policy": "dom", "condition": "return document.readyState == 'complete'", "timeout": 30},
+    # /offers: pause between the product page and the AOD page to mimic human behavior
+    "offers_humanize": {"policy": "humanize", "min": 2, "max": 5},
+    # CAPTCHA: pauses before and after clicking the "Continue shopping" button
+    "captcha_before_click": {"policy": "humanize", "min": 0, "max": 3},
+    "captcha_after_click": {"policy": "humanize", "min": 3, "max": 6},
+    # Session check: give time for the redirection to the sign-in page
+    "session_check_redirect": {"policy": "humanize", "min": 2, "max": 2},
+}
+
+class wait_strategies:
+    """
+    Named wait points, each one with a configurable policy:
+    - "dom": polls a JavaScript condition (or the presence of an XPath) until it is true
+    - "network_idle": waits until no new resource has been loaded for idle_time seconds
+    - "humanize": sleeps for a random time between min and max seconds
+    - "none": doesn't wait at all
+    Every policy returns early with operation_cancelled when the cancel event of the thread is set (see cancellable).
+    The time actually spent blocked is accounted per wait point.
+    """
+    def __init__(self, policies):
+        self.policies = policies
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def wait(self, name, driver=None, log_id=None, cancel_event=None):
+        policy = self.policies.get(name) or {"policy": "none"}
+        cancel_event = cancel_event or current_cancel_event()
+        start_time = time.time()
+        timed_out = False
+        try:
+            policy_name = policy.get("policy", "none")
+            if policy_name == "dom":
+                self._wait_dom(driver, policy, cancel_event)
+            elif policy_name == "network_idle":
+                self._wait_network_idle(driver, policy, cancel_event)
+            elif policy_name == "humanize":
+                delay = random.uniform(policy.get("min", 0), policy.get("max", policy.get("min", 0)))
+                if cancel_event.wait(delay):
+                    raise operation_cancelled(f"Cancelled in wait point '{name}'")
+            elif policy_name != "none":
+                log(f"Unknown policy '{policy_name}' for wait point '{name}', not waiting.", log_id)
+        except TimeoutException:
+            timed_out = True
+            raise
+        finally:
+            self._account(name, time.time() - start_time, timed_out)
+
+    def _poll(self, driver, predicate, timeout, poll_interval, cancel_event=None):
+        # Like WebDriverWait.until, but sleeping on the cancel event
+        cancel_event = cancel_event or current_cancel_event()
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                if predicate(driver):
+                    return
+            except NoSuchElementException:
+                pass
+            if time.monotonic() >= deadline:
+                raise TimeoutException(f"Condition not met after {timeout}s")
+            if cancel_event.wait(min(poll_interval, max(0.0, deadline - time.monotonic()))):
+                raise operation_cancelled("Cancelled while waiting for the page")
+
+    def _wait_dom(self, driver, policy, cancel_event=None):
+        if policy.get("xpath"):
+            condition = "return document.evaluate(arguments[0], document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue !== null"
+            args = [policy["xpath"]]
+        else:
+            condition = policy.get("condition", "return document.readyState == 'complete'")
+            args = []
+        self._poll(driver, lambda d: d.execute_script(condition, *args), policy.get("timeout", 30), policy.get("poll_interval", 0.2), cancel_event)
+
+    def _wait_network_idle(self, driver, policy, cancel_event=None):
+        idle_time = policy.get("idle_time", 0.5)
+        state = {"count": -1, "since": time.time()}
+
+        def is_idle(d):
+            count = d.execute_script("return document.readyState != 'loading' ? performance.getEntriesByType('resource').length : -1")
+            if count != state["count"]:
+                state["count"] = count
+                state["since"] = time.time()
+                return False
+            return count >= 0 and time.time() - state["since"] >= idle_time
+
+        self._poll(driver, is_idle, policy.get("timeout", 30), policy.get("poll_interval", 0.1), cancel_event)
+
+    def _account(self, name, blocked_time, timed_out):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = {"count": 0, "total_time": 0.0, "max_time": 0.0, "timeouts": 0}
+            stats["count"] += 1
+            stats["total_time"] += blocked_time
+            stats["max_time"] = max(stats["max_time"], blocked_time)
+            stats["timeouts"] += timed_out
+
+    def snapshot(self):
+        with self.lock:
+            return {name: dict(stats) for name, stats in self.stats.items()}
+
+def load_wait_policies_from_toml():
+    # waits.toml is optional, its tables override the default policy of the wait points with the same name
+    policies = {name: dict(policy) for name, policy in DEFAULT_WAIT_POLICIES.items()}
+    if browser_profile == "lean":
+        policies.update({name: dict(policy) for name, policy in LEAN_WAIT_POLICIES.items()})
+    try:
+        with open('waits.toml', 'r', encoding='utf-8') as f:
+            waits_toml = toml.load(f)
+    except FileNotFoundError:
+        return policies
+    for name, policy in waits_toml.items():
+        policies[name] = dict(policy)
+    return policies
 
 # States for adding a product
 ASK_NAME, ASK_CUT_PRICE = range(2)
@@ -126,8 +656,8 @@ async def add_cut_price(update: Update, context: ContextTypes.DEFAULT_TYPE):
     with open(products_file, 'w', encoding='utf-8') as f:
         toml.dump(products_toml, f)
 
-    # Start monitoring the new product
-    start_monitoring_product(product_data)
+    # Start monitoring the new product, on the shard worker owning it in sharded mode
+    await asyncio.get_running_loop().run_in_executor(None, lambda: call_monitors("start_monitoring_product", product_data, asin=product_data['asin']))
 
     await update.message.reply_text(f"Product '{product_data['name']}' added and monitoring started!")
     return ConversationHandler.END
@@ -146,8 +676,8 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     asin_to_delete = context.args[0]
 
-    # Stop monitoring the product
-    stop_monitoring_product(asin_to_delete)
+    # Stop monitoring the product, without blocking the event loop while its check is cancelled
+    await asyncio.get_running_loop().run_in_executor(None, lambda: call_monitors("stop_monitoring_product", asin_to_delete, asin=asin_to_delete))
 
     # Remove from products.toml
     products_file = 'products.toml'
@@ -171,6 +701,119 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     else:
         await update.message.reply_text(f"Product with ASIN {asin_to_delete} not found in the monitoring list.")
 
+class command_job_queue:
+    """
+    Runs the browser work of the Telegram commands in a bounded executor, so that the asyncio event loop keeps polling.
+    The command is acknowledged right away with its queue position, and the reply is edited with the result when done.
+    """
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max(1, max_concurrency)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency, thread_name_prefix="command")
+        self.lock = threading.Lock()
+        self.waiting_jobs = []
+        self.running_count = 0
+
+    async def submit(self, update, context, description, job, *args):
+        job_id = object()
+        submit_time = time.time()
+        with self.lock:
+            self.waiting_jobs.append(job_id)
+            position = len(self.waiting_jobs) - (self.max_concurrency - self.running_count)
+        if position > 0:
+            ack = await update.message.reply_text(f"{description}: queued, position {position}.")
+        else:
+            ack = await update.message.reply_text(f"{description}: working on it...")
+        context.application.create_task(self._run(ack, description, job_id, position > 0, submit_time, job, args))
+
+    async def _run(self, ack, description, job_id, queued, submit_time, job, args):
+        loop = asyncio.get_running_loop()
+
+        def progress(text):
+            # Called from the executor thread
+            asyncio.run_coroutine_threadsafe(ack.edit_text(text), loop).result()
+
+        def run_job():
+            with self.lock:
+                self.waiting_jobs.remove(job_id)
+                self.running_count += 1
+            try:
+                with tracer.trace(description.split()[0], description):
+                    tracer.record("queued", time.time() - submit_time)
+                    if queued:
+                        progress(f"{description}: working on it...")
+                    return job(progress, *args)
+            finally:
+                with self.lock:
+                    self.running_count -= 1
+
+        try:
+            result = await loop.run_in_executor(self.executor, run_job)
+        except Exception as e:
+            log(f"{description} failed: {e}")
+            result = f"{description} failed: {e}"
+        if result:
+            # Telegram messages are limited to 4096 characters, the rest of a long result goes to follow-up replies
+            chunks = split_message(result)
+            await ack.edit_text(chunks[0])
+            for chunk in chunks[1:]:
+                await ack.reply_text(chunk)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "waiting": len(self.waiting_jobs),
+                "running": self.running_count,
+                "max_concurrency": self.max_concurrency,
+            }
+
+HTML_TOKEN_REGEX = re.compile(r"<(/?)(\w+)[^>]*>|&#?\w+;|[^<&]+|[<&]")
+
+def split_message(text, max_length=4096, parse_mode=None):
+    # Splits between lines; a line too long for a message is cut, or truncated when it has HTML markup so that its tags stay balanced
+    chunks = []
+    current = ""
+    for line in text.splitlines(keepends=True):
+        if parse_mode == "HTML" and len(line) > max_length:
+            line = truncate_html(line, max_length)
+        while len(line) > max_length:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(line[:max_length])
+            line = line[max_length:]
+        if len(current) + len(line) > max_length:
+            chunks.append(current)
+            current = ""
+        current += line
+    if current or not chunks:
+        chunks.append(current)
+    return chunks
+
+def truncate_html(line, max_length, ellipsis="…"):
+    # Cuts the line between tags and entities, and closes the tags left open
+    ending = "\n" if line.endswith("\n") else ""
+    result = ""
+    open_tags = []
+    for match in HTML_TOKEN_REGEX.finditer(line.rstrip("\n")):
+        token = match.group(0)
+        tag = match.group(2)
+        if tag is None:
+            token_open_tags = open_tags
+        elif match.group(1):
+            token_open_tags = open_tags[:-1]
+        else:
+            token_open_tags = open_tags + [tag]
+        room = max_length - len(result) - len(ellipsis) - len(ending) - sum(len(open_tag) + 3 for open_tag in token_open_tags)
+        if len(token) > room:
+            if tag is None and not token.startswith("&"):
+                result += token[:max(0, room)]
+            break
+        result += token
+        open_tags = token_open_tags
+    else:
+        return line
+    return result + ellipsis + "".join(f"</{open_tag}>" for open_tag in reversed(open_tags)) + ending
+
 async def post_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
@@ -181,48 +824,35 @@ async def post_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     asin = context.args[0]
     seller_id = context.args[1]
     custom_message = " ".join(context.args[2:])
-    log_id = f"/post {asin}"
 
-    driver = None
-    try:
-        # Start a new driver session
-        driver = create_chrome_driver(headless=True)
+    # Pooled drivers are logged in through the cookies
+    if not amazon_cookies.exists():
+        await update.message.reply_text("Cookies file not found. Cannot proceed without being logged in.")
+        return
 
-        # Load cookies to be logged in
-        if not os.path.exists(".cookies.pkl"):
-            await update.message.reply_text("Cookies file not found. Cannot proceed without being logged in.")
-            return
-            
-        driver.get(f"https://{amazon_host}/")
-        with open(".cookies.pkl", "rb") as f:
-            cookies = pickle.load(f)
-            for cookie in cookies:
-                if 'domain' in cookie:
-                    del cookie['domain']
-                driver.add_cookie(cookie)
-        driver.refresh()
+    await command_jobs.submit(update, context, f"/post {asin}", post_job, asin, seller_id, custom_message)
 
+def post_job(progress, asin, seller_id, custom_message):
+    log_id = f"/post {asin}"
+    with driver_pool.lease(log_id) as driver:
         # Navigate to product page
         product_url = get_product_url(asin, seller_id)
         scraped_data = scrape_product_data(driver, product_url, log_id, asin, use_rufus_ai=True)
 
         product_name = scraped_data["product_name"]
         if not product_name:
-            await update.message.reply_text(f"Could not retrieve product name for {asin}.")
-            return
+            return f"Could not retrieve product name for {asin}."
 
         product_image_url = scraped_data["product_image_url"]
         price = scraped_data["current_price"]
         if price <= 0:
-            await update.message.reply_text(f"Could not retrieve a valid price for {asin}.")
-            return
+            return f"Could not retrieve a valid price for {asin}."
 
         items_count = scraped_data["items_count"]
 
-        # Generate Shortlink
-        shortlink = generate_shortlink(driver, asin, log_id)
+        shortlink = shortlinks.get(asin, seller_id, amazon_tag, log_id)
         if not shortlink:
-            shortlink = get_affiliate_link(asin, amazon_tag, seller_id) # Fallback to full URL if shortlink generation fails
+            shortlink = get_affiliate_link(asin, amazon_tag, seller_id) # Fallback to full URL until the shortlink is generated
 
         # Construct and send message
         items_count_str = ""
@@ -231,11 +861,7 @@ async def post_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         final_message = f"{product_name}{items_count_str} a {price:.2f}EUR\n{custom_message}\n{shortlink}"
 
         send_telegram_notification(final_message, image_url=product_image_url, log_id=log_id)
-        await update.message.reply_text("Post notification sent.")
-
-    finally:
-        if driver:
-            driver.quit()
+        return "Post notification sent."
 
 async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
@@ -248,35 +874,24 @@ async def get_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     seller_id = context.args[1]
     options = context.args[2].split(',') if len(context.args) >= 3 else []
     debug = "debug" in options
-    log_id = f"/get {asin}"
-
-    driver = None
-    try:
-        # Start a new driver session
-        driver = create_chrome_driver(headless=not debug)
 
-        # Load cookies to be logged in
-        if not os.path.exists(".cookies.pkl"):
-            await update.message.reply_text("Cookies file not found. Cannot proceed without being logged in.")
-            return
+    # Load cookies to be logged in
+    if not amazon_cookies.exists():
+        await update.message.reply_text("Cookies file not found. Cannot proceed without being logged in.")
+        return
 
-        driver.get(f"https://{amazon_host}/")
-        with open(".cookies.pkl", "rb") as f:
-            cookies = pickle.load(f)
-            for cookie in cookies:
-                if 'domain' in cookie:
-                    del cookie['domain']
-                driver.add_cookie(cookie)
-        driver.refresh()
+    await command_jobs.submit(update, context, f"/get {asin}", get_job, asin, seller_id, debug)
 
+def get_job(progress, asin, seller_id, debug):
+    log_id = f"/get {asin}"
+    with lease_command_driver(debug, log_id) as driver:
         # Navigate to product page
         product_url = get_product_url(asin, seller_id)
         scraped_data = scrape_product_data(driver, product_url, log_id, asin, use_rufus_ai=True)
 
         product_name = scraped_data["product_name"]
         if not product_name:
-            await update.message.reply_text(f"Could not retrieve product name for {asin}.")
-            return
+            return f"Could not retrieve product name for {asin}."
 
         product_image_url = scraped_data["product_image_url"]
         price = scraped_data["current_price"]
@@ -318,59 +933,62 @@ DOM>
         Affiliate Link: {affiliate_link}
         """
 
-        await update.message.reply_text(message)
+        if not debug:
+            return message
 
-        if debug:
-            time.sleep(60)
-
-    finally:
-        if driver:
-            driver.quit()
+        # Keep the visible browser open for a while, after showing the result
+        progress(message)
+        shutdown_event.wait(60)
 
 async def offers_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not context.args:
-        await update.message.reply_text("Usage: /offers <ASIN>")
+        await update.message.reply_text("Usage: /offers <ASIN>[,<ASIN>...] [options]")
         return
 
-    asin = context.args[0]
+    asins = [asin for asin in context.args[0].split(',') if asin]
     options = context.args[1].split(',') if len(context.args) >= 2 else []
     debug = "debug" in options
-    log_id = f"/offers {asin}"
 
-    driver = None
-    try:
-        # Start a new driver session
-        driver = create_chrome_driver(headless=not debug)
+    # Load cookies to be logged in
+    if not amazon_cookies.exists():
+        await update.message.reply_text("Cookies file not found. Cannot proceed without being logged in.")
+        return
 
-        # Load cookies to be logged in
-        if not os.path.exists(".cookies.pkl"):
-            await update.message.reply_text("Cookies file not found. Cannot proceed without being logged in.")
-            return
-            
-        driver.get(f"https://{amazon_host}/")
-        with open(".cookies.pkl", "rb") as f:
-            cookies = pickle.load(f)
-            for cookie in cookies:
-                if 'domain' in cookie:
-                    del cookie['domain']
-                driver.add_cookie(cookie)
+    await command_jobs.submit(update, context, f"/offers {','.join(asins)}", offers_job, asins, debug)
+
+def offers_job(progress, asins, debug):
+    if len(asins) == 1:
+        return get_offers_message(asins[0], debug)
+
+    # Several ASINs are fetched concurrently, each one on its own pooled driver
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(asins), chrome_pool_size), thread_name_prefix="offers") as executor:
+        futures = [executor.submit(get_offers_message, asin, debug) for asin in asins]
+        messages = []
+        for asin, future in zip(asins, futures):
+            try:
+                messages.append(future.result())
+            except Exception as e:
+                log(f"Could not get offers: {e}", f"/offers {asin}")
+                messages.append(f"Could not get offers for ASIN {asin}: {e}\n")
+    return "\n".join(messages)
 
+def get_offers_message(asin, debug):
+    log_id = f"/offers {asin}"
+    with lease_command_driver(debug, log_id) as driver:
         # First, navigate to the standard product page
         product_url = get_product_url(asin)
+        amazon_limiter.acquire(log_id)
         driver.get(product_url)
-        WebDriverWait(driver, 30).until(
-            lambda d: d.execute_script("return document.readyState == 'complete'")
-        )
+        waits.wait("product_page_load", driver, log_id)
         
         # Add a small delay to mimic human behavior
-        time.sleep(2 + random.uniform(0, 3))
+        waits.wait("offers_humanize", driver, log_id)
 
         # Now, get all offers from the AOD page
         offers = get_all_offers(driver, asin, log_id)
 
         if not offers:
-            await update.message.reply_text(f"No offers found for ASIN {asin}.")
-            return
+            return f"No offers found for ASIN {asin}."
 
         # Format the message
         message = f"Offers for ASIN: {asin}\n\n"
@@ -388,11 +1006,7 @@ async def offers_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 message += "  (Pinned Offer)\n"
             message += "\n"
 
-        await update.message.reply_text(message)
-
-    finally:
-        if driver:
-            driver.quit()
+        return message
 
 
 async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -405,44 +1019,18 @@ async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Could not load products.toml. Please check the logs.")
         return
 
-    new_products_map = {p['asin']: p for p in new_products_list}
-    new_asins = set(new_products_map.keys())
-    current_asins = set(active_threads.keys())
-
-    asins_to_remove = current_asins - new_asins
-    asins_to_add = new_asins - current_asins
-    asins_to_check = current_asins.intersection(new_asins)
-
-    removed_count = 0
-    for asin in asins_to_remove:
-        stop_monitoring_product(asin)
-        removed_count += 1
-    if removed_count > 0:
-        log(f"Stopped monitoring {removed_count} product(s) removed from the file.")
-        await update.message.reply_text(f"Stopped monitoring {removed_count} product(s) removed from the file.")
-
-    added_count = 0
-    for asin in asins_to_add:
-        start_monitoring_product(new_products_map[asin])
-        added_count += 1
-    if added_count > 0:
-        log(f"Started monitoring {added_count} new product(s).")
-        await update.message.reply_text(f"Started monitoring {added_count} new product(s).")
-
-    updated_count = 0
-    for asin in asins_to_check:
-        old_product_data = active_threads[asin].get('product_data')
-        new_product_data = new_products_map[asin]
-
-        if old_product_data != new_product_data:
-            log(f"Product {asin} data has changed. Reloading.")
-            stop_monitoring_product(asin)
-            start_monitoring_product(new_product_data)
-            updated_count += 1
+    # Stopping the removed products waits for their checks to be cancelled, so it doesn't run on the event loop
+    results = await asyncio.get_running_loop().run_in_executor(None, call_monitors, "reload_products", new_products_list)
+    counts = {key: sum(result[key] for result in results) for key in ("removed", "added", "updated", "restarted")}
 
-    if updated_count > 0:
-        log(f"Reloaded {updated_count} product(s) with updated configuration.")
-        await update.message.reply_text(f"Reloaded {updated_count} product(s) with updated configuration.")
+    if counts["removed"] > 0:
+        await update.message.reply_text(f"Stopped monitoring {counts['removed']} product(s) removed from the file.")
+    if counts["added"] > 0:
+        await update.message.reply_text(f"Started monitoring {counts['added']} new product(s).")
+    if counts["updated"] > 0:
+        await update.message.reply_text(f"Updated {counts['updated']} product(s) with the new configuration.")
+    if counts["restarted"] > 0:
+        await update.message.reply_text(f"Restarted {counts['restarted']} product(s) whose seller has changed.")
 
     await update.message.reply_text("Reload complete.")
 
@@ -450,19 +1038,14 @@ async def reload_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def list_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.message:
         return
-    if not active_threads:
+    monitors = [monitor for result in await asyncio.get_running_loop().run_in_executor(None, call_monitors, "get_monitors_list") for monitor in result]
+    if not monitors:
         await update.message.reply_text("No products are currently being monitored.")
         return
 
     message = "Currently monitored products:\n"
-    for asin, thread_info in active_threads.items():
-        product_name = thread_info['thread'].product_name
-        cut_price = thread_info['thread'].cut_price
-        autocheckout = thread_info['thread'].autocheckout
-        autoaddtocart = thread_info['thread'].autoaddtocart
-        interval = thread_info['thread'].interval
-        seller_id = thread_info['thread'].seller_id
-        message += f"- <b>{product_name}</b> (ASIN: {asin}, Cut Price: {cut_price:.2f}, Autoaddtocart: {autoaddtocart}, Autocheckout: {autocheckout}, Interval: {interval}s, Seller ID: {seller_id})\n"
+    for monitor in monitors:
+        message += f"- <b>{monitor['product_name']}</b> (ASIN: {monitor['asin']}, Cut Price: {monitor['cut_price']:.2f}, Autoaddtocart: {monitor['autoaddtocart']}, Autocheckout: {monitor['autocheckout']}, Interval: {monitor['interval']}s, Seller ID: {monitor['seller_id']})\n"
     await update.message.reply_text(message, parse_mode="HTML")
 
 async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -473,39 +1056,221 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     asin = context.args[0]
-    if asin not in active_threads:
-        await update.message.reply_text(f"Product with ASIN {asin} is not currently being monitored.")
+    results = await asyncio.get_running_loop().run_in_executor(None, lambda: call_monitors("get_product_info", asin, asin=asin))
+    if results and results[0]:
+        message = results[0]
+    elif history_store:
+        message = get_stored_history_info(asin)
+    else:
+        message = f"Product with ASIN {asin} is not currently being monitored."
+
+    await update.message.reply_text(message, parse_mode="HTML")
+
+def get_monitors_list():
+    return [
+        {
+            'asin': asin,
+            'product_name': monitor_info['monitor'].product_name,
+            'cut_price': monitor_info['monitor'].cut_price,
+            'autoaddtocart': monitor_info['monitor'].autoaddtocart,
+            'autocheckout': monitor_info['monitor'].autocheckout,
+            'interval': monitor_info['monitor'].interval,
+            'seller_id': monitor_info['monitor'].seller_id,
+        }
+        for asin, monitor_info in list(active_monitors.items())
+    ]
+
+def get_product_info(asin):
+    # None when the product isn't monitored by this process
+    monitor_info = active_monitors.get(asin)
+    if monitor_info is None:
+        return None
+    return get_monitor_info(monitor_info['monitor'])
+
+def get_monitor_info(monitor):
+    # Running aggregates, so this doesn't depend on the length of the price history
+    stats = monitor.price_stats.snapshot()
+    if not stats['count']:
+        return f"No price history available for ASIN {monitor.asin}."
+
+    last_price, last_check_time = stats['last']
+    if monitor.last_check_time:
+        last_price, last_check_time = monitor.last_price, monitor.last_check_time
+
+    message = f"<b>Monitoring data for {monitor.product_name} (ASIN: {monitor.asin}):</b>\n"
+    message += f"Seller ID: {monitor.seller_id}\n"
+    message += f"Cut Price: {monitor.cut_price:.2f} EUR\n"
+    message += f"Last Price: {last_price:.2f} EUR on {last_check_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+    message += f"Max Price: {stats['max'][0]:.2f} EUR on {stats['max'][1].strftime('%Y-%m-%d %H:%M:%S')}\n"
+    message += f"Min Price: {stats['min'][0]:.2f} EUR on {stats['min'][1].strftime('%Y-%m-%d %H:%M:%S')}\n"
+    message += f"Average Price: {stats['avg_price']:.2f} EUR ({stats['count']} price changes)\n"
+    for window_name, (window_low, window_high) in stats['windows'].items():
+        message += f"{window_name} Low/High: {window_low[0]:.2f} EUR since {window_low[1].strftime('%Y-%m-%d %H:%M:%S')} / {window_high[0]:.2f} EUR since {window_high[1].strftime('%Y-%m-%d %H:%M:%S')}\n"
+    return message
+
+def get_stored_history_info(asin):
+    summary = history_store.summary(asin)
+    if not summary:
+        return f"No price history available for ASIN {asin}."
+
+    message = f"<b>Price history for ASIN {asin} (not monitored):</b>\n"
+    message += f"Last Price: {summary['last'][0]:.2f} EUR on {summary['last'][1].strftime('%Y-%m-%d %H:%M:%S')}\n"
+    message += f"Max Price: {summary['max'][0]:.2f} EUR on {summary['max'][1].strftime('%Y-%m-%d %H:%M:%S')}\n"
+    message += f"Min Price: {summary['min'][0]:.2f} EUR on {summary['min'][1].strftime('%Y-%m-%d %H:%M:%S')}\n"
+    message += f"Average Price: {summary['avg_price']:.2f} EUR ({summary['count']} price changes)\n"
+    return message
+
+
+async def pool_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    message = ""
+    for process_stats in await asyncio.get_running_loop().run_in_executor(None, gather_process_stats):
+        message += get_process_title(process_stats)
+        pool_stats = process_stats['pool']
+        message += "<b>Chrome driver pool:</b>\n"
+        message += f"Drivers: {pool_stats['size']}/{pool_stats['max_size']} (in use: {pool_stats['in_use']}, idle: {pool_stats['idle']})\n"
+        message += f"Leases: {pool_stats['leases']} (discarded drivers: {pool_stats['discarded']})\n"
+        message += f"Lease wait: avg {pool_stats['avg_wait_time']:.2f}s, max {pool_stats['max_wait_time']:.2f}s\n"
+        message += f"Utilization: {pool_stats['utilization'] * 100:.1f}%\n"
+        scheduler_stats = process_stats['scheduler']
+        message += "\n<b>Monitor scheduler:</b>\n"
+        message += f"Products: {scheduler_stats['products']} (being checked: {scheduler_stats['running']}/{scheduler_stats['workers']} workers)\n"
+        message += f"Queue lag: last {scheduler_stats['last_lag']:.2f}s, avg {scheduler_stats['avg_lag']:.2f}s, max {scheduler_stats['max_lag']:.2f}s\n"
+        if scheduler_stats['polling_mode'] == "adaptive":
+            message += f"Adaptive polling: {scheduler_stats['planned_rate']:.1f}/{scheduler_stats['budget']:.0f} checks per minute\n"
+        limiter_stats = process_stats['limiter']
+        message += "\n<b>Amazon rate limit:</b>\n"
+        message += f"Rate: {limiter_stats['rate']:.1f}/{limiter_stats['max_rate']:.0f} requests/min, tokens: {limiter_stats['tokens']:.1f}/{limiter_stats['burst']}\n"
+        message += f"Requests: {limiter_stats['requests']}, throttled: {limiter_stats['throttled']} (avg {limiter_stats['avg_throttled_time']:.2f}s)\n"
+        message += f"CAPTCHAs: {limiter_stats['captchas']} ({limiter_stats['captcha_rate'] * 100:.2f}% of the requests, {limiter_stats['captchas_last_hour']} in the last hour)\n"
+        shortlinks_stats = process_stats['shortlinks']
+        message += "\n<b>Shortlink cache:</b>\n"
+        message += f"Shortlinks: {shortlinks_stats['entries']} (being generated: {shortlinks_stats['pending']}), hits: {shortlinks_stats['hits']}, misses: {shortlinks_stats['misses']}\n"
+    if supervisor:
+        message += "\n<b>Shard workers:</b>\n"
+        for worker in supervisor.stats():
+            message += f"- Shard {worker['index']}: {'up' if worker['alive'] else 'DOWN'} (pid {worker['pid']}), uptime {worker['uptime'] / 3600:.1f}h, restarts: {worker['restarts']}\n"
+    for chunk in split_message(message, parse_mode="HTML"):
+        await update.message.reply_text(chunk, parse_mode="HTML")
+
+
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    # The percentiles can't be merged, each process gets its own section
+    all_process_stats = [process_stats for process_stats in await asyncio.get_running_loop().run_in_executor(None, gather_process_stats) if process_stats['phases']]
+    if not all_process_stats:
+        await update.message.reply_text("No checks or commands traced yet.")
+        return
+
+    message = ""
+    for process_stats in all_process_stats:
+        message += get_process_title(process_stats)
+        message += format_traces(process_stats['phases'], process_stats['slowest'])
+    for chunk in split_message(message, parse_mode="HTML"):
+        await update.message.reply_text(chunk, parse_mode="HTML")
+
+def format_traces(phases, slowest):
+    message = "<b>Duration per phase (p50 / p95 / p99):</b>\n"
+    for phase, stats in sorted(phases.items()):
+        message += f"- {phase}: {stats['p50']:.2f}s / {stats['p95']:.2f}s / {stats['p99']:.2f}s ({stats['count']} samples)\n"
+
+    message += "\n<b>Slowest checks and commands:</b>\n"
+    for trace in slowest:
+        breakdown = sorted(trace['spans'].items(), key=lambda item: item[1], reverse=True)
+        # Nested spans (e.g. the fields within "fields") are already part of their parent span
+        other_time = trace['duration'] - sum(duration for phase, duration in breakdown if phase != "queued" and phase not in trace['nested'])
+        breakdown_text = ", ".join(f"{phase} {duration:.1f}s" for phase, duration in breakdown + [("other", max(0.0, other_time))])
+        message += f"- {trace['kind']} {html.escape(trace['name'])} at {datetime.fromtimestamp(trace['start_time']).strftime('%d/%m %H:%M')}: {trace['duration']:.1f}s ({breakdown_text})\n"
+    return message
+
+
+async def selectors_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    # Every process orders the candidates with its own hit rates
+    all_process_stats = [process_stats for process_stats in await asyncio.get_running_loop().run_in_executor(None, gather_process_stats) if process_stats['selectors']]
+    if not all_process_stats:
+        await update.message.reply_text("No selector statistics yet.")
         return
 
-    thread_info = active_threads[asin]
-    monitor_thread = thread_info['thread']
+    message = ""
+    for process_stats in all_process_stats:
+        message += get_process_title(process_stats)
+        message += f"<b>Selectors on {html.escape(xpath_selectors.marketplace)}, in the order they are tried:</b>\n"
+        for field, field_selectors in sorted(process_stats['selectors'].items()):
+            message += f"\n<b>{field}</b>\n"
+            for selector in field_selectors:
+                message += f"- {selector['hit_rate'] * 100:.1f}% hits{' ⚠️ STALE' if selector['stale'] else ''}: <code>{html.escape(selector['xpath'])}</code>\n"
+    for chunk in split_message(message, parse_mode="HTML"):
+        await update.message.reply_text(chunk, parse_mode="HTML")
 
-    last_price = monitor_thread.last_price
-    last_check_time = monitor_thread.last_check_time
-    price_history = monitor_thread.price_history
-    seller_id = monitor_thread.seller_id
 
-    if not price_history:
-        message = f"No price history available for ASIN {asin}."
-    else:
-        # price_history is a list of tuples, so we need to extract the prices for calculations
-        prices = [item[0] for item in price_history]
-        avg_price = sum(prices) / len(prices)
+async def cluster_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    if not cluster:
+        await update.message.reply_text("This bot is not part of a cluster (CLUSTER_DB is not set).")
+        return
+    cluster_stats = await asyncio.get_running_loop().run_in_executor(None, cluster.store.snapshot)
+    message = f"<b>Cluster nodes</b> (this one: {html.escape(cluster.store.node_id)}):\n"
+    for node in cluster_stats['nodes']:
+        message += f"- {html.escape(node['node_id'])}: {'up' if node['alive'] else 'DOWN'} (heartbeat {node['heartbeat_age']:.0f}s ago), {node['products']} product(s), {node['leases']} lease(s)\n"
+    message += f"Notifications waiting to be sent: {cluster_stats['outbox']}\n"
+    await update.message.reply_text(message, parse_mode="HTML")
 
-        # Find min and max with their timestamps
-        min_price_tuple = min(price_history, key=lambda item: item[0])
-        max_price_tuple = max(price_history, key=lambda item: item[0])
 
-        message = f"<b>Monitoring data for {monitor_thread.product_name} (ASIN: {asin}):</b>\n"
-        message += f"Seller ID: {seller_id}\n"
-        message += f"Last Price: {last_price:.2f} EUR on {last_check_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-        message += f"Max Price: {max_price_tuple[0]:.2f} EUR on {max_price_tuple[1].strftime('%Y-%m-%d %H:%M:%S')}\n"
-        message += f"Min Price: {min_price_tuple[0]:.2f} EUR on {min_price_tuple[1].strftime('%Y-%m-%d %H:%M:%S')}\n"
-        message += f"Average Price: {avg_price:.2f} EUR\n"
+async def waits_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if not update.message:
+        return
+    # The waits of all the processes add up
+    wait_stats = {}
+    for process_stats in await asyncio.get_running_loop().run_in_executor(None, gather_process_stats):
+        for name, stats in process_stats['waits'].items():
+            total_stats = wait_stats.setdefault(name, {"count": 0, "total_time": 0.0, "max_time": 0.0, "timeouts": 0})
+            total_stats["count"] += stats["count"]
+            total_stats["total_time"] += stats["total_time"]
+            total_stats["max_time"] = max(total_stats["max_time"], stats["max_time"])
+            total_stats["timeouts"] += stats["timeouts"]
+    if not wait_stats:
+        await update.message.reply_text("No waits recorded yet.")
+        return
 
+    message = "<b>Time spent in wait points:</b>\n"
+    for name, stats in sorted(wait_stats.items(), key=lambda item: item[1]['total_time'], reverse=True):
+        message += f"- {name} ({waits.policies.get(name, {}).get('policy', 'none')}): {stats['total_time']:.1f}s total, {stats['count']} waits, avg {stats['total_time'] / stats['count']:.2f}s, max {stats['max_time']:.2f}s, {stats['timeouts']} timeouts\n"
     await update.message.reply_text(message, parse_mode="HTML")
 
 
+def get_process_stats():
+    # What /pool, /stats, /waits and /selectors show, for this process
+    return {
+        "shard": shard_index,
+        "pool": driver_pool.stats(),
+        "scheduler": scheduler.stats(),
+        "limiter": amazon_limiter.stats(),
+        "shortlinks": shortlinks.stats(),
+        "waits": waits.snapshot(),
+        "phases": tracer.percentiles(),
+        "slowest": tracer.slowest(),
+        "selectors": xpath_selectors.snapshot(),
+    }
+
+def gather_process_stats():
+    # This process, then the shard workers in sharded mode
+    all_process_stats = [get_process_stats()]
+    if supervisor:
+        all_process_stats += sorted(supervisor.call_all("get_process_stats"), key=lambda process_stats: process_stats['shard'])
+    return all_process_stats
+
+def get_process_title(process_stats):
+    if not supervisor:
+        return ""
+    if process_stats['shard'] is None:
+        return "\n<b><u>Telegram process</u></b> (/get, /post, /offers)\n"
+    return f"\n<b><u>Shard {process_stats['shard']}</u></b>\n"
+
 def telegram_bot_main():
     application = Application.builder().token(bot_token).build()
 
@@ -528,38 +1293,473 @@ def telegram_bot_main():
     application.add_handler(CommandHandler("offers", offers_command))
     application.add_handler(CommandHandler("reload", reload_command))
     application.add_handler(CommandHandler("info", info_command))
+    application.add_handler(CommandHandler("pool", pool_command))
+    application.add_handler(CommandHandler("waits", waits_command))
+    application.add_handler(CommandHandler("stats", stats_command))
+    application.add_handler(CommandHandler("selectors", selectors_command))
+    application.add_handler(CommandHandler("cluster", cluster_command))
 
     log("Telegram bot started polling...")
     application.run_polling()
 
+class metrics_registry:
+    """
+    In-process counters and histograms, exposed with the gauges read at scrape time in the Prometheus text format.
+    Updating a metric only takes a short lock around a few additions, so it can be used in the checks' hot path.
+    """
+    DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.descriptions = {} # name -> (type, help)
+        self.counters = {} # name -> {labels: value}
+        self.histograms = {} # name -> (buckets, {labels: [bucket counts..., sum, count]})
+        self.collectors = {} # name -> function returning [(labels dict, value)]
+
+    def describe(self, name, metric_type, help_text, buckets=DEFAULT_BUCKETS):
+        self.descriptions[name] = (metric_type, help_text)
+        if metric_type == "counter":
+            self.counters.setdefault(name, {})
+        elif metric_type == "histogram":
+            self.histograms.setdefault(name, (tuple(buckets), {}))
+
+    def collect(self, name, metric_type, help_text, function):
+        # Gauges (or counters kept elsewhere) whose value is read only when the metrics are scraped
+        self.descriptions[name] = (metric_type, help_text)
+        self.collectors[name] = function
+
+    def inc(self, name, value=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            values = self.counters[name]
+            values[key] = values.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        buckets, series = self.histograms[name]
+        with self.lock:
+            counts = series.get(key)
+            if counts is None:
+                counts = series[key] = [0] * (len(buckets) + 2)
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += value
+            counts[-1] += 1
+
+    @contextlib.contextmanager
+    def time(self, name, **labels):
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start_time, **labels)
+
+    def render(self):
+        def format_labels(labels):
+            if not labels:
+                return ""
+            escaped = [(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels]
+            return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+        with self.lock:
+            counters = {name: dict(values) for name, values in self.counters.items()}
+            histograms = {name: (buckets, {key: list(counts) for key, counts in series.items()}) for name, (buckets, series) in self.histograms.items()}
+
+        lines = []
+        for name, (metric_type, help_text) in self.descriptions.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if name in self.collectors:
+                try:
+                    samples = [(tuple(sorted(labels.items())), value) for labels, value in self.collectors[name]()]
+                except Exception as e:
+                    log(f"Could not collect metric {name}: {e}")
+                    samples = []
+                for key, value in samples:
+                    if value is not None:
+                        lines.append(f"{name}{format_labels(key)} {value}")
+            elif name in counters:
+                for key, value in counters[name].items():
+                    lines.append(f"{name}{format_labels(key)} {value}")
+            elif name in histograms:
+                buckets, series = histograms[name]
+                for key, counts in series.items():
+                    for bound, count in zip(buckets, counts):
+                        lines.append(f"{name}_bucket{format_labels(key + (('le', bound),))} {count}")
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {counts[-1]}")
+                    lines.append(f"{name}_sum{format_labels(key)} {counts[-2]}")
+                    lines.append(f"{name}_count{format_labels(key)} {counts[-1]}")
+        return "\n".join(lines) + "\n"
+
+class span_tracer:
+    """
+    Lightweight tracing of the product checks and of the Telegram commands: each phase is a span of the trace of the current thread.
+    Keeps the last durations of each phase for percentiles, and the slowest max_slow_traces traces with their breakdown.
+    """
+    def __init__(self, max_slow_traces=10, max_samples=1000):
+        self.max_slow_traces = max_slow_traces
+        self.max_samples = max_samples
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.samples = {} # phase -> deque of durations
+        self.slow_traces = [] # min-heap of (duration, seq, trace)
+        self.seq = itertools.count()
+
+    @contextlib.contextmanager
+    def trace(self, kind, name):
+        current = {"kind": kind, "name": name, "start_time": time.time(), "spans": {}, "nested": set()}
+        self.local.trace = current
+        self.local.depth = 0
+        try:
+            yield current
+        finally:
+            self.local.trace = None
+            current["duration"] = time.time() - current["start_time"]
+            self._finish(current)
+
+    @contextlib.contextmanager
+    def span(self, phase):
+        depth = getattr(self.local, "depth", 0)
+        self.local.depth = depth + 1
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            self.local.depth = depth
+            self.record(phase, time.time() - start_time, nested=depth > 0)
+
+    def record(self, phase, duration, nested=False):
+        # Outside of a trace (e.g. the background shortlink prefill) spans are not recorded
+        current = getattr(self.local, "trace", None)
+        if current is not None:
+            current["spans"][phase] = current["spans"].get(phase, 0.0) + duration
+            if nested:
+                current["nested"].add(phase)
+
+    def _finish(self, current):
+        with self.lock:
+            for phase, duration in list(current["spans"].items()) + [(f"{current['kind']} total", current["duration"])]:
+                phase_samples = self.samples.get(phase)
+                if phase_samples is None:
+                    phase_samples = self.samples[phase] = collections.deque(maxlen=self.max_samples)
+                phase_samples.append(duration)
+            entry = (current["duration"], next(self.seq), current)
+            if len(self.slow_traces) < self.max_slow_traces:
+                heapq.heappush(self.slow_traces, entry)
+            elif entry[0] > self.slow_traces[0][0]:
+                heapq.heapreplace(self.slow_traces, entry)
+
+    def percentiles(self):
+        with self.lock:
+            samples = {phase: sorted(phase_samples) for phase, phase_samples in self.samples.items()}
+        return {
+            phase: {
+                "count": len(durations),
+                "p50": durations[len(durations) // 2],
+                "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                "p99": durations[min(len(durations) - 1, int(len(durations) * 0.99))],
+            }
+            for phase, durations in samples.items()
+        }
+
+    def slowest(self):
+        with self.lock:
+            return [entry[2] for entry in sorted(self.slow_traces, key=lambda entry: entry[:2], reverse=True)]
+
+@contextlib.contextmanager
+def scrape_step(asin, step):
+    with tracer.span(step), metrics.time("pricesdrop_scrape_step_seconds", asin=asin, step=step):
+        yield
+
+def process_rss_bytes():
+    # Linux only, the metric is left out elsewhere
+    try:
+        with open("/proc/self/statm", 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+def register_metrics():
+    metrics.describe("pricesdrop_scrape_step_seconds", "histogram", "Time spent in each step of a product page scrape.")
+    metrics.describe("pricesdrop_check_seconds", "histogram", "Duration of a product check.")
+    metrics.describe("pricesdrop_rufus_total", "counter", "RufusAI lookups by result (cached, success, failure).")
+    metrics.describe("pricesdrop_shortlink_generation_total", "counter", "SiteStripe shortlink generations by result (success, failure).")
+    metrics.describe("pricesdrop_telegram_send_latency_seconds", "histogram", "Time from queueing a Telegram notification to its delivery.")
+    metrics.collect("pricesdrop_check_lag_seconds", "gauge", "Time between the last two checks of a product minus its interval.",
+                    lambda: [({"asin": asin}, lag) for asin, lag in scheduler.check_lags_snapshot().items()])
+    metrics.collect("pricesdrop_monitored_products", "gauge", "Products being monitored.", lambda: [({}, scheduler.stats()["products"])])
+    metrics.collect("pricesdrop_chrome_drivers", "gauge", "Pooled Chrome drivers by state (in_use, idle).",
+                    lambda: [({"state": "in_use"}, driver_pool.stats()["in_use"]), ({"state": "idle"}, driver_pool.stats()["idle"])])
+    metrics.collect("pricesdrop_threads", "gauge", "Threads of the process.", lambda: [({}, threading.active_count())])
+    metrics.collect("pricesdrop_amazon_requests_total", "counter", "Page loads and HTTP requests to Amazon.", lambda: [({}, amazon_limiter.stats()["requests"])])
+    metrics.collect("pricesdrop_captchas_total", "counter", "CAPTCHAs returned by Amazon.", lambda: [({}, amazon_limiter.stats()["captchas"])])
+    metrics.collect("pricesdrop_amazon_rate_limit", "gauge", "Current Amazon rate limit in requests per minute.", lambda: [({}, amazon_limiter.stats()["rate"])])
+    metrics.collect("pricesdrop_shortlink_cache_total", "counter", "Shortlink cache lookups by result (hit, miss).",
+                    lambda: [({"result": "hit"}, shortlinks.stats()["hits"]), ({"result": "miss"}, shortlinks.stats()["misses"])])
+    metrics.collect("pricesdrop_telegram_notifications_total", "counter", "Telegram notifications by result (sent, failed, dropped).",
+                    lambda: [({"result": result}, notifier.stats()[result]) for result in ["sent", "failed", "dropped"]])
+    metrics.collect("process_resident_memory_bytes", "gauge", "Resident memory size in bytes.", lambda: [({}, process_rss_bytes())])
+
+def start_metrics_server(host, port):
+    class metrics_handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = metrics.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer((host, port), metrics_handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    log(f"Metrics available at http://{host}:{server.server_address[1]}/metrics")
+    return server
+
 def send_telegram_notification(message, image_url=None, log_id=None):
-    if bot_token and chat_id:
+    # Queued, the monitors never wait for the Telegram API. Shard workers hand them to the Telegram process
+    if shard_events is not None:
+        shard_events.put(("notification", message, image_url, log_id))
+        return True
+    if cluster and not cluster.is_sender:
+        cluster.store.push_notification(message, image_url, log_id)
+        return True
+    return notifier.send(message, image_url=image_url, log_id=log_id)
+
+class telegram_notifier:
+    """
+    Bounded queue of outbound Telegram notifications, drained by a dedicated sender thread over a keep-alive session.
+    Honors the retry_after of 429 replies and retries network and server errors with exponential backoff.
+    """
+    def __init__(self, bot_token, chat_id, api_url="https://api.telegram.org", max_queue_size=1000, max_retries=5, timeout=15, log_sent=True):
+        self.bot_token = bot_token
+        self.log_sent = log_sent
+        self.chat_id = chat_id
+        self.api_url = api_url.rstrip("/")
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.session = requests.Session()
+        self.session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=2))
+        self.stats_lock = threading.Lock()
+        self.sent_count = 0
+        self.failed_count = 0
+        self.dropped_count = 0
+        self.retries_count = 0
+        self.latencies = collections.deque(maxlen=1000)
+        self.sender = threading.Thread(target=self._sender_loop, name="telegram-sender", daemon=True)
+        self.sender.start()
+
+    def send(self, message, image_url=None, log_id=None):
+        if not (self.bot_token and self.chat_id):
+            log("Telegram bot token or chat ID not configured. Skipping notification.", log_id)
+            return False
+        try:
+            self.queue.put_nowait((time.time(), message, image_url, log_id))
+        except queue.Full:
+            with self.stats_lock:
+                self.dropped_count += 1
+            log(f"Telegram notification queue is full ({self.queue.maxsize}), dropping notification.", log_id)
+            return False
+        return True
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self, timeout=None):
+        # The notifications still queued after timeout seconds are lost
+        self.queue.put(None)
+        self.sender.join(timeout)
+        if self.sender.is_alive():
+            log(f"Telegram notifications not sent before shutting down: {self.queue.qsize()}.")
+
+    def _sender_loop(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    break
+                enqueued_time, message, image_url, log_id = item
+                sent = self._deliver(message, image_url, log_id)
+                with self.stats_lock:
+                    if sent:
+                        self.sent_count += 1
+                        self.latencies.append(time.time() - enqueued_time)
+                        metrics.observe("pricesdrop_telegram_send_latency_seconds", time.time() - enqueued_time)
+                    else:
+                        self.failed_count += 1
+            except Exception as e:
+                log(f"An error occurred while sending Telegram notification: {e}")
+            finally:
+                self.queue.task_done()
+
+    def _deliver(self, message, image_url, log_id):
         if image_url:
-            url = f"https://api.telegram.org/bot{bot_token}/sendPhoto"
+            url = f"{self.api_url}/bot{self.bot_token}/sendPhoto"
             payload = {
-                "chat_id": chat_id,
+                "chat_id": self.chat_id,
                 "photo": image_url,
                 "caption": message,
                 "parse_mode": "HTML"
             }
         else:
-            url = f"https://api.telegram.org/bot{bot_token}/sendMessage"
+            url = f"{self.api_url}/bot{self.bot_token}/sendMessage"
             payload = {
-                "chat_id": chat_id,
+                "chat_id": self.chat_id,
                 "text": message,
                 "parse_mode": "HTML"
             }
-        try:
-            response = requests.post(url, json=payload)
-            if response.status_code == 200:
-                log("Telegram notification sent successfully.", log_id)
+
+        backoff = 1.0
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                with self.stats_lock:
+                    self.retries_count += 1
+            try:
+                response = self.session.post(url, json=payload, timeout=self.timeout)
+            except requests.RequestException as e:
+                log(f"An error occurred while sending Telegram notification: {e}", log_id)
             else:
+                if response.status_code == 200:
+                    if self.log_sent:
+                        log("Telegram notification sent successfully.", log_id)
+                    return True
+                if response.status_code == 429:
+                    try:
+                        retry_after = float(response.json().get("parameters", {}).get("retry_after", backoff))
+                    except ValueError:
+                        retry_after = backoff
+                    log(f"Telegram rate limit hit, retrying in {retry_after:.0f}s.", log_id)
+                    time.sleep(retry_after)
+                    continue
                 log(f"Failed to send Telegram notification. Status code: {response.status_code}, Response: {response.text}", log_id)
-        except Exception as e:
-            log(f"An error occurred while sending Telegram notification: {e}", log_id)
-    else:
-        log("Telegram bot token or chat ID not configured. Skipping notification.", log_id)
+                if response.status_code < 500:
+                    return False # Client errors won't get any better by retrying
+            time.sleep(backoff + random.uniform(0, backoff / 2))
+            backoff = min(backoff * 2, 60)
+
+        log(f"Giving up sending Telegram notification after {self.max_retries + 1} attempts.", log_id)
+        return False
+
+    def stats(self):
+        with self.stats_lock:
+            latencies = sorted(self.latencies)
+            return {
+                "queued": self.queue.qsize(),
+                "sent": self.sent_count,
+                "failed": self.failed_count,
+                "dropped": self.dropped_count,
+                "retries": self.retries_count,
+                "latency_p50": latencies[len(latencies) // 2] if latencies else 0.0,
+                "latency_p95": latencies[int(len(latencies) * 0.95)] if latencies else 0.0,
+                "latency_max": latencies[-1] if latencies else 0.0,
+            }
+
+def run_notification_benchmark(count=500, stub_latency=0.02, rate_limit_every=50):
+    """
+    Sends count notifications through a telegram_notifier to a local stub of the Telegram Bot API,
+    which answers after stub_latency seconds and replies 429 (retry_after=1) to one request every rate_limit_every.
+    """
+    requests_count = itertools.count(1)
+
+    class stub_handler(http.server.BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            time.sleep(stub_latency)
+            if rate_limit_every and next(requests_count) % rate_limit_every == 0:
+                status, body = 429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 1}}
+            else:
+                status, body = 200, {"ok": True, "result": {}}
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), stub_handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        benchmark_notifier = telegram_notifier("benchmark-token", "benchmark-chat", api_url=f"http://127.0.0.1:{server.server_address[1]}", max_queue_size=count, log_sent=False)
+        start_time = time.time()
+        for i in range(count):
+            benchmark_notifier.send(f"Benchmark notification #{i}")
+        benchmark_notifier.flush()
+        elapsed_time = time.time() - start_time
+        benchmark_stats = benchmark_notifier.stats()
+        benchmark_notifier.close()
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    log(f"Notification benchmark: {benchmark_stats['sent']}/{count} sent in {elapsed_time:.2f}s ({benchmark_stats['sent'] / elapsed_time:.1f} notifications/s), {benchmark_stats['retries']} retries, {benchmark_stats['failed']} failed")
+    log(f"End-to-end latency: p50 {benchmark_stats['latency_p50']:.3f}s, p95 {benchmark_stats['latency_p95']:.3f}s, max {benchmark_stats['latency_max']:.3f}s")
+    return benchmark_stats
+
+
+def run_browser_profile_benchmark(asins, rounds=3):
+    """
+    Loads the product page of each ASIN rounds times with the full and the lean browser profiles, and compares
+    the bytes transferred (as reported by Chrome's network log) and the time from navigation to the buy box price.
+    """
+    price_xpath = " | ".join(container + PRICE_WHOLE_XPATH[1:] for container in MAIN_OFFER_CONTAINER_XPATHS)
+    results = {}
+    for profile in ["full", "lean"]:
+        driver = create_chrome_driver(profile=profile, log_network=True)
+        try:
+            if amazon_cookies.exists():
+                amazon_cookies.apply_to_driver(driver)
+            driver.get_log("performance") # Discard the events of the browser startup
+            results[profile] = {"pages": 0, "bytes": 0, "requests": 0, "blocked": 0, "time_to_price": [], "missing_price": 0}
+            for round_number in range(rounds):
+                for asin in asins:
+                    start_time = time.time()
+                    driver.get(get_product_url(asin))
+                    try:
+                        WebDriverWait(driver, 30, poll_frequency=0.05).until(lambda d: d.find_elements(By.XPATH, price_xpath))
+                        results[profile]["time_to_price"].append(time.time() - start_time)
+                    except TimeoutException:
+                        results[profile]["missing_price"] += 1
+                    # Let the page finish whatever it still loads in the background, so that its bytes are counted too
+                    try:
+                        waits._wait_network_idle(driver, {"idle_time": 1.0, "timeout": 30})
+                    except TimeoutException:
+                        pass
+                    results[profile]["pages"] += 1
+                    for entry in driver.get_log("performance"):
+                        event = json.loads(entry["message"])["message"]
+                        if event["method"] == "Network.requestWillBeSent":
+                            results[profile]["requests"] += 1
+                        elif event["method"] == "Network.loadingFinished":
+                            results[profile]["bytes"] += event["params"].get("encodedDataLength", 0)
+                        elif event["method"] == "Network.loadingFailed" and event["params"].get("blockedReason"):
+                            results[profile]["blocked"] += 1
+                    driver.get("about:blank")
+                    driver.get_log("performance")
+        finally:
+            driver.quit()
 
+    for profile, profile_results in results.items():
+        times = sorted(profile_results["time_to_price"])
+        pages = max(1, profile_results["pages"])
+        p50 = f"{times[len(times) // 2]:.2f}s" if times else "n/a"
+        p95 = f"{times[min(len(times) - 1, int(len(times) * 0.95))]:.2f}s" if times else "n/a"
+        log(f"Browser profile '{profile}': {profile_results['bytes'] / pages / 1024:.0f} KiB and {profile_results['requests'] / pages:.0f} requests per page ({profile_results['blocked'] / pages:.0f} blocked), time to price p50 {p50}, p95 {p95}, {profile_results['missing_price']} pages without price")
+    return results
 
 def get_product_info_from_rufus(driver, log_id, asin):
     ai_product_data = {}
@@ -578,6 +1778,12 @@ def get_product_info_from_rufus(driver, log_id, asin):
         key = f"product_{info}_ai"
         ai_product_data[key] = None
 
+    # Brand, name, description and items count almost never change, they aren't asked again while the cached answer is fresh.
+    # Who sells and ships the product depends on the offer in the buy box, so it is asked every time
+    cached_product_data = {key: value for key, value in (rufus_cache.get(asin) or {}).items() if key in RUFUS_CACHED_FIELDS}
+    ai_product_data |= cached_product_data
+    request_mapping = {info: query for info, query in request_mapping.items() if f"product_{info}_ai" not in cached_product_data}
+
     list_expected_replies = []
     for info, query in request_mapping.items():
         reply_format = f"{info} : <{query}>"
@@ -628,66 +1834,181 @@ def get_product_info_from_rufus(driver, log_id, asin):
 
             # Wait for the answer element to be visible
             WebDriverWait(driver, 15).until(
-                EC.visibility_of_element_located((By.XPATH, '(//div[@class="rufus-sections-container" and @data-section-class="TextSubsections"])[last()]//div[@role="region"]'))
+                EC.visibility_of_element_located((By.XPATH, RUFUS_ANSWER_XPATH))
             )
-            # Wait for the text to be fully populated
-            time.sleep(5)
-            # Retrieve the answer by re-finding the element
-            answer_text = driver.find_element(By.XPATH, '(//div[@class="rufus-sections-container" and @data-section-class="TextSubsections"])[last()]//div[@role="region"]').get_attribute("aria-label")
+            # The answer is streamed, wait for its text to stop changing
+            answer_text = wait_for_stable_attribute(driver, RUFUS_ANSWER_XPATH, "aria-label") or ""
             #log(f"RufusAI reply (attempts #{attempts})> {answer_text}", log_id)
 
             all_answer_texts += [answer_text]
 
+    except operation_cancelled:
+        raise
     except Exception as e:
         save_debug_html(driver, e, "rufus_ai", asin, log_id)
         log(f"Could not get info from RufusAI: {e}", log_id)
+        metrics.inc("pricesdrop_rufus_total", result="failure")
 
     else:
         for reply in answer_text.split(reply_sep):
+            if ' : ' not in reply:
+                continue
             info, value = reply.split(' : ', 1)
-            key = f"product_{info}_ai"
-            ai_product_data[key] = value
+            key = f"product_{info.strip()}_ai"
+            if key in ai_product_data:
+                ai_product_data[key] = value
+        if all(value is not None for value in ai_product_data.values()):
+            if not cached_product_data:
+                rufus_cache.put(asin, {key: ai_product_data[key] for key in RUFUS_CACHED_FIELDS})
+            metrics.inc("pricesdrop_rufus_total", result="cached" if cached_product_data else "success")
+        else:
+            metrics.inc("pricesdrop_rufus_total", result="failure")
 
     return ai_product_data
 
-def get_all_offers(driver, asin, log_id):
+RUFUS_CACHED_FIELDS = ["product_brand_ai", "product_name_ai", "product_description_ai", "product_items_count_ai"]
+RUFUS_ANSWER_XPATH = '(//div[@class="rufus-sections-container" and @data-section-class="TextSubsections"])[last()]//div[@role="region"]'
+
+def wait_for_stable_attribute(driver, xpath, attribute, stable_time=1.5, poll_interval=0.5, timeout=20):
+    # Returns the attribute value once it has stayed the same for stable_time seconds (or the last value on timeout)
+    deadline = time.time() + timeout
+    last_value = None
+    last_change_time = time.time()
+    while time.time() < deadline:
+        try:
+            value = driver.find_element(By.XPATH, xpath).get_attribute(attribute)
+        except NoSuchElementException:
+            value = None
+        if value != last_value:
+            last_value = value
+            last_change_time = time.time()
+        elif value and time.time() - last_change_time >= stable_time:
+            break
+        if current_cancel_event().wait(poll_interval):
+            raise operation_cancelled(f"Cancelled while waiting for the {attribute} attribute to settle")
+    return last_value
+
+class rufus_answer_cache:
+    """
+    Persistent per-ASIN cache of the parsed RufusAI answers, with a TTL and LRU eviction.
+    """
+    def __init__(self, path, ttl, max_entries):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.entries = None
+        self.hits_count = 0
+        self.misses_count = 0
+
+    def _load(self):
+        # Called with the lock held
+        if self.entries is not None:
+            return
+        self.entries = collections.OrderedDict()
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries.update(json.load(f))
+            except Exception as e:
+                log(f"Could not load RufusAI cache from {self.path}: {e}")
+
+    def get(self, asin):
+        with self.lock:
+            self._load()
+            entry = self.entries.get(asin)
+            if entry and time.time() - entry['time'] > self.ttl:
+                del self.entries[asin]
+                entry = None
+            if not entry:
+                self.misses_count += 1
+                return None
+            self.entries.move_to_end(asin)
+            self.hits_count += 1
+            return dict(entry['answer'])
+
+    def put(self, asin, answer):
+        with self.lock:
+            self._load()
+            self.entries[asin] = {'time': time.time(), 'answer': dict(answer)}
+            self.entries.move_to_end(asin)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                log(f"Could not save RufusAI cache to {self.path}: {e}")
+
+AOD_PINNED_OFFER_ID = "aod-pinned-offer"
+AOD_PINNED_OFFER_SHOW_MORE_ID = "aod-pinned-offer-show-more-link"
+AOD_PINNED_OFFER_ADDITIONAL_CONTENT_ID = "aod-pinned-offer-additional-content"
+AOD_OFFERS_XPATH = "//div[@id='aod-offer-list']//div[contains(@class, 'aod-information-block') and @role='listitem']"
+AOD_CONDITION_XPATH = ".//div[@id='aod-offer-heading']//span"
+AOD_SOLD_BY_XPATH = ".//div[@id='aod-offer-soldBy']//a"
+AOD_SHIPS_FROM_XPATH = ".//div[@id='aod-offer-shipsFrom']//span[@class='a-size-small a-color-base']"
+
+def get_all_offers(driver, asin, log_id, aod_url=None, resources=None):
     """
     Fetches and parses all offers for a given ASIN from the All Offers Display page.
     """
+    resources = resources or default_scrape_resources()
     log(f"Getting all offers for {asin} from AOD page.", log_id)
-    aod_url = f"https://{amazon_host}/gp/product/ajax/aodAjaxMain?asin={asin}&pc=dp"
-    driver.get(aod_url)
-    WebDriverWait(driver, 30).until(
-        lambda d: d.execute_script("return document.readyState == 'complete'")
-    )
-
+    aod_url = aod_url or f"https://{amazon_host}/gp/product/ajax/aodAjaxMain?asin={asin}&pc=dp"
+    with scrape_step(asin, "rate_limit"):
+        resources.limiter.acquire(log_id)
+    with scrape_step(asin, "aod_page_load"):
+        driver.get(aod_url)
+        resources.waits.wait("aod_page_load", driver, log_id)
+
+    with scrape_step(asin, "aod_offers"):
+        return parse_offers_with_engine(driver, asin, log_id, resources)
+
+def parse_offers_with_engine(driver, asin, log_id, resources=None):
+    if scrape_engine == "script":
+        return parse_all_offers_script(driver, asin, log_id, resources)
+    if scrape_engine == "compare":
+        start_time = time.time()
+        webdriver_offers = parse_all_offers(driver, asin, log_id, resources)
+        webdriver_time = time.time() - start_time
+        start_time = time.time()
+        script_offers = parse_all_offers_script(driver, asin, log_id, resources)
+        script_time = time.time() - start_time
+        log(f"AOD scrape engines timing: webdriver {webdriver_time:.3f}s, script {script_time:.3f}s ({webdriver_time / max(script_time, 1e-6):.1f}x){'' if webdriver_offers == script_offers else f', MISMATCH: {webdriver_offers!r} / {script_offers!r}'}", log_id)
+        return script_offers
+    return parse_all_offers(driver, asin, log_id, resources)
+
+def parse_all_offers(driver, asin, log_id, resources=None):
     offers = []
 
     def parse_offer(offer_element):
         offer_data = {}
         try:
-            price_whole_str = offer_element.find_element(by=By.XPATH, value=".//span[contains(@class, 'a-price-whole')]").text.replace('.', '').replace(',', '')
+            price_whole_str = offer_element.find_element(by=By.XPATH, value=PRICE_WHOLE_XPATH).text
             try:
-                price_fraction_str = offer_element.find_element(by=By.XPATH, value=".//span[contains(@class, 'a-price-fraction')]").text
-                offer_data['price'] = float(f"{price_whole_str}.{price_fraction_str}")
+                price_fraction_str = offer_element.find_element(by=By.XPATH, value=PRICE_FRACTION_XPATH).text
             except NoSuchElementException:
-                offer_data['price'] = float(price_whole_str)
+                price_fraction_str = None
+            offer_data['price'] = parse_price(price_whole_str, price_fraction_str)
 
             try:
-                offer_data['condition'] = offer_element.find_element(By.XPATH, ".//div[@id='aod-offer-heading']//span").text.strip()
+                offer_data['condition'] = offer_element.find_element(By.XPATH, AOD_CONDITION_XPATH).text.strip()
             except NoSuchElementException:
                 offer_data['condition'] = "N/A"
             
             offer_data['sold_by'] = "N/A"
             try:
-                sold_by_element = offer_element.find_element(By.XPATH, ".//div[@id='aod-offer-soldBy']//a")
+                sold_by_element = offer_element.find_element(By.XPATH, AOD_SOLD_BY_XPATH)
                 offer_data['sold_by'] = sold_by_element.text.strip()
             except NoSuchElementException:
                 pass
 
             offer_data['ships_from'] = "N/A"
             try:
-                ships_from_element = offer_element.find_element(By.XPATH, ".//div[@id='aod-offer-shipsFrom']//span[@class='a-size-small a-color-base']")
+                ships_from_element = offer_element.find_element(By.XPATH, AOD_SHIPS_FROM_XPATH)
                 offer_data['ships_from'] = ships_from_element.text.strip()
             except NoSuchElementException:
                 pass
@@ -699,14 +2020,14 @@ def get_all_offers(driver, asin, log_id):
 
     # Pinned offer
     try:
-        pinned_offer_element = driver.find_element(By.ID, "aod-pinned-offer")
+        pinned_offer_element = driver.find_element(By.ID, AOD_PINNED_OFFER_ID)
         
         # Click "See more" to reveal seller and shipper info
         try:
-            see_more_link = pinned_offer_element.find_element(By.ID, "aod-pinned-offer-show-more-link")
+            see_more_link = pinned_offer_element.find_element(By.ID, AOD_PINNED_OFFER_SHOW_MORE_ID)
             see_more_link.click()
             WebDriverWait(driver, 5).until(
-                EC.visibility_of_element_located((By.ID, "aod-pinned-offer-additional-content"))
+                EC.visibility_of_element_located((By.ID, AOD_PINNED_OFFER_ADDITIONAL_CONTENT_ID))
             )
         except NoSuchElementException:
             pass # If "See more" is not present, continue
@@ -717,11 +2038,11 @@ def get_all_offers(driver, asin, log_id):
             offers.append(pinned_offer_data)
     except NoSuchElementException as e:
         log("No pinned offer found on AOD page.", log_id)
-        save_debug_html(driver, e, "pinned_offer_not_found", asin, log_id)
+        save_debug_html(driver, e, "pinned_offer_not_found", asin, log_id, resources)
 
     # Other offers
     try:
-        offer_elements = driver.find_elements(By.XPATH, "//div[@id='aod-offer-list']//div[contains(@class, 'aod-information-block') and @role='listitem']")
+        offer_elements = driver.find_elements(By.XPATH, AOD_OFFERS_XPATH)
         for offer_element in offer_elements:
             offer_data = parse_offer(offer_element)
             if offer_data:
@@ -732,14 +2053,125 @@ def get_all_offers(driver, asin, log_id):
 
     return offers
 
-def scrape_product_data(driver, product_url, log_id, asin, use_rufus_ai=False):
-    driver.get(product_url)
-    WebDriverWait(driver, 30).until(
-        lambda driver: driver.execute_script("return document.readyState == 'complete'")
-    )
-    handle_captcha(driver, log_id)
+# Reads every AOD offer in a single WebDriver round trip. Hidden nodes (e.g. the collapsed details of the pinned offer)
+# have an empty innerText, so textContent is used for them.
+AOD_OFFERS_SCRIPT = """
+const spec = arguments[0];
+function find(xpath, context) {
+    try {
+        return document.evaluate(xpath, context, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    } catch (e) {
+        return null;
+    }
+}
+function text(node) {
+    return node ? (node.innerText || node.textContent || "").trim() : null;
+}
+function parse(container, isPinned) {
+    return {
+        price_whole: text(find(spec.price_whole, container)),
+        price_fraction: text(find(spec.price_fraction, container)),
+        condition: text(find(spec.condition, container)),
+        sold_by: text(find(spec.sold_by, container)),
+        ships_from: text(find(spec.ships_from, container)),
+        is_pinned: isPinned,
+    };
+}
+const offers = [];
+const pinned = document.getElementById(spec.pinned_offer_id);
+if (pinned) {
+    const seeMore = document.getElementById(spec.pinned_offer_show_more_id);
+    if (seeMore) {
+        seeMore.click();
+    }
+    offers.push(parse(pinned, true));
+}
+const others = document.evaluate(spec.offers, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null);
+for (let i = 0; i < others.snapshotLength; i++) {
+    offers.push(parse(others.snapshotItem(i), false));
+}
+return {has_pinned: pinned !== null, offers: offers};
+"""
+
+def parse_all_offers_script(driver, asin, log_id, resources=None):
+    result = driver.execute_script(AOD_OFFERS_SCRIPT, {
+        "pinned_offer_id": AOD_PINNED_OFFER_ID,
+        "pinned_offer_show_more_id": AOD_PINNED_OFFER_SHOW_MORE_ID,
+        "offers": AOD_OFFERS_XPATH,
+        "price_whole": PRICE_WHOLE_XPATH,
+        "price_fraction": PRICE_FRACTION_XPATH,
+        "condition": AOD_CONDITION_XPATH,
+        "sold_by": AOD_SOLD_BY_XPATH,
+        "ships_from": AOD_SHIPS_FROM_XPATH,
+    })
+
+    if not result["has_pinned"]:
+        log("No pinned offer found on AOD page.", log_id)
+        try:
+            raise NoSuchElementException(f"Could not find the pinned offer with ID: {AOD_PINNED_OFFER_ID}")
+        except NoSuchElementException as e:
+            save_debug_html(driver, e, "pinned_offer_not_found", asin, log_id, resources)
+
+    offers = []
+    for raw_offer in result["offers"]:
+        try:
+            if raw_offer["price_whole"] is None:
+                raise ValueError("price not found")
+            price = parse_price(raw_offer["price_whole"], raw_offer["price_fraction"])
+        except ValueError as e:
+            log(f"Error parsing an offer: {e}", log_id)
+            continue
+        offers.append({
+            'price': price,
+            'condition': raw_offer["condition"] if raw_offer["condition"] is not None else "N/A",
+            'sold_by': raw_offer["sold_by"] if raw_offer["sold_by"] is not None else "N/A",
+            'ships_from': raw_offer["ships_from"] if raw_offer["ships_from"] is not None else "N/A",
+            'is_pinned': raw_offer["is_pinned"],
+        })
+    return offers
 
-    scraped_data = {
+ITEMS_COUNT_XPATHS = [
+    "//tr[contains(@class, 'po-number_of_items')]/td[2]/span",
+    "//div[contains(@data-feature-name, 'metaData') and .//span[contains(text(), 'Numero di articoli')]]//span[@class='a-size-base a-color-tertiary']",
+    "//div[contains(@data-feature-name, 'metaData') and .//span[contains(text(), 'Number of Items')]]//span[@class='a-size-base a-color-tertiary']",
+    "//div[@id='detailBullets_feature_div']//span[contains(text(), 'Numero di articoli')]/following-sibling::span",
+    "//div[@id='detailBullets_feature_div']//span[contains(text(), 'Number of Items')]/following-sibling::span"
+]
+IMAGE_XPATHS = [
+    "//img[@id='landingImage']",
+    "//img[@id='imgBlkFront']",
+    "//div[contains(@class, 'imgTagWrapper')]/img"
+]
+UNAVAILABLE_XPATHS = [
+    "//div[@id='availability']//span[contains(text(), 'Attualmente non disponibile')]",
+    "//div[@id='availability']//span[contains(text(), 'Currently unavailable')]",
+    "//div[@id='availability']//span[contains(text(), 'Non disponibile')]",
+    "//div[@id='outOfStock']",
+]
+MAIN_OFFER_CONTAINER_XPATHS = [
+    "//div[@id='qualifiedBuybox']",
+    "//div[@id='newAccordionRow_0']",
+    "//div[@id='newAccordionRow_1']",
+    "//div[@data-a-accordion-row-name='newAccordionRow']"
+]
+PRODUCT_TITLE_XPATH = "//*[@id='productTitle']"
+MERCHANT_INFO_XPATH = "//*[@id='merchant-info']"
+SOLD_BY_XPATH = "//div[@tabular-attribute-name='Venduto da']//span"
+SHIPS_FROM_XPATH = "//div[@tabular-attribute-name='Spedito da']//span"
+DELIVERY_COST_XPATH = "//div[@id='deliveryBlockMessage']//span[@data-csa-c-delivery-price]"
+PRICE_WHOLE_XPATH = ".//span[contains(@class, 'a-price-whole')]"
+PRICE_FRACTION_XPATH = ".//span[contains(@class, 'a-price-fraction')]"
+USED_CONDITION_XPATH = ".//*[contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'usato')] | .//*[contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'used')] "
+CAPTCHA_XPATH = "//h4[contains(text(), 'Fai clic sul pulsante qui sotto per continuare a fare acquisti')] | //h4[contains(text(), 'Type the characters you see in this image')] | //h4[contains(text(), 'Click the button below to continue shopping')] "
+
+# With the lean browser profile the page load isn't waited for: scrape as soon as the buy box (or what replaces it) exists
+LEAN_WAIT_POLICIES = {
+    "product_page_load": {"policy": "dom", "xpath": " | ".join(MAIN_OFFER_CONTAINER_XPATHS + UNAVAILABLE_XPATHS + [CAPTCHA_XPATH]), "timeout": 30},
+    "aod_page_load": {"policy": "dom", "xpath": f"//div[@id='{AOD_PINNED_OFFER_ID}'] | //div[@id='aod-offer-list']", "timeout": 30},
+}
+
+def new_scraped_data():
+    return {
         "product_name": "",
         "items_count": 1,
         "product_image_url": None,
@@ -753,179 +2185,610 @@ def scrape_product_data(driver, product_url, log_id, asin, use_rufus_ai=False):
         "offer_container": None,
     }
 
-    # Get product name
-    try:
-        scraped_data["product_name"] = driver.find_element(by=By.ID, value="productTitle").text.strip()
-    except Exception as e:
-        log(f"Could not find product name: {e}", log_id)
+def parse_merchant_info(merchant_info_text, scraped_data):
+    sold_by_match = re.search(r"(?:Venduto da|Venditore|Sold by|Seller)\s*([^.|\n]+)", merchant_info_text)
+    if sold_by_match:
+        scraped_data["sold_by"] = sold_by_match.group(1).strip()
+
+    ships_from_match = re.search(r"(?:Spedito da|Spedizione|Ships from|Shipped by)\s*([^.|\n]+)", merchant_info_text)
+    if ships_from_match:
+        scraped_data["ships_from"] = ships_from_match.group(1).strip()
+
+def parse_delivery_cost(delivery_cost_str):
+    if delivery_cost_str:
+        normalized_delivery_cost_str = delivery_cost_str.lower()
+        if "senza costi aggiuntivi" in normalized_delivery_cost_str or "free" in normalized_delivery_cost_str:
+            return 0.0
+        match = re.search(r'(\d+,\d{2})', delivery_cost_str)
+        if match:
+            cost_str = match.group(1).replace(',', '.')
+            return float(cost_str)
+    return None
+
+def parse_price(price_whole_str, price_fraction_str=None):
+    price_whole_str = "".join(price_whole_str.split()).replace('.', '').replace(',', '')
+    if price_fraction_str and price_fraction_str.strip():
+        return float(f"{price_whole_str}.{price_fraction_str.strip()}")
+    return float(price_whole_str)
+
+def normalize_condition(condition_text):
+    condition_cleaned = condition_text.lower()
+    if "usato" in condition_cleaned or "used" in condition_cleaned:
+        return "used"
+    return "new"
+
+def scrape_product_data(driver, product_url, log_id, asin, use_rufus_ai=False, resources=None):
+    resources = resources or default_scrape_resources()
+    with scrape_step(asin, "rate_limit"):
+        resources.limiter.acquire(log_id)
+    with scrape_step(asin, "page_load"):
+        driver.get(product_url)
+        resources.waits.wait("product_page_load", driver, log_id)
+    with scrape_step(asin, "captcha"):
+        handle_captcha(driver, log_id, resources)
+
+    with scrape_step(asin, "fields"):
+        if scrape_engine == "script":
+            scraped_data = scrape_product_fields_script(driver, log_id, asin, resources)
+        elif scrape_engine == "compare":
+            scraped_data = compare_scrape_engines(driver, log_id, asin, resources)
+        else:
+            scraped_data = scrape_product_fields(driver, log_id, asin, resources)
 
-    # Get Sold by and Shipped by
-    try:
-        merchant_info_element = driver.find_element(by=By.ID, value="merchant-info")
-        merchant_info_text = merchant_info_element.text
+    ai_product_data = {}
+    if use_rufus_ai:
+        # Get product info from RufusAI
+        with scrape_step(asin, "rufus"):
+            ai_product_data = get_product_info_from_rufus(driver, log_id, asin)
 
-        sold_by_match = re.search(r"(?:Venduto da|Venditore|Sold by|Seller)\s*([^.|\n]+)", merchant_info_text)
-        if sold_by_match:
-            scraped_data["sold_by"] = sold_by_match.group(1).strip()
+    return scraped_data | ai_product_data
 
-        ships_from_match = re.search(r"(?:Spedito da|Spedizione|Ships from|Shipped by)\s*([^.|\n]+)", merchant_info_text)
-        if ships_from_match:
-            scraped_data["ships_from"] = ships_from_match.group(1).strip()
+def scrape_product_fields(driver, log_id, asin, resources=None):
+    scraped_data = new_scraped_data()
 
-    except NoSuchElementException:
-        # Fallback to other XPaths if merchant-info is not found
+    # Get product name
+    with tracer.span("field name"):
         try:
-            sold_by_element = driver.find_element(by=By.XPATH, value="//div[@tabular-attribute-name='Venduto da']//span")
-            scraped_data["sold_by"] = sold_by_element.text.strip()
-        except NoSuchElementException:
-            pass # Sold by not found with this XPath
+            scraped_data["product_name"] = driver.find_element(by=By.ID, value="productTitle").text.strip()
+        except Exception as e:
+            log(f"Could not find product name: {e}", log_id)
 
+    # Get Sold by and Shipped by
+    with tracer.span("field merchant"):
         try:
-            ships_from_element = driver.find_element(by=By.XPATH, value="//div[@tabular-attribute-name='Spedito da']//span")
-            scraped_data["ships_from"] = ships_from_element.text.strip()
+            merchant_info_element = driver.find_element(by=By.ID, value="merchant-info")
+            parse_merchant_info(merchant_info_element.text, scraped_data)
+
         except NoSuchElementException:
-            pass # Shipped by not found with this XPath
-    except Exception as e:
-        log(f"Could not find Sold by/Shipped by information: {e}", log_id)
+            # Fallback to other XPaths if merchant-info is not found
+            try:
+                sold_by_element = driver.find_element(by=By.XPATH, value=SOLD_BY_XPATH)
+                scraped_data["sold_by"] = sold_by_element.text.strip()
+            except NoSuchElementException:
+                pass # Sold by not found with this XPath
 
-    # Retrieve items count
-    try:
-        ITEMS_COUNT_XPATHS = [
-            "//tr[contains(@class, 'po-number_of_items')]/td[2]/span",
-            "//div[contains(@data-feature-name, 'metaData') and .//span[contains(text(), 'Numero di articoli')]]//span[@class='a-size-base a-color-tertiary']",
-            "//div[contains(@data-feature-name, 'metaData') and .//span[contains(text(), 'Number of Items')]]//span[@class='a-size-base a-color-tertiary']",
-            "//div[@id='detailBullets_feature_div']//span[contains(text(), 'Numero di articoli')]/following-sibling::span",
-            "//div[@id='detailBullets_feature_div']//span[contains(text(), 'Number of Items')]/following-sibling::span"
-        ]
-        for xpath in ITEMS_COUNT_XPATHS:
             try:
-                items_count_element = driver.find_element(by=By.XPATH, value=xpath)
-                scraped_data["items_count"] = int(items_count_element.text)
-                break  # if found, break the loop
-            except (NoSuchElementException, ValueError):
-                continue  # if not found, try the next xpath
-    except Exception as e:
-        log(f"Could not find or parse items count: {e}", log_id)
-    
-    # Try to find the product image URL
-    try:
-        IMAGE_XPATHS = [
-            "//img[@id='landingImage']",
-            "//img[@id='imgBlkFront']",
-            "//div[contains(@class, 'imgTagWrapper')]/img"
-        ]
-        for xpath in IMAGE_XPATHS:
-            try:
-                image_element = driver.find_element(by=By.XPATH, value=xpath)
-                scraped_data["product_image_url"] = image_element.get_attribute('src')
-                if scraped_data["product_image_url"]:
-                    break
+                ships_from_element = driver.find_element(by=By.XPATH, value=SHIPS_FROM_XPATH)
+                scraped_data["ships_from"] = ships_from_element.text.strip()
             except NoSuchElementException:
-                continue
-    except Exception as e:
-        log(f"Could not find product image: {e}", log_id)
+                pass # Shipped by not found with this XPath
+        except Exception as e:
+            log(f"Could not find Sold by/Shipped by information: {e}", log_id)
+
+    # Retrieve items count
+    with tracer.span("field items_count"):
+        try:
+            matched_xpath = None
+            for xpath in xpath_selectors.candidates("items_count", ITEMS_COUNT_XPATHS):
+                try:
+                    items_count_element = driver.find_element(by=By.XPATH, value=xpath)
+                    scraped_data["items_count"] = int(items_count_element.text)
+                    matched_xpath = xpath
+                    break  # if found, break the loop
+                except (NoSuchElementException, ValueError):
+                    continue  # if not found, try the next xpath
+            xpath_selectors.record("items_count", ITEMS_COUNT_XPATHS, matched_xpath)
+        except Exception as e:
+            log(f"Could not find or parse items count: {e}", log_id)
+
+    # Try to find the product image URL
+    with tracer.span("field image"):
+        try:
+            matched_xpath = None
+            for xpath in xpath_selectors.candidates("image", IMAGE_XPATHS):
+                try:
+                    image_element = driver.find_element(by=By.XPATH, value=xpath)
+                    scraped_data["product_image_url"] = image_element.get_attribute('src')
+                    if scraped_data["product_image_url"]:
+                        matched_xpath = xpath
+                        break
+                except NoSuchElementException:
+                    continue
+            xpath_selectors.record("image", IMAGE_XPATHS, matched_xpath)
+        except Exception as e:
+            log(f"Could not find product image: {e}", log_id)
 
     # Try to find the delivery cost
+    with tracer.span("field delivery_cost"):
+        try:
+            delivery_cost_element = driver.find_element(by=By.XPATH, value=DELIVERY_COST_XPATH)
+            scraped_data["delivery_cost"] = parse_delivery_cost(delivery_cost_element.get_attribute('data-csa-c-delivery-price'))
+        except NoSuchElementException:
+            pass # Delivery block is optional, so no error if not found
+        except Exception as e:
+            log(f"Could not parse delivery cost: {e}", log_id)
+
+    # Check for product unavailability
+    with tracer.span("field unavailable"):
+        try:
+            unavailable_element, _ = find_element_by_multiple_xpaths(driver, UNAVAILABLE_XPATHS, "unavailable element", field="unavailable")
+            if unavailable_element:
+                scraped_data["is_unavailable"] = True
+                scraped_data["current_price"] = -1.0
+        except NoSuchElementException:
+            pass
+
+    # Check the main "Brand New" option (Featured Offer) only if not already determined as unavailable
+    with tracer.span("field main_offer"):
+        if not scraped_data["is_unavailable"]:
+            try:
+                offer_container, _ = find_element_by_multiple_xpaths(driver, MAIN_OFFER_CONTAINER_XPATHS, "main offer container", field="main_offer_container")
+                scraped_data["offer_container"] = offer_container
+
+                price_whole_str = offer_container.find_element(by=By.XPATH, value=PRICE_WHOLE_XPATH).text
+                try:
+                    price_fraction_str = offer_container.find_element(by=By.XPATH, value=PRICE_FRACTION_XPATH).text
+                except NoSuchElementException:
+                    price_fraction_str = None
+                scraped_data["current_price"] = parse_price(price_whole_str, price_fraction_str)
+
+                scraped_data["condition_text"] = "New"
+                try:
+                    used_element = offer_container.find_element(by=By.XPATH, value=USED_CONDITION_XPATH)
+                    if used_element:
+                        scraped_data["condition_text"] = used_element.text.strip()
+                except NoSuchElementException:
+                    pass
+
+                scraped_data["normalized_state"] = normalize_condition(scraped_data["condition_text"])
+            except NoSuchElementException as e:
+                save_debug_html(driver, e, "main_offer", asin, log_id, resources)
+            except Exception as e:
+                save_debug_html(driver, e, "main_offer", asin, log_id, resources)
+                exc_type, exc_value, exc_tb = sys.exc_info()
+                file_name = exc_tb.tb_frame.f_code.co_filename
+                line_number = exc_tb.tb_lineno
+                log(f"An unexpected error occurred while processing the main offer: {e} at file {file_name} line {line_number}", log_id)
+
+    return scraped_data
+
+# Evaluates all the product page selectors in the browser, so that the whole extraction costs a single WebDriver round trip
+PRODUCT_FIELDS_SCRIPT = """
+const spec = arguments[0];
+function find(xpath, context) {
+    try {
+        return document.evaluate(xpath, context || document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    } catch (e) {
+        return null;
+    }
+}
+function text(node) {
+    return node ? (node.innerText !== undefined ? node.innerText : node.textContent) : null;
+}
+const result = {
+    product_name: text(find(spec.product_title)),
+    merchant_info: text(find(spec.merchant_info)),
+    sold_by: text(find(spec.sold_by)),
+    ships_from: text(find(spec.ships_from)),
+    items_count: spec.items_count.map(xpath => text(find(xpath))),
+    images: spec.images.map(xpath => { const node = find(xpath); return node ? (node.src || node.getAttribute('src')) : null; }),
+    delivery_cost: null,
+    unavailable_index: spec.unavailable.findIndex(xpath => find(xpath) !== null),
+    offer_container: null,
+    offer_container_index: -1,
+    price_whole: null,
+    price_fraction: null,
+    used_condition: null,
+};
+const delivery = find(spec.delivery_cost);
+if (delivery) {
+    result.delivery_cost = delivery.getAttribute('data-csa-c-delivery-price');
+}
+for (const [index, xpath] of spec.main_offer_container.entries()) {
+    const container = find(xpath);
+    if (container) {
+        result.offer_container = container;
+        result.offer_container_index = index;
+        result.price_whole = text(find(spec.price_whole, container));
+        result.price_fraction = text(find(spec.price_fraction, container));
+        result.used_condition = text(find(spec.used_condition, container));
+        break;
+    }
+}
+return result;
+"""
+
+def scrape_product_fields_script(driver, log_id, asin, resources=None):
+    scraped_data = new_scraped_data()
+
+    # The candidates are sent in order of hit rate, the script returns the results in the same order
+    items_count_xpaths = xpath_selectors.candidates("items_count", ITEMS_COUNT_XPATHS)
+    image_xpaths = xpath_selectors.candidates("image", IMAGE_XPATHS)
+    unavailable_xpaths = xpath_selectors.candidates("unavailable", UNAVAILABLE_XPATHS)
+    main_offer_container_xpaths = xpath_selectors.candidates("main_offer_container", MAIN_OFFER_CONTAINER_XPATHS)
+    fields = driver.execute_script(PRODUCT_FIELDS_SCRIPT, {
+        "product_title": PRODUCT_TITLE_XPATH,
+        "merchant_info": MERCHANT_INFO_XPATH,
+        "sold_by": SOLD_BY_XPATH,
+        "ships_from": SHIPS_FROM_XPATH,
+        "items_count": items_count_xpaths,
+        "images": image_xpaths,
+        "delivery_cost": DELIVERY_COST_XPATH,
+        "unavailable": unavailable_xpaths,
+        "main_offer_container": main_offer_container_xpaths,
+        "price_whole": PRICE_WHOLE_XPATH,
+        "price_fraction": PRICE_FRACTION_XPATH,
+        "used_condition": USED_CONDITION_XPATH,
+    })
+
+    if fields["product_name"] is not None:
+        scraped_data["product_name"] = fields["product_name"].strip()
+    else:
+        log("Could not find product name", log_id)
+
+    if fields["merchant_info"] is not None:
+        parse_merchant_info(fields["merchant_info"], scraped_data)
+    else:
+        if fields["sold_by"] is not None:
+            scraped_data["sold_by"] = fields["sold_by"].strip()
+        if fields["ships_from"] is not None:
+            scraped_data["ships_from"] = fields["ships_from"].strip()
+
+    matched_xpath = None
+    for xpath, items_count_str in zip(items_count_xpaths, fields["items_count"]):
+        try:
+            scraped_data["items_count"] = int(items_count_str)
+            matched_xpath = xpath
+            break
+        except (TypeError, ValueError):
+            continue
+    xpath_selectors.record("items_count", ITEMS_COUNT_XPATHS, matched_xpath)
+
+    matched_xpath = next((xpath for xpath, image_url in zip(image_xpaths, fields["images"]) if image_url), None)
+    scraped_data["product_image_url"] = next((image_url for image_url in fields["images"] if image_url), None)
+    xpath_selectors.record("image", IMAGE_XPATHS, matched_xpath)
+
     try:
-        delivery_cost_element = driver.find_element(by=By.XPATH, value="//div[@id='deliveryBlockMessage']//span[@data-csa-c-delivery-price]")
-        delivery_cost_str = delivery_cost_element.get_attribute('data-csa-c-delivery-price')
-        if delivery_cost_str:
-            normalized_delivery_cost_str = delivery_cost_str.lower()
-            if "senza costi aggiuntivi" in normalized_delivery_cost_str or "free" in normalized_delivery_cost_str:
-                scraped_data["delivery_cost"] = 0.0
-            else:
-                match = re.search(r'(\d+,\d{2})', delivery_cost_str)
-                if match:
-                    cost_str = match.group(1).replace(',', '.')
-                    scraped_data["delivery_cost"] = float(cost_str)
-    except NoSuchElementException:
-        pass # Delivery block is optional, so no error if not found
+        scraped_data["delivery_cost"] = parse_delivery_cost(fields["delivery_cost"])
     except Exception as e:
         log(f"Could not parse delivery cost: {e}", log_id)
 
-    # Check for product unavailability
+    xpath_selectors.record("unavailable", UNAVAILABLE_XPATHS, unavailable_xpaths[fields["unavailable_index"]] if fields["unavailable_index"] >= 0 else None)
+    if fields["unavailable_index"] >= 0:
+        scraped_data["is_unavailable"] = True
+        scraped_data["current_price"] = -1.0
+        return scraped_data
+
+    xpath_selectors.record("main_offer_container", MAIN_OFFER_CONTAINER_XPATHS, main_offer_container_xpaths[fields["offer_container_index"]] if fields["offer_container_index"] >= 0 else None)
     try:
-        UNAVAILABLE_XPATHS = [
-            "//div[@id='availability']//span[contains(text(), 'Attualmente non disponibile')]",
-            "//div[@id='availability']//span[contains(text(), 'Currently unavailable')]",
-            "//div[@id='availability']//span[contains(text(), 'Non disponibile')]",
-            "//div[@id='outOfStock']",
-        ]
-        unavailable_element, _ = find_element_by_multiple_xpaths(driver, UNAVAILABLE_XPATHS, "unavailable element")
-        if unavailable_element:
-            scraped_data["is_unavailable"] = True
-            scraped_data["current_price"] = -1.0
-    except NoSuchElementException:
-        pass
+        if fields["offer_container"] is None:
+            raise NoSuchElementException(f"Could not find main offer container using any of the provided XPaths: {MAIN_OFFER_CONTAINER_XPATHS}")
+        scraped_data["offer_container"] = fields["offer_container"]
+        if fields["price_whole"] is None:
+            raise NoSuchElementException(f"Could not find the main offer price using XPath: {PRICE_WHOLE_XPATH}")
+        scraped_data["current_price"] = parse_price(fields["price_whole"], fields["price_fraction"])
+
+        scraped_data["condition_text"] = "New"
+        if fields["used_condition"] is not None:
+            scraped_data["condition_text"] = fields["used_condition"].strip()
+        scraped_data["normalized_state"] = normalize_condition(scraped_data["condition_text"])
+    except Exception as e:
+        save_debug_html(driver, e, "main_offer", asin, log_id, resources)
+
+    return scraped_data
+
+def compare_scrape_engines(driver, log_id, asin, resources=None):
+    start_time = time.time()
+    webdriver_data = scrape_product_fields(driver, log_id, asin, resources)
+    webdriver_time = time.time() - start_time
+
+    start_time = time.time()
+    script_data = scrape_product_fields_script(driver, log_id, asin, resources)
+    script_time = time.time() - start_time
+
+    mismatches = [key for key in webdriver_data if key != "offer_container" and webdriver_data[key] != script_data[key]]
+    log(f"Scrape engines timing: webdriver {webdriver_time:.3f}s, script {script_time:.3f}s ({webdriver_time / max(script_time, 1e-6):.1f}x){f', MISMATCHES: ' + ', '.join(f'{key}={webdriver_data[key]!r}/{script_data[key]!r}' for key in mismatches) if mismatches else ''}", log_id)
+    return script_data
+
+def get_amazon_http_session():
+    global amazon_http_session
+    with amazon_http_session_lock:
+        if amazon_http_session is None:
+            session = requests.Session()
+            # Keep-alive connections are shared by all the monitor workers
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max(monitor_workers, 10))
+            session.mount("https://", adapter)
+            session.headers.update({
+                "User-Agent": user_agent_string,
+                "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+                "Accept-Language": "it-IT,it;q=0.9,en-US;q=0.8,en;q=0.7",
+            })
+            amazon_cookies.apply_to_http_session(session)
+            amazon_http_session = session
+        return amazon_http_session
+
+def compiled_xpath(xpath):
+    compiled = compiled_xpaths.get(xpath)
+    if compiled is None:
+        compiled = compiled_xpaths[xpath] = lxml.etree.XPath(xpath)
+    return compiled
+
+def scrape_product_data_http(product_url, log_id, asin):
+    """
+    Scrapes the product page without a browser, using the pooled requests session and lxml.
+    Returns None when the page needs the browser (CAPTCHA, price not found...), so that the caller can fall back to scrape_product_data().
+    """
+    with scrape_step(asin, "rate_limit"):
+        amazon_limiter.acquire(log_id)
+    try:
+        with scrape_step(asin, "http_fetch"):
+            response = get_amazon_http_session().get(product_url, timeout=15)
+    except requests.RequestException as e:
+        log(f"HTTP fetch of the product page failed, falling back to the browser: {e}", log_id)
+        return None
+    if response.status_code != 200:
+        log(f"HTTP fetch of the product page returned status code {response.status_code}, falling back to the browser.", log_id)
+        return None
 
-    # Check the main "Brand New" option (Featured Offer) only if not already determined as unavailable
-    if not scraped_data["is_unavailable"]:
-        try:
-            MAIN_OFFER_CONTAINER_XPATHS = [
-                "//div[@id='qualifiedBuybox']",
-                "//div[@id='newAccordionRow_0']",
-                "//div[@id='newAccordionRow_1']",
-                "//div[@data-a-accordion-row-name='newAccordionRow']"
-            ]
-            offer_container, _ = find_element_by_multiple_xpaths(driver, MAIN_OFFER_CONTAINER_XPATHS, "main offer container")
-            scraped_data["offer_container"] = offer_container
+    try:
+        tree = lxml.html.fromstring(response.content)
+    except (lxml.etree.ParserError, ValueError) as e:
+        log(f"HTTP fetch of the product page returned an unparsable page, falling back to the browser: {e}", log_id)
+        return None
 
-            price_whole_str = offer_container.find_element(by=By.XPATH, value=".//span[contains(@class, 'a-price-whole')]").text.replace('.', '').replace(',', '')
-            try:
-                price_fraction_str = offer_container.find_element(by=By.XPATH, value=".//span[contains(@class, 'a-price-fraction')]").text
-                scraped_data["current_price"] = float(f"{price_whole_str}.{price_fraction_str}")
-            except NoSuchElementException:
-                scraped_data["current_price"] = float(price_whole_str)
+    def find(xpath, node=tree):
+        results = compiled_xpath(xpath)(node)
+        return results[0] if results else None
 
-            scraped_data["condition_text"] = "New"
-            try:
-                used_element = offer_container.find_element(by=By.XPATH, value=".//*[contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'usato')] | .//*[contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'used')] ")
-                if used_element:
-                    scraped_data["condition_text"] = used_element.text.strip()
-            except NoSuchElementException:
-                pass
+    def visible_text(element):
+        return "\n".join(text.strip() for text in element.itertext() if text.strip())
 
-            scraped_data["normalized_state"] = "new"
-            condition_cleaned = scraped_data["condition_text"].lower()
-            if "usato" in condition_cleaned or "used" in condition_cleaned:
-                scraped_data["normalized_state"] = "used"
-        except NoSuchElementException as e:
-            save_debug_html(driver, e, "main_offer", asin, log_id)
-        except Exception as e:
-            save_debug_html(driver, e, "main_offer", asin, log_id)
-            exc_type, exc_value, exc_tb = sys.exc_info()
-            file_name = exc_tb.tb_frame.f_code.co_filename
-            line_number = exc_tb.tb_lineno
-            log(f"An unexpected error occurred while processing the main offer: {e} at file {file_name} line {line_number}", log_id)
+    if find(CAPTCHA_XPATH) is not None or find("//form[contains(@action, 'validateCaptcha')]") is not None:
+        log("CAPTCHA page returned to the HTTP fetch, falling back to the browser.", log_id)
+        amazon_limiter.on_captcha(log_id)
+        return None
 
-    ai_product_data = {}
-    if use_rufus_ai:
-        # Get product info from RufusAI
-        ai_product_data = get_product_info_from_rufus(driver, log_id, asin)
+    scraped_data = new_scraped_data()
 
-    return scraped_data | ai_product_data
+    title_element = find(PRODUCT_TITLE_XPATH)
+    if title_element is not None:
+        scraped_data["product_name"] = visible_text(title_element)
+
+    merchant_info_element = find(MERCHANT_INFO_XPATH)
+    if merchant_info_element is not None:
+        parse_merchant_info(visible_text(merchant_info_element), scraped_data)
+    else:
+        sold_by_element = find(SOLD_BY_XPATH)
+        if sold_by_element is not None:
+            scraped_data["sold_by"] = visible_text(sold_by_element)
+        ships_from_element = find(SHIPS_FROM_XPATH)
+        if ships_from_element is not None:
+            scraped_data["ships_from"] = visible_text(ships_from_element)
+
+    matched_xpath = None
+    for xpath in xpath_selectors.candidates("items_count", ITEMS_COUNT_XPATHS):
+        items_count_element = find(xpath)
+        if items_count_element is None:
+            continue
+        try:
+            scraped_data["items_count"] = int(visible_text(items_count_element))
+            matched_xpath = xpath
+            break
+        except ValueError:
+            continue
+    xpath_selectors.record("items_count", ITEMS_COUNT_XPATHS, matched_xpath)
+
+    matched_xpath = None
+    for xpath in xpath_selectors.candidates("image", IMAGE_XPATHS):
+        image_element = find(xpath)
+        if image_element is not None and image_element.get('src'):
+            scraped_data["product_image_url"] = image_element.get('src')
+            matched_xpath = xpath
+            break
+    xpath_selectors.record("image", IMAGE_XPATHS, matched_xpath)
+
+    delivery_cost_element = find(DELIVERY_COST_XPATH)
+    if delivery_cost_element is not None:
+        scraped_data["delivery_cost"] = parse_delivery_cost(delivery_cost_element.get('data-csa-c-delivery-price'))
+
+    matched_xpath = next((xpath for xpath in xpath_selectors.candidates("unavailable", UNAVAILABLE_XPATHS) if find(xpath) is not None), None)
+    xpath_selectors.record("unavailable", UNAVAILABLE_XPATHS, matched_xpath)
+    if matched_xpath is not None:
+        scraped_data["is_unavailable"] = True
+        return scraped_data
+
+    offer_container = None
+    matched_xpath = None
+    for xpath in xpath_selectors.candidates("main_offer_container", MAIN_OFFER_CONTAINER_XPATHS):
+        offer_container = find(xpath)
+        if offer_container is not None:
+            matched_xpath = xpath
+            break
+    xpath_selectors.record("main_offer_container", MAIN_OFFER_CONTAINER_XPATHS, matched_xpath)
+    price_whole_element = find(PRICE_WHOLE_XPATH, offer_container) if offer_container is not None else None
+    if price_whole_element is None:
+        log("Main offer price not found by the HTTP fetch, falling back to the browser.", log_id)
+        return None
+
+    price_fraction_element = find(PRICE_FRACTION_XPATH, offer_container)
+    try:
+        scraped_data["current_price"] = parse_price(visible_text(price_whole_element), visible_text(price_fraction_element) if price_fraction_element is not None else None)
+    except ValueError:
+        log("Main offer price could not be parsed from the HTTP fetch, falling back to the browser.", log_id)
+        return None
 
-def find_element_by_multiple_xpaths(driver, xpaths, description="element"):
-    for xpath in xpaths:
+    scraped_data["condition_text"] = "New"
+    used_element = find(USED_CONDITION_XPATH, offer_container)
+    if used_element is not None:
+        scraped_data["condition_text"] = visible_text(used_element)
+    scraped_data["normalized_state"] = normalize_condition(scraped_data["condition_text"])
+
+    return scraped_data
+
+class selector_registry:
+    """
+    Hit statistics of the candidate XPaths of each field, per marketplace, persisted in data/selectors.json.
+    Candidates are tried in order of recent hit rate, so the selector that usually matches costs a single lookup, and
+    selectors that stopped matching while the others of the same field still do are flagged as stale.
+    """
+    def __init__(self, path, marketplace, decay=0.05, stale_after_hits=50, save_interval=60):
+        self.path = path
+        self.marketplace = marketplace
+        self.decay = decay
+        self.stale_after_hits = stale_after_hits
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.fields = None
+        self.flagged = set()
+        self.last_save_time = time.time()
+        self.dirty = False
+
+    def _load(self):
+        # Called with the lock held
+        if self.fields is not None:
+            return
+        self.fields = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.fields = json.load(f).get(self.marketplace, {})
+            except Exception as e:
+                log(f"Could not load selector statistics from {self.path}: {e}")
+
+    def _field_stats(self, field, xpaths):
+        # Called with the lock held
+        self._load()
+        field_stats = self.fields.setdefault(field, {"lookups": 0, "hits": 0, "selectors": {}})
+        for xpath in xpaths:
+            field_stats["selectors"].setdefault(xpath, {"hits": 0, "score": 0.0, "last_hit_time": None, "field_hits_at_last_hit": 0})
+        return field_stats
+
+    def candidates(self, field, xpaths):
+        with self.lock:
+            selectors_stats = self._field_stats(field, xpaths)["selectors"]
+            # sorted() is stable: without statistics the original order is kept
+            return sorted(xpaths, key=lambda xpath: -selectors_stats[xpath]["score"])
+
+    def record(self, field, xpaths, matched_xpath):
+        with self.lock:
+            field_stats = self._field_stats(field, xpaths)
+            field_stats["lookups"] += 1
+            if matched_xpath is not None:
+                field_stats["hits"] += 1
+            for xpath in xpaths:
+                selector_stats = field_stats["selectors"][xpath]
+                hit = xpath == matched_xpath
+                # Only the lookups that found something count, so that e.g. the unavailability selectors don't decay while products are available
+                if matched_xpath is not None:
+                    selector_stats["score"] = selector_stats["score"] * (1 - self.decay) + (self.decay if hit else 0.0)
+                if hit:
+                    selector_stats["hits"] += 1
+                    selector_stats["last_hit_time"] = time.time()
+                    selector_stats["field_hits_at_last_hit"] = field_stats["hits"]
+                    self.flagged.discard((field, xpath))
+                elif matched_xpath is not None and self._is_stale(field_stats, selector_stats) and (field, xpath) not in self.flagged:
+                    self.flagged.add((field, xpath))
+                    log(f"Selector for '{field}' on {self.marketplace} has stopped matching: {xpath}")
+            self.dirty = True
+            if time.time() - self.last_save_time >= self.save_interval:
+                self._save()
+
+    def _is_stale(self, field_stats, selector_stats):
+        # A fallback that never matched hasn't stopped matching
+        return selector_stats["hits"] > 0 and field_stats["hits"] - selector_stats["field_hits_at_last_hit"] >= self.stale_after_hits
+
+    def _save(self):
+        # Called with the lock held
+        self.last_save_time = time.time()
+        if not self.dirty:
+            return
+        try:
+            all_marketplaces = {}
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    all_marketplaces = json.load(f)
+            all_marketplaces[self.marketplace] = self.fields
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(all_marketplaces, f)
+            os.replace(tmp_path, self.path)
+            self.dirty = False
+        except Exception as e:
+            log(f"Could not save selector statistics to {self.path}: {e}")
+
+    def flush(self):
+        with self.lock:
+            if self.fields is not None:
+                self._save()
+
+    def snapshot(self):
+        with self.lock:
+            self._load()
+            result = {}
+            for field, field_stats in self.fields.items():
+                result[field] = []
+                for xpath, selector_stats in sorted(field_stats["selectors"].items(), key=lambda item: -item[1]["score"]):
+                    result[field].append({
+                        "xpath": xpath,
+                        "hit_rate": selector_stats["hits"] / field_stats["lookups"] if field_stats["lookups"] else 0.0,
+                        "score": selector_stats["score"],
+                        "stale": self._is_stale(field_stats, selector_stats),
+                    })
+            return result
+
+def find_element_by_multiple_xpaths(driver, xpaths, description="element", field=None):
+    # With a field name, the candidates are tried in order of hit rate and the result is recorded
+    candidates = xpath_selectors.candidates(field, xpaths) if field else xpaths
+    for xpath in candidates:
         try:
             element = driver.find_element(by=By.XPATH, value=xpath)
+            if field:
+                xpath_selectors.record(field, xpaths, xpath)
             return element, xpath
         except NoSuchElementException:
             continue
+    if field:
+        xpath_selectors.record(field, xpaths, None)
     raise NoSuchElementException(f"Could not find {description} using any of the provided XPaths: {xpaths}")
 
-def save_debug_html(driver, exception, context_name, asin, log_id):
+DEBUG_HTML_DIR = "logs"
+
+class scrape_resources:
+    """
+    The rate limiter, wait points and debug HTML directory used by a scrape, so that a caller like the benchmark can run with its own.
+    """
+    def __init__(self, limiter, waits, debug_html_dir=DEBUG_HTML_DIR):
+        self.limiter = limiter
+        self.waits = waits
+        self.debug_html_dir = debug_html_dir
+
+def default_scrape_resources():
+    # Looked up at each call, the shard workers replace amazon_limiter with their share of the budget
+    return scrape_resources(amazon_limiter, waits)
+
+def save_debug_html(driver, exception, context_name, asin, log_id, resources=None):
+    debug_html_dir = resources.debug_html_dir if resources else DEBUG_HTML_DIR
     exc_type, exc_value, exc_tb = sys.exc_info()
     file_name = exc_tb.tb_frame.f_code.co_filename
     line_number = exc_tb.tb_lineno
     current_url = driver.current_url
     error_message = f"URL: {current_url}, File: {file_name}, Line: {line_number}, Error: {exception}"
     
-    logs_dir = "logs"
-    if not os.path.exists(logs_dir):
-        os.makedirs(logs_dir)
+    if not os.path.exists(debug_html_dir):
+        os.makedirs(debug_html_dir)
         
-    html_file_name = os.path.join(logs_dir, f"debug_{context_name}_not_found_{asin}.html")
+    html_file_name = os.path.join(debug_html_dir, f"debug_{context_name}_not_found_{asin}.html")
     
     with open(html_file_name, "w", encoding="utf-8") as f:
         f.write(f"<!-- {error_message} -->\n")
@@ -933,24 +2796,28 @@ def save_debug_html(driver, exception, context_name, asin, log_id):
         
     log(f"Error during '{context_name}' processing. Page HTML saved to {html_file_name} for debugging. {error_message}", log_id)
 
-def handle_captcha(driver, log_id):
+def handle_captcha(driver, log_id, resources=None):
+    resources = resources or default_scrape_resources()
     try:
-        captcha_text_element = driver.find_element(by=By.XPATH, value="//h4[contains(text(), 'Fai clic sul pulsante qui sotto per continuare a fare acquisti')] | //h4[contains(text(), 'Type the characters you see in this image')] | //h4[contains(text(), 'Click the button below to continue shopping')] ")
+        captcha_text_element = driver.find_element(by=By.XPATH, value=CAPTCHA_XPATH)
         if captcha_text_element:
             log(f"CAPTCHA detected! Attempting to bypass by clicking 'Continue shopping' button.", log_id)
-            random_delay = random.uniform(0, 3)
-            log(f"Waiting for {random_delay:.2f} seconds before clicking 'Continue shopping' button.", log_id)
-            time.sleep(random_delay)
+            resources.limiter.on_captcha(log_id)
+            resources.waits.wait("captcha_before_click", driver, log_id)
             continue_button = driver.find_element(by=By.XPATH, value="//button[contains(text(), 'Continua con gli acquisti')] | //button[contains(text(), 'Continue shopping')] | //button[contains(text(), 'Continue with your order')] ")
             continue_button.click()
-            log(f"'Continue shopping' button clicked. Waiting for 3 seconds.", log_id)
-            time.sleep(3 + random.uniform(0, 3))
+            log(f"'Continue shopping' button clicked.", log_id)
+            resources.waits.wait("captcha_after_click", driver, log_id)
             return True # CAPTCHA was handled
     except NoSuchElementException:
         pass # No CAPTCHA
     return False # No CAPTCHA was found/handled
 
 def generate_shortlink(driver, asin, log_id):
+    with tracer.span("shortlink"):
+        return _generate_shortlink(driver, asin, log_id)
+
+def _generate_shortlink(driver, asin, log_id):
     shortlink = ""
     try:
         get_link_button = driver.find_element(by=By.CSS_SELECTOR, value="button[data-csa-c-content-id='sitestripe-get-linkbutton']")
@@ -970,29 +2837,442 @@ def generate_shortlink(driver, asin, log_id):
 
         shortlink = shortlink_textarea.get_attribute("value")
         log(f"Generated shortlink for {asin}: {shortlink}", log_id)
+        metrics.inc("pricesdrop_shortlink_generation_total", result="success")
     except Exception as e:
         log(f"Failed to generate shortlink for {asin}: {e}", log_id)
+        metrics.inc("pricesdrop_shortlink_generation_total", result="failure")
     return shortlink
 
+class shortlink_cache:
+    """
+    Persistent cache of the SiteStripe shortlinks, keyed by ASIN, seller and affiliate tag.
+    Missing shortlinks are generated by a background thread on a pooled driver, so notifications never wait for SiteStripe.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = None
+        self.pending = set()
+        self.queue = queue.Queue()
+        self.worker = None
+        self.hits_count = 0
+        self.misses_count = 0
+
+    def _key(self, asin, seller_id, tag):
+        return f"{asin}|{seller_id or ''}|{tag}"
+
+    def _load(self):
+        # Called with the lock held
+        if self.entries is not None:
+            return
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self.entries.update(json.load(f))
+            except Exception as e:
+                log(f"Could not load shortlink cache from {self.path}: {e}")
+
+    def get(self, asin, seller_id, tag, log_id=None):
+        """
+        Returns the cached shortlink, or an empty string after scheduling its generation.
+        """
+        with self.lock:
+            self._load()
+            entry = self.entries.get(self._key(asin, seller_id, tag))
+            if entry:
+                self.hits_count += 1
+                return entry['shortlink']
+            self.misses_count += 1
+        self.prefill(asin, seller_id, tag, log_id)
+        return ""
+
+    def put(self, asin, seller_id, tag, shortlink):
+        with self.lock:
+            self._load()
+            self.entries[self._key(asin, seller_id, tag)] = {'time': time.time(), 'shortlink': shortlink}
+            try:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                tmp_path = f"{self.path}.tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.entries, f)
+                os.replace(tmp_path, self.path)
+            except Exception as e:
+                log(f"Could not save shortlink cache to {self.path}: {e}")
+
+    def prefill(self, asin, seller_id, tag, log_id=None):
+        key = self._key(asin, seller_id, tag)
+        with self.lock:
+            self._load()
+            if key in self.entries or key in self.pending:
+                return
+            self.pending.add(key)
+            if self.worker is None:
+                self.worker = threading.Thread(target=self._worker_loop, name="shortlink-prefill", daemon=True)
+                self.worker.start()
+        self.queue.put((asin, seller_id, tag, log_id))
+
+    def _worker_loop(self):
+        while True:
+            asin, seller_id, tag, log_id = self.queue.get()
+            shortlink = ""
+            try:
+                # SiteStripe links to the page it is opened on, the tag is the one of the logged-in associate account
+                with driver_pool.lease(log_id) as driver:
+                    amazon_limiter.acquire(log_id)
+                    driver.get(get_product_url(asin, seller_id))
+                    waits.wait("product_page_load", driver, log_id)
+                    shortlink = generate_shortlink(driver, asin, log_id)
+            except operation_cancelled:
+                return # Shutting down
+            except Exception as e:
+                log(f"Failed to generate shortlink for {asin}: {e}", log_id)
+            if shortlink:
+                self.put(asin, seller_id, tag, shortlink)
+            with self.lock:
+                self.pending.discard(self._key(asin, seller_id, tag))
+
+    def stats(self):
+        with self.lock:
+            return {
+                'entries': len(self.entries or {}),
+                'pending': len(self.pending),
+                'hits': self.hits_count,
+                'misses': self.misses_count,
+            }
+
 def get_product_url(asin, seller_id=None):
     smid = sellers.get(seller_id, {}).get('smid') if seller_id else None
-    if not smid and len(seller_id) in [13, 14] and seller_id.isalnum():
+    if not smid and seller_id and len(seller_id) in [13, 14] and seller_id.isalnum():
         smid = seller_id
     return f"https://{amazon_host}/dp/{asin}/?aod=0{f'&smid={smid}' if smid else ''}"
 
 def get_affiliate_link(asin, amazon_tag, seller_id=None):
     smid = sellers.get(seller_id, {}).get('smid') if seller_id else None
-    if not smid and len(seller_id) in [13, 14] and seller_id.isalnum():
+    if not smid and seller_id and len(seller_id) in [13, 14] and seller_id.isalnum():
         smid = seller_id
     return f"https://{amazon_host}/dp/{asin}/?offerta_selezionata_da={bot_name}{f'&smid={smid}' if smid else ''}&tag={amazon_tag}"
 
 
-class pricesdrop_bot(threading.Thread):
-    def __init__(self, amazon_host, amazon_tag, product, stop_event):
+class price_history_log:
+    """
+    Append-only price history of a product: one JSON line [price, ISO timestamp] per price change, in data/<ASIN>_price_history.jsonl.
+    The file is only rewritten by compact(), atomically, to drop the lines left truncated by a crash.
+    """
+    def __init__(self, asin, data_dir="data", compact_every=1000):
+        self.asin = asin
+        self.path = os.path.join(data_dir, f"{asin}_price_history.jsonl")
+        self.legacy_path = os.path.join(data_dir, f"{asin}_price_history.json")
+        self.compact_every = compact_every
+        self.appends_count = 0
+        self.needs_newline = False
+        self.lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path) and os.path.exists(self.legacy_path):
+            self._convert_legacy_file()
+        if not os.path.exists(self.path):
+            return
+
+        corrupted_count = 0
+        last_line = ""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            for line in f:
+                last_line = line
+                try:
+                    price, timestamp = json.loads(line)
+                    yield (price, datetime.fromisoformat(timestamp))
+                except ValueError:
+                    corrupted_count += 1
+        self.needs_newline = bool(last_line) and not last_line.endswith("\n")
+
+        if corrupted_count:
+            log(f"Skipped {corrupted_count} corrupted line(s) in {self.path}, compacting it.", self.asin)
+            self.compact()
+
+    def _convert_legacy_file(self):
+        with open(self.legacy_path, 'r', encoding='utf-8') as f:
+            legacy_history = json.load(f)
+        self._rewrite([(item[0], datetime.fromisoformat(item[1])) for item in legacy_history])
+        os.replace(self.legacy_path, f"{self.legacy_path}.bak")
+        log(f"Converted {self.legacy_path} ({len(legacy_history)} entries) to {self.path}.", self.asin)
+
+    def append(self, price, timestamp):
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self.needs_newline:
+                    f.write("\n")
+                    self.needs_newline = False
+                f.write(json.dumps([price, timestamp.isoformat()]) + "\n")
+            self.appends_count += 1
+            compact = self.appends_count >= self.compact_every
+        if compact:
+            self.compact()
+
+    def compact(self):
+        with self.lock:
+            history = []
+            if os.path.exists(self.path):
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        try:
+                            price, timestamp = json.loads(line)
+                        except ValueError:
+                            continue
+                        # Keep only the actual price changes
+                        if history and history[-1][0] == price:
+                            continue
+                        history.append((price, datetime.fromisoformat(timestamp)))
+            self._rewrite(history)
+            self.appends_count = 0
+            self.needs_newline = False
+
+    def _rewrite(self, history):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for price, timestamp in history:
+                f.write(json.dumps([price, timestamp.isoformat()]) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+
+class price_statistics:
+    """
+    Running aggregates of a product's price history, updated in amortized O(1) for each price change.
+    The rolling window lows/highs are kept in monotonic deques of [price, since, until] entries, where until is the time of the
+    next price change (None for the current price), so that the price in effect at the start of a window is still accounted.
+    """
+    WINDOWS = {
+        "24h": timedelta(hours=24),
+        "7d": timedelta(days=7),
+        "30d": timedelta(days=30),
+    }
+    RECENT_CHANGES_WINDOW = timedelta(hours=24)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.last_entry = None
+        self.window_lows = {window_name: collections.deque() for window_name in self.WINDOWS}
+        self.window_highs = {window_name: collections.deque() for window_name in self.WINDOWS}
+        self.recent_changes = collections.deque() # Times of the price changes in the last RECENT_CHANGES_WINDOW
+
+    def add(self, price, timestamp):
+        with self.lock:
+            self.count += 1
+            self.total += price
+            if self.min is None or price < self.min[0]:
+                self.min = (price, timestamp)
+            if self.max is None or price > self.max[0]:
+                self.max = (price, timestamp)
+
+            if self.last_entry:
+                self.last_entry[2] = timestamp
+            entry = [price, timestamp, None]
+            self.last_entry = entry
+            for window_name in self.WINDOWS:
+                lows = self.window_lows[window_name]
+                while lows and lows[-1][0] >= price:
+                    lows.pop()
+                lows.append(entry)
+                highs = self.window_highs[window_name]
+                while highs and highs[-1][0] <= price:
+                    highs.pop()
+                highs.append(entry)
+            self.recent_changes.append(timestamp)
+            self._expire(timestamp)
+
+    def _expire(self, now):
+        for window_name, window_length in self.WINDOWS.items():
+            cutoff = now - window_length
+            for entries in (self.window_lows[window_name], self.window_highs[window_name]):
+                while entries and entries[0][2] is not None and entries[0][2] <= cutoff:
+                    entries.popleft()
+        while self.recent_changes and self.recent_changes[0] < now - self.RECENT_CHANGES_WINDOW:
+            self.recent_changes.popleft()
+
+    def recent_activity(self, now=None):
+        # Number of price changes in the last RECENT_CHANGES_WINDOW and time of the last change, for the adaptive polling
+        with self.lock:
+            self._expire(now or datetime.now())
+            return len(self.recent_changes), self.last_entry[1] if self.last_entry else None
+
+    def snapshot(self, now=None):
+        with self.lock:
+            self._expire(now or datetime.now())
+            return {
+                "count": self.count,
+                "avg_price": self.total / self.count if self.count else None,
+                "min": self.min,
+                "max": self.max,
+                "last": (self.last_entry[0], self.last_entry[1]) if self.last_entry else None,
+                "windows": {
+                    window_name: ((self.window_lows[window_name][0][0], self.window_lows[window_name][0][1]), (self.window_highs[window_name][0][0], self.window_highs[window_name][0][1]))
+                    for window_name in self.WINDOWS if self.window_lows[window_name]
+                },
+            }
+
+
+class price_history_store:
+    """
+    SQLite database with the price history of every product, shared by all the monitors and kept after a product is deleted.
+    Appends are queued and committed in batches by a single writer thread, reads open their own connection.
+    """
+    def __init__(self, path, batch_size=200, flush_interval=1.0):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS price_history (asin TEXT NOT NULL, price REAL NOT NULL, timestamp TEXT NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS price_history_asin_timestamp ON price_history (asin, timestamp)")
+            conn.execute("CREATE TABLE IF NOT EXISTS imported_files (file_name TEXT PRIMARY KEY, imported_at TEXT NOT NULL)")
+            conn.commit()
+        self.writer = threading.Thread(target=self._writer_loop, name="history-writer", daemon=True)
+        self.writer.start()
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, asin, price, timestamp):
+        self.queue.put((asin, price, timestamp.isoformat()))
+
+    def flush(self):
+        self.queue.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join()
+
+    def _writer_loop(self):
+        conn = self._connect()
+        stop = False
+        while not stop:
+            batch = [self.queue.get()]
+            deadline = time.time() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get(timeout=max(deadline - time.time(), 0)))
+                except queue.Empty:
+                    break
+            if batch[-1] is None:
+                stop = True
+            rows = [row for row in batch if row is not None]
+            try:
+                if rows:
+                    conn.executemany("INSERT INTO price_history (asin, price, timestamp) VALUES (?, ?, ?)", rows)
+                    conn.commit()
+            except sqlite3.Error as e:
+                log(f"Could not write {len(rows)} price history row(s) to {self.path}: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+        conn.close()
+
+    def load(self, asin):
+        with contextlib.closing(self._connect()) as conn:
+            for price, timestamp in conn.execute("SELECT price, timestamp FROM price_history WHERE asin = ? ORDER BY timestamp", (asin,)):
+                yield (price, datetime.fromisoformat(timestamp))
+
+    def summary(self, asin):
+        with contextlib.closing(self._connect()) as conn:
+            count, avg_price = conn.execute("SELECT COUNT(*), AVG(price) FROM price_history WHERE asin = ?", (asin,)).fetchone()
+            if not count:
+                return None
+            # SQLite returns the timestamp of the row holding the MIN()/MAX() value
+            min_price, min_timestamp = conn.execute("SELECT MIN(price), timestamp FROM price_history WHERE asin = ?", (asin,)).fetchone()
+            max_price, max_timestamp = conn.execute("SELECT MAX(price), timestamp FROM price_history WHERE asin = ?", (asin,)).fetchone()
+            last_price, last_timestamp = conn.execute("SELECT price, timestamp FROM price_history WHERE asin = ? ORDER BY timestamp DESC LIMIT 1", (asin,)).fetchone()
+        return {
+            "count": count,
+            "avg_price": avg_price,
+            "min": (min_price, datetime.fromisoformat(min_timestamp)),
+            "max": (max_price, datetime.fromisoformat(max_timestamp)),
+            "last": (last_price, datetime.fromisoformat(last_timestamp)),
+        }
+
+    def import_history_files(self, data_dir):
+        # One-shot migration of the per-product JSON/JSONL histories, every file is imported only once
+        with contextlib.closing(self._connect()) as conn:
+            imported_files = {row[0] for row in conn.execute("SELECT file_name FROM imported_files")}
+            for file_name in sorted(os.listdir(data_dir)):
+                match = re.fullmatch(r"(.+)_price_history\.(json|jsonl)", file_name)
+                if not match or file_name in imported_files:
+                    continue
+                asin = match.group(1)
+                try:
+                    if match.group(2) == "json":
+                        with open(os.path.join(data_dir, file_name), 'r', encoding='utf-8') as f:
+                            history = [(item[0], datetime.fromisoformat(item[1])) for item in json.load(f)]
+                    else:
+                        history = list(price_history_log(asin, data_dir).load())
+                except Exception as e:
+                    log(f"Could not import price history from {file_name}: {e}")
+                    continue
+                conn.executemany("INSERT INTO price_history (asin, price, timestamp) VALUES (?, ?, ?)", [(asin, price, timestamp.isoformat()) for price, timestamp in history])
+                conn.execute("INSERT INTO imported_files (file_name, imported_at) VALUES (?, ?)", (file_name, datetime.now().isoformat()))
+                conn.commit()
+                log(f"Imported {len(history)} price history entries for {asin} from {file_name} into {self.path}.")
+
+class price_history_store_log:
+    """
+    Per-product view of the price_history_store, with the same interface as price_history_log.
+    """
+    def __init__(self, store, asin):
+        self.store = store
+        self.asin = asin
+
+    def load(self):
+        return self.store.load(self.asin)
+
+    def append(self, price, timestamp):
+        self.store.append(self.asin, price, timestamp)
+
+def open_price_history(asin):
+    if history_store:
+        return price_history_store_log(history_store, asin)
+    return price_history_log(asin)
+
+
+class pricesdrop_bot:
+    def __init__(self, amazon_host, amazon_tag, product, stop_event, check_function=None):
         self.amazon_host=amazon_host
         self.amazon_tag=amazon_tag
-        self.product_name=product["name"]
         self.asin=product["asin"]
+        # Called with the monitor instead of scraping the product page, e.g. by the cluster tests
+        self.check_function = check_function
+        self.update_product(product)
+        self.previous_price = 0.0
+        self.previous_offer_xpath = None
+        self.stop_event = stop_event
+        self.last_price = None
+        self.last_check_time = None
+        self.last_available = True
+        self.history_log = open_price_history(self.asin)
+
+        self.price_stats = price_statistics()
+
+        # Load price history from file if it exists
+        try:
+            # Only the running statistics are kept in memory, not the whole history
+            for price, timestamp in self.history_log.load():
+                self.price_stats.add(price, timestamp)
+                self.last_price = price
+                self.last_check_time = timestamp
+            if self.last_price is not None:
+                self.previous_price = self.last_price # Initialize previous_price with the last known price
+                log(f"Initialized previous price for {self.product_name} to {self.previous_price:.2f} from history.", self.product_name)
+        except Exception as e:
+            log(f"Error loading price history for {self.asin}: {e}", self.product_name)
+
+    def update_product(self, product):
+        # Also used by /reload to change a running monitor in place, a check in progress sees the new values from its next step
+        self.product_name=product["name"]
         self.cut_price=product["cut_price"]
         self.autoaddtocart=product.get("autoaddtocart", False)
         self.autocheckout=product.get("autocheckout", False)
@@ -1000,192 +3280,397 @@ class pricesdrop_bot(threading.Thread):
         self.seller_id=product.get("seller_id", "amazon")
         object_state=product.get("object_state")
         self.object_state = [state.lower() for state in object_state] if object_state else []
-        self.previous_price = 0.0
-        self.previous_offer_xpath = None
-        self.stop_event = stop_event
         self.product_url = get_product_url(self.asin, self.seller_id)
-        self.last_price = None
-        self.last_check_time = None
-        self.price_history = []
-        self.history_file_path = os.path.join("data", f"{self.asin}_price_history.json")
 
-        # Load price history from file if it exists
-        if os.path.exists(self.history_file_path):
-            try:
-                with open(self.history_file_path, 'r', encoding='utf-8') as f:
-                    loaded_history = json.load(f)
-                    # Convert timestamps back to datetime objects
-                    self.price_history = [(item[0], datetime.fromisoformat(item[1])) for item in loaded_history]
-                    if self.price_history:
-                        self.last_price = self.price_history[-1][0]
-                        self.last_check_time = self.price_history[-1][1]
-                        self.previous_price = self.last_price # Initialize previous_price with the last known price
-                        log(f"Initialized previous price for {self.product_name} to {self.previous_price:.2f} from history.", self.product_name)
-            except Exception as e:
-                log(f"Error loading price history for {self.asin}: {e}", self.product_name)
-        threading.Thread.__init__(self)
+    def check(self):
+        log_id = self.product_name
+        if self.check_function:
+            self.check_function(self)
+            return
 
-    def _save_price_history(self):
-        # Convert datetime objects to ISO format strings for JSON serialization
-        serializable_history = [(item[0], item[1].isoformat()) for item in self.price_history]
-        with open(self.history_file_path, 'w', encoding='utf-8') as f:
-            json.dump(serializable_history, f, indent=4) 
+        # Cart actions need the page loaded in a browser, so these products always go through Selenium
+        if monitor_transport == "http" and not (self.autoaddtocart or self.autocheckout):
+            scraped_data = scrape_product_data_http(self.product_url, log_id, self.asin)
+            if scraped_data is not None:
+                self.check_product(None, log_id, scraped_data)
+                return
 
-    def run(self):
-        driver = create_chrome_driver(headless=True) # Always headless for monitoring 
+        # The driver is only held for the duration of the check, so that it can serve other monitors in the meantime
+        try:
+            with driver_pool.lease(log_id) as driver:
+                self.check_product(driver, log_id)
+        except operation_cancelled:
+            log("Check cancelled.", log_id)
+        except Exception as e:
+            log(f"Could not lease a Chrome driver: {e}", log_id)
 
-        # Always load cookies, as login is handled externally
-        driver.get(f"https://{self.amazon_host}/")
-        with open(".cookies.pkl", "rb") as f:
-            cookies = pickle.load(f)
-            for cookie in cookies:
-                if 'domain' in cookie:
-                    del cookie['domain']
-                driver.add_cookie(cookie)
-        driver.refresh()
+    def polling_weight(self, now=None):
+        """
+        How urgently the product needs to be checked again, relative to the other products (1.0 is a normal product).
+        Used by the adaptive polling to share the global request budget.
+        """
+        if not self.last_available:
+            return 0.25
+        now = now or datetime.now()
+        weight = 1.0
+
+        # Up to 4x when the price is within 20% of cut_price
+        if self.last_price and self.cut_price > 0:
+            gap = (self.last_price - self.cut_price) / self.cut_price
+            if gap < 0.2:
+                weight *= 1 + 3 * (1 - max(0.0, gap) / 0.2)
+
+        # Up to 4x for products whose price changed often in the last 24 hours, half for the ones that didn't change in a week
+        changes_count, last_change_time = self.price_stats.recent_activity(now)
+        if changes_count:
+            weight *= 1 + min(changes_count, 6) / 2
+        elif last_change_time and last_change_time < now - timedelta(days=7):
+            weight *= 0.5
+        return weight
+
+    def check_product(self, driver, log_id, scraped_data=None):
+        try:
+            if scraped_data is None:
+                scraped_data = scrape_product_data(driver, self.product_url, log_id, self.asin)
+            if self.stop_event.is_set():
+                return True
+
+            self.last_check_time = datetime.now()
+            current_price = scraped_data["current_price"]
+            self.last_available = current_price is not None and current_price > 0
+            if current_price > 0:
+                if self.last_price is None or current_price != self.last_price:
+                    self.last_price = current_price
+                    self.history_log.append(current_price, self.last_check_time)
+                    self.price_stats.add(current_price, self.last_check_time)
+
+            product_image_url = scraped_data["product_image_url"]
+            condition_text = scraped_data["condition_text"]
+            normalized_state = scraped_data["normalized_state"]
+            offer_container = scraped_data["offer_container"] # Keep for add to cart button
+            delivery_cost = scraped_data["delivery_cost"]
+
+            price_changed = current_price != self.previous_price
+
+            if current_price == -1.0:
+                log_message = f"Monitored offer state: '{condition_text}' (normalized: '{normalized_state}'), price: UNAVAILABLE"
+            elif current_price is None:
+                log_message = f"Monitored offer state: '{condition_text}' (normalized: '{normalized_state}'), price: ERROR_GETTING_PRICE"
+            else:
+                log_message = f"Monitored offer state: '{condition_text}' (normalized: '{normalized_state}'), price: {current_price:.2f}"
+
+            if current_price == -1.0:
+                if price_changed:
+                    log(f"{log_message}", log_id)
+            elif current_price is None:
+                if price_changed:
+                    log(f"{log_message} - ERROR: unable to get main offer's current price...", log_id)
+            elif self.object_state and normalized_state not in self.object_state:
+                if price_changed:
+                    log(f"{log_message} - SKIPPING: State not in desired list {self.object_state}", log_id)
+            elif current_price <= self.cut_price:
+                if price_changed:
+                    log(f"{log_message} - ACCEPTED: Price is low enough.", log_id)
+
+                    if self.autoaddtocart and not self.autocheckout:
+                        try:
+                            add_to_cart_button = offer_container.find_element(by=By.XPATH, value=".//input[@id='add-to-cart-button']")
+                            add_to_cart_button.click()
+                            log(f"!!! Just added to cart !!!", log_id)
+                        except NoSuchElementException:
+                            log(f"Could not find 'Add to Cart' button.", log_id)
+                    elif self.autocheckout:
+                        try:
+                            add_to_cart_button = offer_container.find_element(by=By.XPATH, value=".//input[@id='add-to-cart-button']")
+                            add_to_cart_button.click()
+                            log(f"Added to cart, proceeding to checkout...", log_id)
+
+                            # Go to cart page
+                            amazon_limiter.acquire(log_id)
+                            driver.get(f"https://{self.amazon_host}/gp/cart/view.html")
+
+                            # Wait for the checkout button to be clickable and then click it
+                            checkout_button = WebDriverWait(driver, 10).until(
+                                EC.element_to_be_clickable((By.XPATH, '//*[@id="sc-buy-box-ptc-button"]/span/input'))
+                            )
+                            checkout_button.click()
+                            log(f"Clicked 'Proceed to Checkout' button.", log_id)
+
+                            # Wait for either the next button or the final order button to be clickable
+                            wait = WebDriverWait(driver, 10)
+                            element = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="a-autoid-0-announce"] | //*[@id="submitOrderButtonId"]/span/input')))
+
+                            # Check which element was found and click it
+                            if element.tag_name == 'input':
+                                # This is the final order button
+                                element.click()
+                                log(f"!!! Successfully placed order !!!", log_id)
+                            else:
+                                # This is the generic next button
+                                element.click()
+                                log(f"Clicked generic next button (a-autoid-0-announce).", log_id)
+                                # Now wait for the final button
+                                place_order_button = WebDriverWait(driver, 10).until(
+                                    EC.element_to_be_clickable((By.XPATH, '//*[@id="submitOrderButtonId"]/span/input'))
+                                )
+                                place_order_button.click()
+                                log(f"!!! Successfully placed order !!!", log_id)
 
-        log_id = self.product_name
+                            # After placing the order, the monitoring for this product should stop.
+                            self.stop_event.set()
 
-        log(f"Monitoring product '{self.product_name}' ({self.asin}) started", log_id)
+                        except NoSuchElementException as e:
+                            log(f"Autocheckout failed: Could not find a required element. Error: {e}", log_id)
+                        except Exception as e:
+                            log(f"An unexpected error occurred during autocheckout: {e}", log_id)
 
-        first_run = True
-        while True:
-            if not first_run:
-                # Calculate sleep time
-                elapsed_time = time.time() - start_time
-                sleep_time = self.interval - elapsed_time
-                if sleep_time > 0:
-                    time.sleep(sleep_time + random.uniform(0, 3))
-            else:
-                first_run = False
+                    shortlink = shortlinks.get(self.asin, self.seller_id, self.amazon_tag, log_id)
+                    if not shortlink:
+                        shortlink = get_affiliate_link(self.asin, self.amazon_tag) # Fallback to full URL until the shortlink is generated
 
-            if self.stop_event.is_set():
-                break
-
-            start_time = time.time()
+                    message = f"{self.product_name} ({self.asin})"
+                    message += f"\n📉 Il prezzo è crollato: {current_price:.2f} EUR!"
+                    if delivery_cost is not None:
+                        message += f"\n🚚 Consegna: {delivery_cost:.2f} EUR"
+                    message += f"\nLink: {shortlink}"
+                    send_telegram_notification(message, image_url=product_image_url, log_id=log_id)
 
-            try:
-                scraped_data = scrape_product_data(driver, self.product_url, log_id, self.asin)
-                if self.stop_event.is_set():
-                    break
+            else:
+                if price_changed:
+                    log(f"{log_message} - SKIPPING: The current price is not low enough (i.e. > {self.cut_price:.2f})", log_id)
 
-                self.last_check_time = datetime.now()
-                current_price = scraped_data["current_price"]
-                if current_price > 0:
-                    if self.last_price is None or current_price != self.last_price:
-                        self.last_price = current_price
-                        self.price_history.append((current_price, self.last_check_time))
-                        self._save_price_history()
-
-                product_image_url = scraped_data["product_image_url"]
-                condition_text = scraped_data["condition_text"]
-                normalized_state = scraped_data["normalized_state"]
-                offer_container = scraped_data["offer_container"] # Keep for add to cart button
-                delivery_cost = scraped_data["delivery_cost"]
-
-                price_changed = current_price != self.previous_price
-
-                if current_price == -1.0:
-                    log_message = f"Monitored offer state: '{condition_text}' (normalized: '{normalized_state}'), price: UNAVAILABLE"
-                elif current_price is None:
-                    log_message = f"Monitored offer state: '{condition_text}' (normalized: '{normalized_state}'), price: ERROR_GETTING_PRICE"
-                else:
-                    log_message = f"Monitored offer state: '{condition_text}' (normalized: '{normalized_state}'), price: {current_price:.2f}"
-
-                if current_price == -1.0:
-                    if price_changed:
-                        log(f"{log_message}", log_id)
-                elif current_price is None:
-                    if price_changed:
-                        log(f"{log_message} - ERROR: unable to get main offer's current price...", log_id)
-                elif self.object_state and normalized_state not in self.object_state:
-                    if price_changed:
-                        log(f"{log_message} - SKIPPING: State not in desired list {self.object_state}", log_id)
-                elif current_price <= self.cut_price:
-                    if price_changed:
-                        log(f"{log_message} - ACCEPTED: Price is low enough.", log_id)
-
-                        if self.autoaddtocart and not self.autocheckout:
-                            try:
-                                add_to_cart_button = offer_container.find_element(by=By.XPATH, value=".//input[@id='add-to-cart-button']")
-                                add_to_cart_button.click()
-                                log(f"!!! Just added to cart !!!", log_id)
-                            except NoSuchElementException:
-                                log(f"Could not find 'Add to Cart' button.", log_id)
-                        elif self.autocheckout:
-                            try:
-                                add_to_cart_button = offer_container.find_element(by=By.XPATH, value=".//input[@id='add-to-cart-button']")
-                                add_to_cart_button.click()
-                                log(f"Added to cart, proceeding to checkout...", log_id)
-
-                                # Go to cart page
-                                driver.get(f"https://{self.amazon_host}/gp/cart/view.html")
-
-                                # Wait for the checkout button to be clickable and then click it
-                                checkout_button = WebDriverWait(driver, 10).until(
-                                    EC.element_to_be_clickable((By.XPATH, '//*[@id="sc-buy-box-ptc-button"]/span/input'))
-                                )
-                                checkout_button.click()
-                                log(f"Clicked 'Proceed to Checkout' button.", log_id)
-
-                                # Wait for either the next button or the final order button to be clickable
-                                wait = WebDriverWait(driver, 10)
-                                element = wait.until(EC.element_to_be_clickable((By.XPATH, '//*[@id="a-autoid-0-announce"] | //*[@id="submitOrderButtonId"]/span/input')))
-
-                                # Check which element was found and click it
-                                if element.tag_name == 'input':
-                                    # This is the final order button
-                                    element.click()
-                                    log(f"!!! Successfully placed order !!!", log_id)
-                                else:
-                                    # This is the generic next button
-                                    element.click()
-                                    log(f"Clicked generic next button (a-autoid-0-announce).", log_id)
-                                    # Now wait for the final button
-                                    place_order_button = WebDriverWait(driver, 10).until(
-                                        EC.element_to_be_clickable((By.XPATH, '//*[@id="submitOrderButtonId"]/span/input'))
-                                    )
-                                    place_order_button.click()
-                                    log(f"!!! Successfully placed order !!!", log_id)
-
-                                # After placing the order, the monitoring for this product should stop.
-                                self.stop_event.set()
-
-                            except NoSuchElementException as e:
-                                log(f"Autocheckout failed: Could not find a required element. Error: {e}", log_id)
-                            except Exception as e:
-                                log(f"An unexpected error occurred during autocheckout: {e}", log_id)
-
-                        shortlink = generate_shortlink(driver, self.asin, log_id)
-                        if not shortlink:
-                            shortlink = get_affiliate_link(self.asin, self.amazon_tag) # Fallback to full URL if shortlink generation fails
-                    
-                        message = f"{self.product_name} ({self.asin})"
-                        message += f"\n📉 Il prezzo è crollato: {current_price:.2f} EUR!"
-                        if delivery_cost is not None:
-                            message += f"\n🚚 Consegna: {delivery_cost:.2f} EUR"
-                        message += f"\nLink: {shortlink}"
-                        send_telegram_notification(message, image_url=product_image_url, log_id=log_id)
-                    
-                else:
-                    if price_changed:
-                        log(f"{log_message} - SKIPPING: The current price is not low enough (i.e. > {self.cut_price:.2f})", log_id)
-                
-                # Update previous_price after all processing for the current iteration
-                self.previous_price = current_price
-
-                if self.stop_event.is_set(): # If main offer was processed and bought, exit
-                    break
+            # Update previous_price after all processing for the current iteration
+            self.previous_price = current_price
 
-            except Exception as e:
-                exc_type, exc_value, exc_tb = sys.exc_info()
-                file_name = exc_tb.tb_frame.f_code.co_filename
-                line_number = exc_tb.tb_lineno
-                log(f"Error finding offers: {e} at file {file_name} line {line_number}", log_id)
+        except operation_cancelled:
+            raise
+        except Exception as e:
+            exc_type, exc_value, exc_tb = sys.exc_info()
+            file_name = exc_tb.tb_frame.f_code.co_filename
+            line_number = exc_tb.tb_lineno
+            log(f"Error finding offers: {e} at file {file_name} line {line_number}", log_id)
+            if driver is not None:
                 driver.refresh()
-                time.sleep(2 + random.uniform(0, 3))
-            
-        driver.quit()
+            return False
+
+        return True
+
+class monitor_scheduler:
+    """
+    Runs the checks of all the monitored products from a single heap keyed by the next due time.
+    Due checks are dispatched to a fixed-size pool of workers, so the number of threads doesn't grow with the watchlist.
+    With the adaptive polling mode the products' intervals are ignored: requests_per_minute is shared among the products
+    in proportion to their polling weight, each product being checked every min_interval to max_interval seconds.
+    """
+    def __init__(self, workers_count, polling_mode="fixed", requests_per_minute=60, min_interval=15, max_interval=900):
+        self.workers_count = max(1, workers_count)
+        self.polling_mode = polling_mode
+        self.requests_per_minute = requests_per_minute
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.weights = {} # asin -> polling weight of the last check
+        self.adaptive_intervals = None # asin -> planned interval with the adaptive polling, recomputed when a weight changes
+        self.budget_warned = False
+        self.intervals = {} # asin -> interval before the next check
+        self.last_starts = {} # asin -> start time of the last check
+        self.check_lags = {} # asin -> time between the last two checks minus the interval
+        self.free_workers = self.workers_count
+        self.heap = []
+        self.entries = {} # asin -> heap entry [due_time, seq, monitor], removed entries are left in the heap with monitor = None
+        self.running = {} # asin -> monitor being checked right now
+        self.seq = itertools.count()
+        self.cond = threading.Condition()
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers_count, thread_name_prefix="monitor")
+        self.dispatched_count = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.last_lag = 0.0
+        self.dispatcher = threading.Thread(target=self._dispatch_loop, name="monitor-scheduler", daemon=True)
+        self.dispatcher.start()
+
+    def _push(self, monitor, due_time):
+        entry = [due_time, next(self.seq), monitor]
+        self.entries[monitor.asin] = entry
+        heapq.heappush(self.heap, entry)
+        self.cond.notify()
+
+    def add(self, monitor, due_time=None):
+        weight = monitor.polling_weight()
+        with self.cond:
+            self._remove_entry(monitor.asin)
+            self._set_weight(monitor.asin, weight)
+            self._push(monitor, time.time() if due_time is None else due_time)
+
+    def _remove_entry(self, asin):
+        entry = self.entries.pop(asin, None)
+        if entry:
+            entry[-1] = None
+            # Drop the stale entries once they are the majority of the heap
+            if len(self.heap) > 2 * len(self.entries) + 64:
+                self.heap = [e for e in self.heap if e[-1] is not None]
+                heapq.heapify(self.heap)
+
+    def update(self, monitor):
+        # The product settings changed: refresh its polling weight and, with fixed intervals, move its next check according to the new interval
+        weight = monitor.polling_weight()
+        with self.cond:
+            if monitor.asin not in self.weights:
+                return
+            self._set_weight(monitor.asin, weight)
+            if self.polling_mode == "fixed" and monitor.asin in self.entries:
+                self.intervals[monitor.asin] = monitor.interval
+                last_start = self.last_starts.get(monitor.asin)
+                self._remove_entry(monitor.asin)
+                self._push(monitor, time.time() if last_start is None else last_start + monitor.interval)
+
+    def remove(self, asin):
+        with self.cond:
+            self._remove_entry(asin)
+            if self.weights.pop(asin, None) is not None:
+                self.adaptive_intervals = None
+            self.intervals.pop(asin, None)
+            self.last_starts.pop(asin, None)
+            self.check_lags.pop(asin, None)
+
+    def reschedule(self, asin, due_time=None):
+        with self.cond:
+            entry = self.entries.get(asin)
+            if entry:
+                monitor = entry[-1]
+                self._remove_entry(asin)
+                self._push(monitor, time.time() if due_time is None else due_time)
+
+    def wait_until_idle(self, asins, timeout=None):
+        # Wait for the in-flight checks of the products to complete, returns the ones still running after timeout seconds
+        asins = set(asins)
+        with self.cond:
+            self.cond.wait_for(lambda: not asins & self.running.keys(), timeout=timeout)
+            return asins & self.running.keys()
+
+    def _dispatch_loop(self):
+        while True:
+            with self.cond:
+                while True:
+                    while self.heap and self.heap[0][-1] is None:
+                        heapq.heappop(self.heap)
+                    if self.heap and self.free_workers > 0:
+                        wait_time = self.heap[0][0] - time.time()
+                        if wait_time <= 0:
+                            break
+                        self.cond.wait(wait_time)
+                    else:
+                        self.cond.wait()
+
+                due_time, _, monitor = heapq.heappop(self.heap)
+                del self.entries[monitor.asin]
+                self.running[monitor.asin] = monitor
+                self.free_workers -= 1
+
+                lag = time.time() - due_time
+                self.dispatched_count += 1
+                self.total_lag += lag
+                self.max_lag = max(self.max_lag, lag)
+                self.last_lag = lag
+
+            self.executor.submit(self._run_check, monitor)
+
+    def _set_weight(self, asin, weight):
+        # Called with the lock held
+        if self.weights.get(asin) != weight:
+            self.weights[asin] = weight
+            self.adaptive_intervals = None
+
+    def _adaptive_interval(self, asin):
+        # Called with the lock held
+        if self.adaptive_intervals is None:
+            self.adaptive_intervals = self._plan_adaptive_intervals()
+        return self.adaptive_intervals.get(asin, self.max_interval)
+
+    def _plan_adaptive_intervals(self):
+        """
+        Shares requests_per_minute among the products: each one is checked at level * weight checks per minute, bounded by
+        min_interval and max_interval, with the level found by bisection so that the checks add up to the budget at most.
+        When the budget can't even check every product every max_interval seconds, the intervals are stretched beyond it.
+        """
+        if not self.weights:
+            return {}
+        min_rate = 60 / self.max_interval
+        max_rate = 60 / self.min_interval
+        budget = max(self.requests_per_minute, 1e-6)
+        products_count = len(self.weights)
+
+        if products_count * min_rate > budget:
+            if not self.budget_warned:
+                log(f"POLLING_BUDGET ({self.requests_per_minute:.0f}/min) is too low to check {products_count} products every {self.max_interval:.0f}s, checking each one every {60 * products_count / budget:.0f}s instead.")
+                self.budget_warned = True
+            return {asin: 60 * products_count / budget for asin in self.weights}
+        self.budget_warned = False
+        if products_count * max_rate <= budget:
+            return {asin: self.min_interval for asin in self.weights}
+
+        def rate(level, weight):
+            return min(max_rate, max(min_rate, level * weight))
+
+        low, high = 0.0, max_rate / max(min(self.weights.values()), 1e-6)
+        for _ in range(50):
+            level = (low + high) / 2
+            if sum(rate(level, weight) for weight in self.weights.values()) > budget:
+                high = level
+            else:
+                low = level
+        return {asin: 60 / rate(low, weight) for asin, weight in self.weights.items()}
+
+    def _run_check(self, monitor):
+        start_time = time.time()
+        with self.cond:
+            last_start = self.last_starts.get(monitor.asin)
+            if last_start is not None:
+                self.check_lags[monitor.asin] = start_time - last_start - self.intervals.get(monitor.asin, monitor.interval)
+            self.last_starts[monitor.asin] = start_time
+        try:
+            with cancellable(monitor.stop_event), tracer.trace("check", f"{monitor.product_name} ({monitor.asin})"):
+                monitor.check()
+        except operation_cancelled:
+            log("Check cancelled.", monitor.product_name)
+        except Exception as e:
+            log(f"Unexpected error while checking product: {e}", monitor.product_name)
+        finally:
+            metrics.observe("pricesdrop_check_seconds", time.time() - start_time, asin=monitor.asin)
+            weight = monitor.polling_weight() if self.polling_mode == "adaptive" else 1.0
+            with self.cond:
+                self.free_workers += 1
+                # A restarted product can already have a new check running, if the previous one outlived its stop timeout
+                if self.running.get(monitor.asin) is monitor:
+                    del self.running[monitor.asin]
+                # Stopped monitors (deleted, or bought by autocheckout) are not scheduled anymore
+                if not monitor.stop_event.is_set() and monitor.asin not in self.entries and monitor.asin in self.weights:
+                    if self.polling_mode == "adaptive":
+                        self._set_weight(monitor.asin, weight)
+                        interval = self._adaptive_interval(monitor.asin)
+                    else:
+                        interval = monitor.interval
+                    self.intervals[monitor.asin] = interval
+                    self._push(monitor, start_time + interval + random.uniform(0, 3))
+                self.cond.notify_all()
+
+    def check_lags_snapshot(self):
+        with self.cond:
+            return dict(self.check_lags)
+
+    def stats(self):
+        with self.cond:
+            return {
+                "products": len(self.entries) + len(self.running),
+                "running": len(self.running),
+                "workers": self.workers_count,
+                "dispatched": self.dispatched_count,
+                "avg_lag": self.total_lag / self.dispatched_count if self.dispatched_count else 0.0,
+                "max_lag": self.max_lag,
+                "last_lag": self.last_lag,
+                "polling_mode": self.polling_mode,
+                "budget": self.requests_per_minute,
+                "planned_rate": sum(60 / interval for interval in self.intervals.values()),
+            }
 
 def load_products_from_toml():
     products_file = 'products.toml'
@@ -1224,56 +3709,185 @@ def load_sellers_from_toml():
     return sellers_toml
 
 def start_monitoring_product(product_data):
+    with monitors_lock:
+        return _start_monitoring_product(product_data)
+
+def _start_monitoring_product(product_data):
     asin = product_data['asin']
-    if asin in active_threads:
+    if asin in active_monitors:
         log(f"Product {asin} is already being monitored.")
-        return
+        return False
+    if cluster and not cluster.claim(asin):
+        log(f"Product {asin} is already being monitored by another node.")
+        return False
 
     log(f"Starting monitoring product '{product_data['name']}' ({asin}): {('buy it' if product_data.get('autocheckout') else ('add it to cart' if product_data.get('autoaddtocart') else 'notify it'))} if price drops under {product_data['cut_price']:.2f}...")
     stop_event = threading.Event()
-    t = pricesdrop_bot(
+    monitor = pricesdrop_bot(
         amazon_host=amazon_host, 
         amazon_tag=amazon_tag, 
         product=product_data,
-        stop_event=stop_event
+        stop_event=stop_event,
+        check_function=cluster.check_function if cluster else None
     )
-    t.start()
-    active_threads[asin] = {'thread': t, 'stop_event': stop_event, 'product_data': product_data}
+    active_monitors[asin] = {'monitor': monitor, 'stop_event': stop_event, 'product_data': product_data}
+    scheduler.add(monitor)
+    prefill_shortlink(monitor)
+    return True
+
+def update_monitoring_product(product_data):
+    with monitors_lock:
+        _update_monitoring_product(product_data)
+
+def _update_monitoring_product(product_data):
+    asin = product_data['asin']
+    monitor = active_monitors[asin]['monitor']
+    monitor.update_product(product_data)
+    active_monitors[asin]['product_data'] = product_data
+    scheduler.update(monitor)
+    prefill_shortlink(monitor)
+    log(f"Updated monitoring product '{product_data['name']}' ({asin}): {('buy it' if product_data.get('autocheckout') else ('add it to cart' if product_data.get('autoaddtocart') else 'notify it'))} if price drops under {product_data['cut_price']:.2f}...")
+
+def prefill_shortlink(monitor):
+    # A monitor with its own check function never loads Amazon pages, nor needs a browser for the shortlink
+    if monitor.check_function is None:
+        shortlinks.prefill(monitor.asin, monitor.seller_id, monitor.amazon_tag)
 
 def stop_monitoring_product(asin):
-    if asin not in active_threads:
-        log(f"Product {asin} is not being monitored.")
+    with monitors_lock:
+        if asin not in active_monitors:
+            log(f"Product {asin} is not being monitored.")
+            return
+        asins = _detach_monitors([asin])
+    _await_monitors_stopped(asins)
+
+def stop_monitoring_products(asins, timeout=None):
+    """
+    Stops the monitors of the given products together: all of them are signalled first, so that their in-flight checks
+    are cancelled at their next wait point, then they are awaited with a single deadline of timeout seconds.
+    monitors_lock is only held while the monitors are signalled, not while they are awaited.
+    """
+    with monitors_lock:
+        asins = _detach_monitors(asins)
+    _await_monitors_stopped(asins, timeout)
+
+def _detach_monitors(asins):
+    # Called with monitors_lock held: signals the monitors and forgets them, returns the ASINs to pass to _await_monitors_stopped
+    asins = [asin for asin in asins if asin in active_monitors]
+    if asins:
+        log(f"Stopping monitoring for {len(asins)} product(s)...")
+    for asin in asins:
+        active_monitors.pop(asin)['stop_event'].set()
+        scheduler.remove(asin)
+    return asins
+
+def _await_monitors_stopped(asins, timeout=None):
+    # Called without monitors_lock, so that the commands and the lease refresh don't wait for the checks being cancelled
+    if not asins:
         return
+    timeout = stop_timeout if timeout is None else timeout
+    still_running = scheduler.wait_until_idle(asins, timeout=timeout)
+    if cluster:
+        # The other nodes can take the products over right away, instead of waiting for the leases to expire.
+        # Not the products monitored again in the meantime, they hold the same lease
+        with monitors_lock:
+            cluster.release([asin for asin in asins if asin not in active_monitors])
+    if still_running:
+        log(f"The check of {len(still_running)} product(s) was still running after {timeout:.1f}s, it will be discarded when done: {', '.join(sorted(still_running))}")
+    log(f"Stopped monitoring for {len(asins)} product(s): {', '.join(asins)}.")
+
+def reload_products(new_products_list):
+    """
+    Applies a new product list to the running monitors (in a shard worker only the products of its shard, on a cluster node its share of them).
+    Returns how many products were removed, added, updated in place and restarted.
+    """
+    with monitors_lock:
+        result, stopping_asins, products_to_restart = _reload_products(new_products_list)
+    _finish_reload(stopping_asins, products_to_restart)
+    return result
+
+def _reload_products(new_products_list):
+    # Called with monitors_lock held: the removed and restarted monitors are only signalled here, _finish_reload awaits them
+    # and starts the restarted ones again
+    new_products_map = {p['asin']: p for p in select_shard_products(new_products_list)}
+    new_asins = set(new_products_map.keys())
+    current_asins = set(active_monitors.keys())
+
+    asins_to_remove = current_asins - new_asins
+    asins_to_add = new_asins - current_asins
+    asins_to_check = current_asins.intersection(new_asins)
+
+    # The removed products are stopped in parallel
+    stopping_asins = _detach_monitors(list(asins_to_remove))
+
+    added_count = sum(_start_monitoring_product(new_products_map[asin]) for asin in asins_to_add)
+    if added_count:
+        log(f"Started monitoring {added_count} new product(s).")
+
+    updated_count = 0
+    asins_to_restart = []
+    for asin in asins_to_check:
+        old_product_data = active_monitors[asin].get('product_data')
+        new_product_data = new_products_map[asin]
+
+        if old_product_data != new_product_data:
+            monitor = active_monitors[asin]['monitor']
+            # Thresholds, interval, cart actions and object states are applied to the running monitor,
+            # it is restarted only if it has to check another page
+            if get_product_url(asin, new_product_data.get("seller_id", "amazon")) != monitor.product_url:
+                log(f"Product {asin} URL has changed. Restarting its monitoring.")
+                asins_to_restart.append(asin)
+            else:
+                _update_monitoring_product(new_product_data)
+                updated_count += 1
+    stopping_asins += _detach_monitors(asins_to_restart)
+
+    if updated_count > 0:
+        log(f"Updated {updated_count} product(s) with the new configuration.")
+    result = {"removed": len(asins_to_remove), "added": added_count, "updated": updated_count, "restarted": len(asins_to_restart)}
+    return result, stopping_asins, [new_products_map[asin] for asin in asins_to_restart]
 
-    log(f"Stopping monitoring for product {asin}...")
-    active_threads[asin]['stop_event'].set()
-    active_threads[asin]['thread'].join()
-    del active_threads[asin]
-    log(f"Stopped monitoring for product {asin}.")
+def _finish_reload(stopping_asins, products_to_restart):
+    _await_monitors_stopped(stopping_asins)
+    restarted_count = sum(start_monitoring_product(product_data) for product_data in products_to_restart)
+    if restarted_count:
+        log(f"Restarted {restarted_count} product(s) whose seller has changed.")
+
+def shutdown_bot(timeout):
+    """
+    Stops everything in about timeout seconds: the in-flight checks and commands are cancelled, the price history and the selectors
+    are flushed to disk, the queued notifications are sent while there is time left and every Chrome driver is quit.
+    """
+    deadline = time.monotonic() + timeout
+    log(f"Shutting down (timeout {timeout:.1f}s)...")
+    shutdown_event.set()
+
+    if supervisor:
+        # The workers' notifications keep being sent until they are all gone
+        supervisor.stop(timeout=timeout / 2)
+    stop_monitoring_products(list(active_monitors), timeout=timeout / 2)
+    if cluster:
+        cluster.stop()
+    command_jobs.executor.shutdown(wait=False, cancel_futures=True)
+    # The leases of the checks that didn't notice the cancellation in time end when their driver is quit
+    driver_pool.shutdown(timeout=max(0.0, deadline - time.monotonic()) / 2)
+
+    if history_store:
+        history_store.close()
+    xpath_selectors.flush()
+    notifier.close(timeout=max(0.0, deadline - time.monotonic()))
+    log("Shutdown complete.")
 
 def amazon_monitor_main(monitoring_started_event):
-    if os.path.exists(".cookies.pkl"):
+    if amazon_cookies.exists():
         log("Cookies file found. Checking session validity...")
-        check_driver = create_chrome_driver(headless=True)
-        check_driver.get(f"https://{amazon_host}/")
-        with open(".cookies.pkl", "rb") as f:
-            cookies = pickle.load(f)
-            for cookie in cookies:
-                if 'domain' in cookie:
-                    del cookie['domain']
-                check_driver.add_cookie(cookie)
-        
-        check_driver.get(f"https://{amazon_host}/gp/css/homepage.html")
-        time.sleep(2) # Give time for redirection
-        
-        if "signin" in check_driver.current_url:
+        if not amazon_cookies.validate():
             log("Session from cookies is invalid. Deleting cookies and performing new login.")
-            os.remove(".cookies.pkl")
+            amazon_cookies.invalidate()
         else:
             log("Session is valid.")
-        check_driver.quit()
 
-    if not os.path.exists(".cookies.pkl"):
+    if not amazon_cookies.exists():
         log("No cookies found. Performing login in non-headless mode...")
         login_driver = create_chrome_driver(headless=False)
 
@@ -1290,8 +3904,7 @@ def amazon_monitor_main(monitoring_started_event):
         input("Please complete the login on the browser. If you have to complete a 2FA, do it. Once you are logged in, press Enter here to continue...") # Wait for user to complete login and 2FA (if any)
 
         # Save cookies to avoid always performing login+2FA
-        with open(".cookies.pkl", "wb") as f:
-            pickle.dump(login_driver.get_cookies(), f)
+        amazon_cookies.save(login_driver.get_cookies())
         login_driver.quit() # Quit the non-headless driver after login
         log("Login completed and cookies saved.")
 
@@ -1305,13 +3918,398 @@ def amazon_monitor_main(monitoring_started_event):
     if not os.path.exists("data"):
         os.makedirs("data")
 
-    for item in products:
-        start_monitoring_product(item)
+    if history_backend == "sqlite":
+        global history_store
+        history_store = price_history_store(history_db_path)
+        history_store.import_history_files("data")
+
+    if supervisor:
+        supervisor.start()
+    elif cluster:
+        cluster.start()
+    else:
+        for item in products:
+            start_monitoring_product(item)
 
     # Signal that monitoring has started
     monitoring_started_event.set()
     log("Amazon monitoring initial setup complete. Telegram bot can now start.")
 
+def shard_of(asin, shards_count):
+    # crc32 rather than hash(), which is salted differently in every process
+    return zlib.crc32(asin.encode()) % shards_count
+
+def select_shard_products(products):
+    if cluster:
+        return cluster.select(products)
+    if shard_index is None:
+        return products
+    return [product for product in products if shard_of(product['asin'], shards) == shard_index]
+
+def call_monitors(function_name, *args, asin=None):
+    """
+    Runs one of the shard_functions where the monitors live: in this process, or in sharded mode on the worker owning asin,
+    or on every worker when asin is None. Returns the list of the results.
+    """
+    if supervisor is None:
+        return [shard_functions[function_name](*args)]
+    if asin is None:
+        return supervisor.call_all(function_name, *args)
+    try:
+        return [supervisor.call(shard_of(asin, supervisor.shards_count), function_name, *args)]
+    except Exception as e:
+        log(f"Shard worker call {function_name} failed for {asin}: {e}")
+        return []
+
+class shard_supervisor:
+    """
+    Runs the monitors in shards_count worker processes, each one owning the products whose ASIN hashes to its shard,
+    so that a hung chromedriver or a slow parse only affects the products of one worker.
+    Crashed workers are restarted, the workers' notifications are sent by the Telegram process, and the Telegram commands
+    reach the monitors through call() and call_all().
+    """
+    def __init__(self, shards_count, call_timeout=60, restart_delay=5):
+        self.shards_count = shards_count
+        self.call_timeout = call_timeout
+        self.restart_delay = restart_delay
+        # Forked workers would inherit the locks of this process' threads, but not the threads
+        self.context = multiprocessing.get_context("spawn")
+        self.events = self.context.Queue()
+        self.processes = [None] * shards_count
+        self.commands = [None] * shards_count
+        self.started_times = [0.0] * shards_count
+        self.restarts_count = [0] * shards_count
+        self.lock = threading.Lock()
+        self.pending_calls = {} # call id -> Future of the reply
+        self.call_ids = itertools.count()
+        self.stopping = False
+        self.events_thread = threading.Thread(target=self._events_loop, name="shard-events", daemon=True)
+
+    def start(self):
+        for index in range(self.shards_count):
+            self._start_worker(index)
+        self.events_thread.start()
+        threading.Thread(target=self._watchdog_loop, name="shard-watchdog", daemon=True).start()
+
+    def _start_worker(self, index):
+        # A restarted worker gets a new command queue, the calls sent to the dead one time out
+        self.commands[index] = self.context.Queue()
+        process = self.context.Process(target=shard_worker_main, args=(index, self.commands[index], self.events), name=f"shard-{index}")
+        process.start()
+        self.processes[index] = process
+        self.started_times[index] = time.time()
+        log(f"Started shard worker {index} (pid {process.pid}).")
+
+    def _watchdog_loop(self):
+        while not shutdown_event.wait(1):
+            for index, process in enumerate(self.processes):
+                if self.stopping or process.is_alive():
+                    continue
+                if time.time() - self.started_times[index] < self.restart_delay:
+                    continue # Don't restart a crashing worker in a tight loop
+                log(f"Shard worker {index} exited with code {process.exitcode}, restarting it.")
+                self.restarts_count[index] += 1
+                self._start_worker(index)
+
+    def _events_loop(self):
+        while True:
+            event = self.events.get()
+            if event is None:
+                break
+            try:
+                if event[0] == "notification":
+                    _, message, image_url, log_id = event
+                    notifier.send(message, image_url=image_url, log_id=log_id)
+                elif event[0] == "reply":
+                    _, call_id, ok, result = event
+                    with self.lock:
+                        future = self.pending_calls.pop(call_id, None)
+                    if future:
+                        if ok:
+                            future.set_result(result)
+                        else:
+                            future.set_exception(RuntimeError(result))
+            except Exception as e:
+                log(f"Error handling shard worker event {event[0]}: {e}")
+
+    def call(self, index, function_name, *args, timeout=None):
+        future = concurrent.futures.Future()
+        with self.lock:
+            call_id = next(self.call_ids)
+            self.pending_calls[call_id] = future
+        try:
+            self.commands[index].put((call_id, function_name, args))
+            return future.result(timeout=timeout or self.call_timeout)
+        finally:
+            with self.lock:
+                self.pending_calls.pop(call_id, None)
+
+    def call_all(self, function_name, *args):
+        # The workers run the call in parallel, the results of the workers that failed or are down are left out
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.shards_count, thread_name_prefix="shard-call") as executor:
+            futures = [executor.submit(self.call, index, function_name, *args) for index in range(self.shards_count)]
+        results = []
+        for index, future in enumerate(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                log(f"Shard worker {index} call {function_name} failed: {e!r}")
+        return results
+
+    def stop(self, timeout):
+        # Every worker runs its own shutdown, the ones still alive at the deadline are killed
+        self.stopping = True
+        deadline = time.monotonic() + timeout
+        for commands in self.commands:
+            if commands is not None:
+                commands.put((None, "stop", (timeout * 0.8,)))
+        for process in self.processes:
+            if process is not None:
+                process.join(max(0.0, deadline - time.monotonic()))
+        for index, process in enumerate(self.processes):
+            if process is not None and process.is_alive():
+                log(f"Shard worker {index} didn't stop in {timeout:.1f}s, killing it.")
+                process.kill()
+        self.events.put(None)
+        if self.events_thread.is_alive():
+            self.events_thread.join(max(0.0, deadline - time.monotonic()))
+
+    def stats(self):
+        return [
+            {
+                "index": index,
+                "pid": process.pid if process else None,
+                "alive": bool(process and process.is_alive()),
+                "uptime": time.time() - self.started_times[index],
+                "restarts": self.restarts_count[index],
+            }
+            for index, process in enumerate(self.processes)
+        ]
+
+def create_shard_rate_limiter():
+    # In sharded mode, the Telegram process (for the commands) and each worker get the same share of AMAZON_RATE_LIMIT
+    return amazon_rate_limiter(requests_per_minute=amazon_rate_limit / (shards + 1), burst=max(1, amazon_rate_burst // (shards + 1)))
+
+def shard_worker_main(index, commands, events):
+    """
+    Entry point of a shard worker process: monitors its share of products.toml and runs the calls of the Telegram process
+    until it is asked to stop, or gets SIGTERM.
+    """
+    global shard_index, shard_events, history_store, amazon_limiter
+    shard_index = index
+    shard_events = events
+    signal.signal(signal.SIGINT, signal.SIG_IGN) # Ctrl+C reaches the whole process group, the supervisor stops the workers itself
+    signal.signal(signal.SIGTERM, lambda signum, frame: shutdown_event.set())
+
+    # The Amazon request budgets are for the whole bot, so they are split among the workers
+    amazon_limiter = create_shard_rate_limiter()
+    scheduler.requests_per_minute = polling_budget / shards
+    if metrics_port:
+        start_metrics_server(metrics_host, metrics_port + 1 + index)
+    if history_backend == "sqlite":
+        history_store = price_history_store(history_db_path)
+
+    products = select_shard_products(load_products_from_toml() or [])
+    for product in products:
+        start_monitoring_product(product)
+    log(f"Shard worker started, monitoring {len(products)} product(s).")
+
+    timeout = shutdown_timeout
+    while not shutdown_event.is_set():
+        try:
+            call_id, function_name, args = commands.get(timeout=1)
+        except queue.Empty:
+            continue
+        if function_name == "stop":
+            timeout = args[0]
+            break
+        try:
+            result, ok = shard_functions[function_name](*args), True
+        except Exception as e:
+            result, ok = f"{type(e).__name__}: {e}", False
+        events.put(("reply", call_id, ok, result))
+    shutdown_bot(timeout)
+
+class asin_lease_store:
+    """
+    Time-limited ASIN leases shared by the nodes monitoring the same watchlist, in a SQLite database that all of them can open
+    (a stand-in for a coordination server, the expiry times assume the nodes' clocks are in sync).
+    A node keeps its products by renewing their leases; when it dies they expire and the other nodes take the products over.
+    The nodes' notifications are queued in an outbox, sent by the node running the Telegram bot.
+    """
+    def __init__(self, path, node_id, ttl=60):
+        self.path = path
+        self.node_id = node_id
+        self.ttl = ttl
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS leases (asin TEXT PRIMARY KEY, node_id TEXT NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS nodes (node_id TEXT PRIMARY KEY, heartbeat_at REAL NOT NULL, products_count INTEGER NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS outbox (id INTEGER PRIMARY KEY AUTOINCREMENT, created_at REAL NOT NULL, message TEXT NOT NULL, image_url TEXT, log_id TEXT)")
+
+    def _connect(self):
+        # Autocommit mode, the read-modify-write operations open their own BEGIN IMMEDIATE transaction
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def heartbeat(self, products_count):
+        # Returns the number of live nodes, this one included
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("INSERT OR REPLACE INTO nodes (node_id, heartbeat_at, products_count) VALUES (?, ?, ?)", (self.node_id, now, products_count))
+            conn.execute("DELETE FROM nodes WHERE heartbeat_at < ?", (now - 10 * self.ttl,))
+            return conn.execute("SELECT COUNT(*) FROM nodes WHERE heartbeat_at > ?", (now - self.ttl,)).fetchone()[0]
+
+    def claim(self, asin):
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            row = conn.execute("SELECT node_id, expires_at FROM leases WHERE asin = ?", (asin,)).fetchone()
+            if row and row[0] != self.node_id and row[1] > now:
+                conn.execute("ROLLBACK")
+                return False
+            conn.execute("INSERT OR REPLACE INTO leases (asin, node_id, expires_at) VALUES (?, ?, ?)", (asin, self.node_id, now + self.ttl))
+            conn.execute("COMMIT")
+            return True
+
+    def renew(self, asins):
+        # Extends the leases still held by this node, returns the ASINs whose lease was taken by another node
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            held = {row[0] for row in conn.execute("SELECT asin FROM leases WHERE node_id = ?", (self.node_id,))}
+            conn.execute("UPDATE leases SET expires_at = ? WHERE node_id = ?", (now + self.ttl, self.node_id))
+            conn.execute("COMMIT")
+        return [asin for asin in asins if asin not in held]
+
+    def release(self, asins):
+        with contextlib.closing(self._connect()) as conn:
+            conn.executemany("DELETE FROM leases WHERE asin = ? AND node_id = ?", [(asin, self.node_id) for asin in asins])
+
+    def leave(self):
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("DELETE FROM leases WHERE node_id = ?", (self.node_id,))
+            conn.execute("DELETE FROM nodes WHERE node_id = ?", (self.node_id,))
+
+    def owners(self):
+        # asin -> node holding a lease that hasn't expired
+        with contextlib.closing(self._connect()) as conn:
+            return dict(conn.execute("SELECT asin, node_id FROM leases WHERE expires_at > ?", (time.time(),)))
+
+    def push_notification(self, message, image_url=None, log_id=None):
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("INSERT INTO outbox (created_at, message, image_url, log_id) VALUES (?, ?, ?, ?)", (time.time(), message, image_url, log_id))
+
+    def pop_notifications(self, limit=100):
+        with contextlib.closing(self._connect()) as conn:
+            conn.execute("BEGIN IMMEDIATE")
+            rows = conn.execute("SELECT id, message, image_url, log_id FROM outbox ORDER BY id LIMIT ?", (limit,)).fetchall()
+            conn.executemany("DELETE FROM outbox WHERE id = ?", [(row[0],) for row in rows])
+            conn.execute("COMMIT")
+        return [row[1:] for row in rows]
+
+    def snapshot(self):
+        now = time.time()
+        with contextlib.closing(self._connect()) as conn:
+            leases = dict(conn.execute("SELECT node_id, COUNT(*) FROM leases WHERE expires_at > ? GROUP BY node_id", (now,)))
+            nodes = [
+                {"node_id": node_id, "heartbeat_age": now - heartbeat_at, "alive": now - heartbeat_at < self.ttl, "products": products_count, "leases": leases.get(node_id, 0)}
+                for node_id, heartbeat_at, products_count in conn.execute("SELECT node_id, heartbeat_at, products_count FROM nodes ORDER BY node_id")
+            ]
+            outbox = conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+        return {"nodes": nodes, "outbox": outbox}
+
+def select_leased_products(store, products, held_asins, live_nodes):
+    """
+    The products a node should monitor: the ones it holds, then free ones (never leased, released or expired),
+    up to its fair share of the watchlist. Nodes above their share drop the extra products, so that a new node gets some.
+    """
+    owners = store.owners()
+    fair_share = (len(products) + live_nodes - 1) // max(1, live_nodes)
+    held = [product for product in products if product['asin'] in held_asins]
+    free = [product for product in products if product['asin'] not in held_asins and product['asin'] not in owners]
+    random.shuffle(free) # Nodes refreshing at the same time don't all go for the same products
+    return (held + free)[:fair_share]
+
+class cluster_node:
+    """
+    Makes this process one of the nodes sharing the watchlist through store: every refresh_interval seconds it renews its leases,
+    stops the products it lost and applies its share of products.toml with reload_products.
+    The sender node (the one running the Telegram bot) also sends the notifications of the other nodes.
+    check_function is passed to the node's monitors, and on_lease(kind, asins) is called with "claim" after the leases are
+    claimed and with "release" before they are released.
+    """
+    def __init__(self, store, is_sender, refresh_interval=None, check_function=None, on_lease=None):
+        self.store = store
+        self.is_sender = is_sender
+        self.refresh_interval = refresh_interval or store.ttl / 3
+        self.check_function = check_function
+        self.on_lease = on_lease
+        self.live_nodes = 1
+
+    def start(self):
+        self.refresh()
+        threading.Thread(target=self._refresh_loop, name="cluster-leases", daemon=True).start()
+        if self.is_sender:
+            threading.Thread(target=self._outbox_loop, name="cluster-outbox", daemon=True).start()
+
+    def select(self, products):
+        return select_leased_products(self.store, products, set(active_monitors), self.live_nodes)
+
+    def claim(self, asin):
+        claimed = self.store.claim(asin)
+        if claimed and self.on_lease:
+            self.on_lease("claim", [asin])
+        return claimed
+
+    def release(self, asins):
+        if asins and self.on_lease:
+            self.on_lease("release", asins)
+        self.store.release(asins)
+
+    def refresh(self):
+        # Under monitors_lock, so that the commands don't change the monitors between the renewal and the selection.
+        # The stopped monitors are awaited after it is released
+        stopping_asins, products_to_restart = [], []
+        with monitors_lock:
+            self.live_nodes = self.store.heartbeat(len(active_monitors))
+            lost = self.store.renew(list(active_monitors))
+            if lost:
+                log(f"Leases taken over by another node, stopping: {', '.join(lost)}")
+                stopping_asins = _detach_monitors(lost)
+            products = load_products_from_toml()
+            if products is not None:
+                _, reloaded_asins, products_to_restart = _reload_products(products)
+                stopping_asins += reloaded_asins
+        _finish_reload(stopping_asins, products_to_restart)
+
+    def _refresh_loop(self):
+        while not shutdown_event.wait(self.refresh_interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                log(f"Could not refresh the ASIN leases: {e}")
+
+    def _outbox_loop(self):
+        while not shutdown_event.wait(1):
+            try:
+                for message, image_url, log_id in self.store.pop_notifications():
+                    notifier.send(message, image_url=image_url, log_id=log_id)
+            except Exception as e:
+                log(f"Could not read the notifications of the other nodes: {e}")
+
+    def stop(self):
+        self.store.leave()
+
+# What the Telegram commands can run on the monitors, see call_monitors
+shard_functions = {
+    "start_monitoring_product": start_monitoring_product,
+    "stop_monitoring_product": stop_monitoring_product,
+    "reload_products": reload_products,
+    "get_monitors_list": get_monitors_list,
+    "get_product_info": get_product_info,
+    "get_process_stats": get_process_stats,
+}
+
 
 bot_name = os.getenv("TELEGRAM_BOT_NAME") or "pricesdrop.it"
 bot_token = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -1322,26 +4320,133 @@ amazon_tag=os.getenv("AMAZON_TAG") or "pricesdrop-21"
 amazon_email=os.getenv("AMAZON_EMAIL")
 amazon_psw=os.getenv("AMAZON_PASSWORD")
 
-
-# Load products from TOML file
-products = load_products_from_toml()
-if products is None:
-    sys.exit()
+chrome_pool_size=int(os.getenv("CHROME_POOL_SIZE") or 4)
+monitor_workers=int(os.getenv("MONITOR_WORKERS") or chrome_pool_size)
+monitor_transport=(os.getenv("MONITOR_TRANSPORT") or "selenium").lower()
+scrape_engine=(os.getenv("SCRAPE_ENGINE") or "webdriver").lower()
+history_backend=(os.getenv("HISTORY_BACKEND") or "jsonl").lower()
+history_db_path=os.getenv("HISTORY_DB") or os.path.join("data", "history.db")
+telegram_api_url=os.getenv("TELEGRAM_API_URL") or "https://api.telegram.org"
+notification_queue_size=int(os.getenv("NOTIFICATION_QUEUE_SIZE") or 1000)
+command_concurrency=int(os.getenv("COMMAND_CONCURRENCY") or 2)
+rufus_cache_ttl=float(os.getenv("RUFUS_CACHE_TTL") or 7 * 24 * 3600)
+rufus_cache_size=int(os.getenv("RUFUS_CACHE_SIZE") or 1000)
+amazon_rate_limit=float(os.getenv("AMAZON_RATE_LIMIT") or 120)
+amazon_rate_burst=int(os.getenv("AMAZON_RATE_BURST") or 10)
+polling_mode=(os.getenv("POLLING_MODE") or "fixed").lower()
+polling_budget=float(os.getenv("POLLING_BUDGET") or 60)
+min_poll_interval=float(os.getenv("MIN_POLL_INTERVAL") or 15)
+max_poll_interval=float(os.getenv("MAX_POLL_INTERVAL") or 900)
+browser_profile=(os.getenv("BROWSER_PROFILE") or "full").lower()
+lean_page_load_strategy=(os.getenv("LEAN_PAGE_LOAD_STRATEGY") or "eager").lower()
+lean_blocked_urls=[url.strip() for url in (os.getenv("LEAN_BLOCKED_URLS") or "").split(",") if url.strip()]
+lean_allowed_urls=[url.strip() for url in (os.getenv("LEAN_ALLOWED_URLS") or "").split(",") if url.strip()]
+metrics_host=os.getenv("METRICS_HOST") or "127.0.0.1"
+metrics_port=int(os.getenv("METRICS_PORT") or 0)
+slow_traces_kept=int(os.getenv("SLOW_TRACES_KEPT") or 10)
+stop_timeout=float(os.getenv("STOP_TIMEOUT") or 15)
+shutdown_timeout=float(os.getenv("SHUTDOWN_TIMEOUT") or 10)
+shards=max(1, int(os.getenv("SHARDS") or 1))
+cluster_db=os.getenv("CLUSTER_DB")
+node_id=os.getenv("NODE_ID") or f"{platform.node()}-{os.getpid()}"
+lease_ttl=float(os.getenv("LEASE_TTL") or 60)
+
+shard_index = None # Set in the shard worker processes
+shard_events = None
+supervisor = None
+cluster = None
+
+metrics = metrics_registry()
+tracer = span_tracer(max_slow_traces=slow_traces_kept)
 
 sellers = load_sellers_from_toml()
 
-active_threads = {}
+active_monitors = {}
+# Held by whatever starts, stops or updates monitors: the commands, /reload and the cluster refresh.
+# The readers only iterate over copies of active_monitors.
+monitors_lock = threading.RLock()
+shutdown_event = threading.Event()
+
+waits = wait_strategies(load_wait_policies_from_toml())
+
+amazon_cookies = amazon_session()
+
+driver_pool = chrome_driver_pool(max_size=chrome_pool_size, profile=browser_profile)
+amazon_limiter = amazon_rate_limiter(requests_per_minute=amazon_rate_limit, burst=amazon_rate_burst)
+scheduler = monitor_scheduler(workers_count=monitor_workers, polling_mode=polling_mode, requests_per_minute=polling_budget, min_interval=min_poll_interval, max_interval=max_poll_interval)
+
+amazon_http_session = None
+amazon_http_session_lock = threading.Lock()
+compiled_xpaths = {}
+
+history_store = None
+
+notifier = telegram_notifier(bot_token, chat_id, api_url=telegram_api_url, max_queue_size=notification_queue_size)
+command_jobs = command_job_queue(max_concurrency=command_concurrency)
+rufus_cache = rufus_answer_cache(os.path.join("data", "rufus_cache.json"), ttl=rufus_cache_ttl, max_entries=rufus_cache_size)
+shortlinks = shortlink_cache(os.path.join("data", "shortlinks.json"))
+xpath_selectors = selector_registry(os.path.join("data", "selectors.json"), marketplace=amazon_host)
+register_metrics()
 
 if __name__ == '__main__':
+    if "--notification-benchmark" in sys.argv:
+        run_notification_benchmark()
+        sys.exit()
+
+    if "--browser-profile-benchmark" in sys.argv:
+        # ASINs can be given after the option, otherwise the enabled products are used
+        benchmark_asins = sys.argv[sys.argv.index("--browser-profile-benchmark") + 1:]
+        if not benchmark_asins:
+            benchmark_asins = [product['asin'] for product in load_products_from_toml() or []]
+        run_browser_profile_benchmark(benchmark_asins)
+        sys.exit()
+
+    # Load products from TOML file
+    products = load_products_from_toml()
+    if products is None:
+        sys.exit()
+
+    if metrics_port:
+        start_metrics_server(metrics_host, metrics_port)
+
     monitoring_started_event = threading.Event()
 
+    if cluster_db:
+        # The node started without --node runs the Telegram bot, and sends the notifications of all the nodes
+        cluster = cluster_node(asin_lease_store(cluster_db, node_id, ttl=lease_ttl), is_sender="--node" not in sys.argv)
+        if shards > 1:
+            log("SHARDS is ignored on cluster nodes, start more nodes instead.")
+    elif "--node" in sys.argv:
+        log("--node needs CLUSTER_DB, the database shared by the nodes.")
+        sys.exit()
+    elif shards > 1:
+        # The login and the history import are done once here, the workers are started once they are done
+        supervisor = shard_supervisor(shards)
+        amazon_limiter = create_shard_rate_limiter()
+
     # Start Amazon monitoring in a separate thread
     amazon_thread = threading.Thread(target=amazon_monitor_main, args=(monitoring_started_event,))
     amazon_thread.start()
 
     # Wait for Amazon monitoring to complete its initial setup
     monitoring_started_event.wait()
+
+    if "--node" in sys.argv:
+        # Monitoring only, until Ctrl+C or SIGTERM
+        signal.signal(signal.SIGTERM, lambda signum, frame: shutdown_event.set())
+        log(f"Cluster node {node_id} running.")
+        try:
+            while not shutdown_event.wait(1):
+                pass
+        except KeyboardInterrupt:
+            pass
+        shutdown_bot(shutdown_timeout)
+        sys.exit()
+
     log("Telegram bot starting...")
 
-    # Run Telegram bot in the main thread
-    telegram_bot_main()
+    # Run Telegram bot in the main thread, it returns on SIGINT or SIGTERM
+    try:
+        telegram_bot_main()
+    finally:
+        shutdown_bot(shutdown_timeout)
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# main.py reads and creates its files (sellers.toml, data/...) in the working directory when it is imported
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(tempfile.mkdtemp(prefix="pricesdrop-tests-"))
+os.makedirs("data", exist_ok=True)
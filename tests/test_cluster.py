@@ -0,0 +1,143 @@
+import collections
+import multiprocessing
+import os
+import queue
+import signal
+import time
+
+import pytest
+import toml
+
+import main
+
+NODES_COUNT = 3
+PRODUCTS_COUNT = 30
+TTL = 1.5
+DURATION = 18
+
+
+def run_node(index, path, ttl, events):
+    """
+    A node process: a real cluster_node monitoring the products.toml of the current directory, whose checks send a simulated
+    price drop notification. Reports the leases it claims and releases and the notifications to events, until it gets SIGTERM.
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: main.shutdown_event.set())
+
+    def on_lease(kind, asins):
+        event_time = time.time()
+        for asin in asins:
+            events.put((kind, index, asin, event_time))
+
+    def check(monitor):
+        main.send_telegram_notification(f"Simulated price drop for {monitor.asin}", log_id=monitor.product_name)
+        events.put(("notification", index, monitor.asin, time.time()))
+
+    main.cluster = main.cluster_node(main.asin_lease_store(path, f"node-{index}", ttl=ttl), is_sender=False, check_function=check, on_lease=on_lease)
+    main.cluster.start()
+    main.shutdown_event.wait()
+    main.shutdown_bot(ttl)
+
+
+def drain(events, received):
+    while True:
+        try:
+            received.append(events.get_nowait())
+        except queue.Empty:
+            return
+
+
+def lease_conflicts(received, killed, kill_time, end_time):
+    # Lease intervals per product, the ones still open end with the kill or the end of the run
+    intervals = collections.defaultdict(list)
+    open_intervals = {}
+    for kind, index, asin, event_time in sorted(received, key=lambda event: event[3]):
+        if kind == "claim":
+            open_intervals.setdefault((index, asin), event_time)
+        elif kind == "release" and (index, asin) in open_intervals:
+            intervals[asin].append((open_intervals.pop((index, asin)), event_time, index))
+    for (index, asin), claim_time in open_intervals.items():
+        intervals[asin].append((claim_time, kill_time if index == killed else end_time, index))
+
+    conflicts = []
+    for asin, asin_intervals in intervals.items():
+        asin_intervals.sort()
+        for (_, end, index), (next_start, _, next_index) in zip(asin_intervals, asin_intervals[1:]):
+            if index != next_index and next_start < end:
+                conflicts.append((asin, index, next_index))
+    return conflicts
+
+
+@pytest.fixture
+def cluster_run(tmp_path, monkeypatch):
+    """
+    NODES_COUNT node processes share a lease database and PRODUCTS_COUNT products checked every TTL seconds, the first node
+    is killed halfway without releasing its leases, like a crashed node.
+    """
+    monkeypatch.chdir(tmp_path)
+    asins = [f"SIM{i:07d}" for i in range(PRODUCTS_COUNT)]
+    with open("products.toml", "w", encoding="utf-8") as f:
+        toml.dump({f"Simulated product {i}": {"asin": asin, "cut_price": 1.0, "interval": TTL} for i, asin in enumerate(asins)}, f)
+    os.makedirs("data", exist_ok=True)
+    path = str(tmp_path / "cluster.db")
+    sender_store = main.asin_lease_store(path, "sender", ttl=TTL)
+
+    context = multiprocessing.get_context("spawn")
+    # One queue per node, the killed node could leave a shared one locked
+    events = [context.Queue() for _ in range(NODES_COUNT)]
+    processes = [context.Process(target=run_node, args=(index, path, TTL, events[index])) for index in range(NODES_COUNT)]
+    for process in processes:
+        process.start()
+
+    received = []
+    delivered = 0
+    killed = 0
+    kill_time = None
+    takeover_time = None
+    try:
+        start_time = time.time()
+        while time.time() - start_time < DURATION:
+            time.sleep(TTL / 3)
+            for node_events in events:
+                drain(node_events, received)
+            delivered += len(sender_store.pop_notifications(limit=10000))
+            owners = sender_store.owners()
+            covered = sum(1 for asin in asins if owners.get(asin, f"node-{killed}") != f"node-{killed}")
+            if kill_time is None and time.time() - start_time >= DURATION / 2:
+                kill_time = time.time()
+                processes[killed].kill()
+            elif kill_time is not None and takeover_time is None and covered == PRODUCTS_COUNT:
+                takeover_time = time.time() - kill_time
+    finally:
+        for process in processes:
+            process.terminate()
+        end_time = time.time()
+        for index, process in enumerate(processes):
+            # Drained before the join, a node exits only once its queue is flushed
+            while process.is_alive() or not events[index].empty():
+                try:
+                    received.append(events[index].get(timeout=0.5))
+                except queue.Empty:
+                    if time.time() - end_time > 4 * TTL:
+                        process.kill()
+            process.join()
+    delivered += len(sender_store.pop_notifications(limit=10000))
+
+    return {
+        "conflicts": lease_conflicts(received, killed, kill_time, end_time),
+        "takeover_time": takeover_time,
+        "delivered": delivered,
+        "sent": sum(1 for event in received if event[0] == "notification"),
+        "claimed": {asin for kind, _, asin, _ in received if kind == "claim"},
+    }
+
+
+def test_nodes_share_the_watchlist_without_double_leases(cluster_run):
+    assert cluster_run["conflicts"] == []
+    assert cluster_run["claimed"] == {f"SIM{i:07d}" for i in range(PRODUCTS_COUNT)}
+    # The products of the killed node are taken over once its leases expire
+    assert cluster_run["takeover_time"] is not None
+    assert cluster_run["takeover_time"] <= 2 * TTL
+    # Every notification of the nodes goes through the outbox
+    assert cluster_run["sent"] > 0
+    assert cluster_run["delivered"] == cluster_run["sent"]
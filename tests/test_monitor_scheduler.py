@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+import main
+
+
+def create_scheduler(budget, weights, min_interval=15, max_interval=900):
+    scheduler = main.monitor_scheduler(workers_count=1, polling_mode="adaptive", requests_per_minute=budget, min_interval=min_interval, max_interval=max_interval)
+    with scheduler.cond:
+        for asin, weight in weights.items():
+            scheduler._set_weight(asin, weight)
+    return scheduler
+
+
+def planned_rate(intervals):
+    return sum(60 / interval for interval in intervals.values())
+
+
+@pytest.mark.parametrize("seed", range(5))
+@pytest.mark.parametrize("budget", [40, 120, 1000])
+def test_mixed_weights_stay_within_the_budget(seed, budget):
+    rng = random.Random(seed)
+    weights = {f"ASIN{i:06d}": rng.choice([0.125, 0.25, 0.5, 1.0, 2.0, 4.0, 16.0]) for i in range(500)}
+    scheduler = create_scheduler(budget, weights)
+
+    intervals = scheduler._plan_adaptive_intervals()
+    assert planned_rate(intervals) <= budget * (1 + 1e-9)
+    # The budget is used, not just respected
+    assert planned_rate(intervals) >= budget * 0.99
+    assert all(15 <= interval <= 900 for interval in intervals.values())
+
+
+def test_heavier_products_are_checked_more_often():
+    weights = {"LIGHT": 0.25, "NORMAL": 1.0, "HEAVY": 4.0}
+    weights.update({f"ASIN{i:06d}": 1.0 for i in range(100)})
+    intervals = create_scheduler(60, weights)._plan_adaptive_intervals()
+
+    assert intervals["HEAVY"] < intervals["NORMAL"] < intervals["LIGHT"]
+
+
+def test_budget_below_the_maximum_interval():
+    # 1000 products every 900s at least would need 66.7 checks per minute
+    weights = {f"ASIN{i:06d}": [0.25, 1.0, 4.0][i % 3] for i in range(1000)}
+    scheduler = create_scheduler(30, weights)
+
+    intervals = scheduler._plan_adaptive_intervals()
+    assert planned_rate(intervals) <= 30 * (1 + 1e-9)
+    assert all(interval == pytest.approx(2000) for interval in intervals.values())
+    assert scheduler.budget_warned
+
+
+def test_everything_at_the_minimum_interval_when_the_budget_allows_it():
+    weights = {f"ASIN{i:06d}": 0.25 * (i + 1) for i in range(10)}
+    intervals = create_scheduler(60, weights)._plan_adaptive_intervals()
+
+    assert set(intervals.values()) == {15}
+
+
+def test_plan_is_recomputed_when_a_weight_changes():
+    weights = {f"ASIN{i:06d}": 1.0 for i in range(100)}
+    scheduler = create_scheduler(60, weights)
+    with scheduler.cond:
+        before = scheduler._adaptive_interval("ASIN000000")
+        scheduler._set_weight("ASIN000000", 4.0)
+        after = scheduler._adaptive_interval("ASIN000000")
+        assert planned_rate(scheduler.adaptive_intervals) <= 60 * (1 + 1e-9)
+
+    assert after < before
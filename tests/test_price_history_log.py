@@ -0,0 +1,64 @@
+import json
+import os
+from datetime import datetime, timedelta
+
+import main
+
+START = datetime(2024, 1, 1, 12, 0)
+
+
+def test_appends_are_loaded_back(tmp_path):
+    history_log = main.price_history_log("B000TEST01", data_dir=str(tmp_path))
+    history_log.append(10.0, START)
+    history_log.append(9.5, START + timedelta(hours=1))
+
+    reopened_log = main.price_history_log("B000TEST01", data_dir=str(tmp_path))
+    assert list(reopened_log.load()) == [(10.0, START), (9.5, START + timedelta(hours=1))]
+
+
+def test_truncated_last_line_is_skipped_and_compacted(tmp_path):
+    path = tmp_path / "B000TEST01_price_history.jsonl"
+    path.write_text(
+        json.dumps([10.0, START.isoformat()]) + "\n" +
+        json.dumps([9.5, (START + timedelta(hours=1)).isoformat()]) + "\n" +
+        '[9.0, "2024-01-01T14:0', # Crash in the middle of an append
+        encoding="utf-8")
+
+    history_log = main.price_history_log("B000TEST01", data_dir=str(tmp_path))
+    assert list(history_log.load()) == [(10.0, START), (9.5, START + timedelta(hours=1))]
+    assert path.read_text(encoding="utf-8").endswith("\n")
+
+    # The next append starts on a line of its own
+    history_log.append(8.0, START + timedelta(hours=3))
+    reopened_log = main.price_history_log("B000TEST01", data_dir=str(tmp_path))
+    assert list(reopened_log.load()) == [(10.0, START), (9.5, START + timedelta(hours=1)), (8.0, START + timedelta(hours=3))]
+
+
+def test_append_after_a_line_without_newline(tmp_path):
+    path = tmp_path / "B000TEST01_price_history.jsonl"
+    path.write_text(json.dumps([10.0, START.isoformat()]), encoding="utf-8")
+
+    history_log = main.price_history_log("B000TEST01", data_dir=str(tmp_path))
+    assert list(history_log.load()) == [(10.0, START)]
+    history_log.append(9.0, START + timedelta(hours=1))
+
+    assert path.read_text(encoding="utf-8").count("\n") == 2
+    assert list(main.price_history_log("B000TEST01", data_dir=str(tmp_path)).load()) == [(10.0, START), (9.0, START + timedelta(hours=1))]
+
+
+def test_compaction_keeps_only_price_changes(tmp_path):
+    history_log = main.price_history_log("B000TEST01", data_dir=str(tmp_path), compact_every=4)
+    for hours, price in enumerate([10.0, 10.0, 9.0, 9.0]):
+        history_log.append(price, START + timedelta(hours=hours))
+
+    assert list(history_log.load()) == [(10.0, START), (9.0, START + timedelta(hours=2))]
+
+
+def test_legacy_json_file_is_converted(tmp_path):
+    legacy_path = tmp_path / "B000TEST01_price_history.json"
+    legacy_path.write_text(json.dumps([[10.0, START.isoformat()], [9.0, (START + timedelta(days=1)).isoformat()]]), encoding="utf-8")
+
+    history_log = main.price_history_log("B000TEST01", data_dir=str(tmp_path))
+    assert list(history_log.load()) == [(10.0, START), (9.0, START + timedelta(days=1))]
+    assert not legacy_path.exists()
+    assert os.path.exists(f"{legacy_path}.bak")
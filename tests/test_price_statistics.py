@@ -0,0 +1,48 @@
+from datetime import datetime, timedelta
+
+import main
+
+
+def test_snapshot_aggregates():
+    start = datetime(2024, 1, 1)
+    stats = main.price_statistics()
+    for hours, price in [(0, 10.0), (1, 8.0), (2, 12.0), (3, 9.0)]:
+        stats.add(price, start + timedelta(hours=hours))
+
+    snapshot = stats.snapshot(now=start + timedelta(hours=4))
+    assert snapshot["count"] == 4
+    assert snapshot["avg_price"] == 9.75
+    assert snapshot["min"] == (8.0, start + timedelta(hours=1))
+    assert snapshot["max"] == (12.0, start + timedelta(hours=2))
+    assert snapshot["last"] == (9.0, start + timedelta(hours=3))
+
+
+def test_window_keeps_the_price_in_effect_at_its_start():
+    start = datetime(2024, 1, 1)
+    stats = main.price_statistics()
+    stats.add(5.0, start)
+    stats.add(20.0, start + timedelta(days=2))
+    stats.add(15.0, start + timedelta(days=3))
+
+    windows = stats.snapshot(now=start + timedelta(days=3, hours=12))["windows"]
+    # 20.0 was still the price 24 hours ago, 5.0 had already been replaced
+    assert windows["24h"] == ((15.0, start + timedelta(days=3)), (20.0, start + timedelta(days=2)))
+    assert windows["7d"] == ((5.0, start), (20.0, start + timedelta(days=2)))
+
+
+def test_recent_activity_only_keeps_the_last_24_hours():
+    start = datetime(2024, 1, 1)
+    stats = main.price_statistics()
+    for minutes in range(0, 30 * 24 * 60, 30):
+        stats.add(10.0 + minutes % 7, start + timedelta(minutes=minutes))
+    now = start + timedelta(days=30)
+
+    changes_count, last_change_time = stats.recent_activity(now)
+    assert changes_count == 48
+    assert last_change_time == start + timedelta(minutes=30 * 24 * 60 - 30)
+    assert len(stats.recent_changes) == 48
+
+
+def test_recent_activity_without_changes():
+    stats = main.price_statistics()
+    assert stats.recent_activity() == (0, None)
@@ -0,0 +1,56 @@
+import threading
+import time
+
+import pytest
+
+import main
+
+
+def test_burst_then_throttled_to_the_rate():
+    limiter = main.amazon_rate_limiter(requests_per_minute=600, burst=3)
+    for _ in range(3):
+        assert limiter.acquire() == 0.0
+
+    throttled_time = limiter.acquire()
+    assert 0.05 <= throttled_time <= 0.5
+    stats = limiter.stats()
+    assert (stats["requests"], stats["throttled"]) == (4, 1)
+
+
+def test_captcha_halves_the_rate_down_to_the_minimum():
+    limiter = main.amazon_rate_limiter(requests_per_minute=120, burst=10, min_rate_ratio=1 / 4)
+    limiter.on_captcha()
+    assert limiter.rate == pytest.approx(1.0)
+    # Every thread waits after a CAPTCHA, whatever was left in the bucket
+    assert limiter.tokens <= 0
+
+    for _ in range(5):
+        limiter.on_captcha()
+    assert limiter.rate == pytest.approx(0.5)
+    assert limiter.stats()["captchas"] == 6
+
+
+def test_rate_grows_back_by_a_tenth_per_interval():
+    limiter = main.amazon_rate_limiter(requests_per_minute=120, burst=10, increase_interval=60)
+    limiter.on_captcha()
+    captcha_time = limiter.last_adjust_time
+
+    with limiter.lock:
+        limiter._refill(captcha_time + 59)
+        assert limiter.rate == pytest.approx(1.0)
+        limiter._refill(captcha_time + 3 * 60)
+        assert limiter.rate == pytest.approx(1.6)
+        limiter._refill(captcha_time + 60 * 60)
+        assert limiter.rate == pytest.approx(2.0)
+
+
+def test_waiting_for_a_token_can_be_cancelled():
+    limiter = main.amazon_rate_limiter(requests_per_minute=1, burst=1)
+    limiter.acquire()
+    cancel_event = threading.Event()
+    threading.Timer(0.2, cancel_event.set).start()
+
+    start_time = time.monotonic()
+    with pytest.raises(main.operation_cancelled):
+        limiter.acquire(cancel_event=cancel_event)
+    assert time.monotonic() - start_time < 5
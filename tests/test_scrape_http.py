@@ -0,0 +1,88 @@
+import http.server
+import os
+import threading
+
+import pytest
+import requests
+
+import main
+
+PAGES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pages")
+
+
+def read_page(file_name):
+    with open(os.path.join(PAGES_DIR, file_name), "rb") as f:
+        return f.read()
+
+
+@pytest.fixture
+def amazon_stub(monkeypatch):
+    # Serves path -> (status, body), with a plain session and a limiter of its own instead of the bot's
+    pages = {}
+
+    class handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            status, body = pages.get(self.path, (404, b""))
+            self.send_response(status)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(main, "amazon_http_session", requests.Session())
+    monkeypatch.setattr(main, "amazon_limiter", main.amazon_rate_limiter(requests_per_minute=6000, burst=100))
+    yield pages, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+def test_saved_product_page(amazon_stub):
+    pages, url = amazon_stub
+    pages["/dp/B000TEST01"] = (200, read_page("product.html"))
+
+    scraped_data = main.scrape_product_data_http(f"{url}/dp/B000TEST01", "test", "B000TEST01")
+    assert scraped_data["product_name"] == "Caffè in grani 1 kg, confezione da 3"
+    assert scraped_data["current_price"] == 1234.56
+    assert scraped_data["items_count"] == 3
+    assert scraped_data["product_image_url"] == "https://m.media-amazon.com/images/I/caffe.jpg"
+    assert scraped_data["delivery_cost"] == 0.0
+    assert scraped_data["sold_by"] == "Torrefazione Esempio"
+    assert scraped_data["ships_from"] == "Amazon"
+    assert scraped_data["normalized_state"] == "new"
+    assert not scraped_data["is_unavailable"]
+
+
+def test_saved_unavailable_page(amazon_stub):
+    pages, url = amazon_stub
+    pages["/dp/B000TEST02"] = (200, read_page("unavailable.html"))
+
+    scraped_data = main.scrape_product_data_http(f"{url}/dp/B000TEST02", "test", "B000TEST02")
+    assert scraped_data["is_unavailable"]
+    assert scraped_data["product_name"] == "Macinacaffè manuale"
+
+
+@pytest.mark.parametrize("status, body", [
+    (200, b""), # lxml can't parse an empty document
+    (200, b"   \n  "),
+    (503, b"<html><body>Service Unavailable</body></html>"),
+    (200, b"<html><body><h4>Type the characters you see in this image</h4></body></html>"),
+    (200, b"<html><body><div id='qualifiedBuybox'>No price here</div></body></html>"),
+])
+def test_falls_back_to_the_browser(amazon_stub, status, body):
+    pages, url = amazon_stub
+    pages["/dp/B000TEST03"] = (status, body)
+
+    assert main.scrape_product_data_http(f"{url}/dp/B000TEST03", "test", "B000TEST03") is None
+
+
+def test_captcha_slows_the_rate_limiter_down(amazon_stub):
+    pages, url = amazon_stub
+    pages["/dp/B000TEST04"] = (200, b"<html><body><form action='/errors/validateCaptcha'></form></body></html>")
+
+    assert main.scrape_product_data_http(f"{url}/dp/B000TEST04", "test", "B000TEST04") is None
+    assert main.amazon_limiter.rate == main.amazon_limiter.max_rate / 2
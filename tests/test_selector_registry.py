@@ -0,0 +1,73 @@
+import main
+
+XPATHS = ["//span[@id='a']", "//span[@id='b']", "//span[@id='c']"]
+
+
+def create_registry(tmp_path, marketplace="amazon.it", **kwargs):
+    return main.selector_registry(str(tmp_path / "selectors.json"), marketplace=marketplace, **kwargs)
+
+
+def test_original_order_without_statistics(tmp_path):
+    registry = create_registry(tmp_path)
+    assert registry.candidates("price", XPATHS) == XPATHS
+    # Ties keep the original order too
+    registry.record("price", XPATHS, XPATHS[2])
+    assert registry.candidates("price", XPATHS) == [XPATHS[2], XPATHS[0], XPATHS[1]]
+
+
+def test_candidates_follow_the_recent_hit_rate(tmp_path):
+    registry = create_registry(tmp_path, decay=0.2)
+    for _ in range(10):
+        registry.record("price", XPATHS, XPATHS[1])
+    assert registry.candidates("price", XPATHS)[0] == XPATHS[1]
+
+    # The layout changed: the old hits decay and the new selector takes over
+    for _ in range(10):
+        registry.record("price", XPATHS, XPATHS[2])
+    assert registry.candidates("price", XPATHS) == [XPATHS[2], XPATHS[1], XPATHS[0]]
+
+
+def test_lookups_without_a_match_keep_the_scores(tmp_path):
+    registry = create_registry(tmp_path)
+    registry.record("unavailable", XPATHS, XPATHS[1])
+    score = registry.snapshot()["unavailable"][0]["score"]
+    for _ in range(100):
+        registry.record("unavailable", XPATHS, None)
+
+    selectors = registry.snapshot()["unavailable"]
+    assert selectors[0]["xpath"] == XPATHS[1]
+    assert selectors[0]["score"] == score
+    assert selectors[0]["hit_rate"] == 1 / 101
+
+
+def test_selector_that_stopped_matching_is_flagged(tmp_path):
+    registry = create_registry(tmp_path, stale_after_hits=5)
+    for _ in range(3):
+        registry.record("price", XPATHS, XPATHS[0])
+    for _ in range(4):
+        registry.record("price", XPATHS, XPATHS[1])
+    assert not registry.flagged
+
+    registry.record("price", XPATHS, XPATHS[1])
+    assert registry.flagged == {("price", XPATHS[0])}
+    stale = {selector["xpath"]: selector["stale"] for selector in registry.snapshot()["price"]}
+    # The fallback that never matched is not stale
+    assert stale == {XPATHS[0]: True, XPATHS[1]: False, XPATHS[2]: False}
+
+    # Matching again clears the flag
+    registry.record("price", XPATHS, XPATHS[0])
+    assert not registry.flagged
+    assert not any(selector["stale"] for selector in registry.snapshot()["price"])
+
+
+def test_statistics_are_saved_per_marketplace(tmp_path):
+    registry = create_registry(tmp_path, save_interval=0)
+    registry.record("price", XPATHS, XPATHS[2])
+    registry.flush()
+    other_registry = create_registry(tmp_path, marketplace="amazon.de", save_interval=0)
+    other_registry.record("price", XPATHS, XPATHS[1])
+    other_registry.flush()
+
+    assert create_registry(tmp_path).candidates("price", XPATHS)[0] == XPATHS[2]
+    assert create_registry(tmp_path, marketplace="amazon.de").candidates("price", XPATHS)[0] == XPATHS[1]
+    assert create_registry(tmp_path, marketplace="amazon.fr").candidates("price", XPATHS) == XPATHS
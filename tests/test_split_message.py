@@ -0,0 +1,64 @@
+import re
+
+import main
+
+
+def assert_balanced(chunk):
+    open_tags = []
+    for closing, tag in re.findall(r"<(/?)(\w+)[^>]*>", chunk):
+        if closing:
+            assert open_tags and open_tags.pop() == tag
+        else:
+            open_tags.append(tag)
+    assert not open_tags
+
+
+def test_short_text_is_a_single_chunk():
+    assert main.split_message("one\ntwo\n") == ["one\ntwo\n"]
+    assert main.split_message("") == [""]
+
+
+def test_splits_between_lines():
+    lines = [f"- entry {i:04d}\n" for i in range(1000)]
+    chunks = main.split_message("".join(lines), max_length=100)
+
+    assert "".join(chunks) == "".join(lines)
+    assert all(len(chunk) <= 100 for chunk in chunks)
+    assert all(chunk.endswith("\n") for chunk in chunks)
+
+
+def test_long_plain_line_is_cut():
+    chunks = main.split_message("x" * 5000)
+    assert [len(chunk) for chunk in chunks] == [4096, 904]
+
+
+def test_long_html_line_is_truncated_with_balanced_tags():
+    message = "<b>Title</b>\n" + "<b>" + "a" * 5000 + "</b>\n" + "- last <code>entry</code>\n"
+    chunks = main.split_message(message, parse_mode="HTML")
+
+    assert all(len(chunk) <= 4096 for chunk in chunks)
+    for chunk in chunks:
+        assert_balanced(chunk)
+    assert chunks[0].startswith("<b>Title</b>\n")
+    assert "…</b>\n" in "".join(chunks)
+    assert chunks[-1].endswith("- last <code>entry</code>\n")
+
+
+def test_html_truncation_keeps_tags_and_entities_whole():
+    line = "- 10.0% hits: <code>" + "//div[@id='x']&amp;" * 300 + "</code>\n"
+    truncated = main.truncate_html(line, 200)
+
+    assert len(truncated) <= 200
+    assert truncated.endswith("…</code>\n")
+    assert_balanced(truncated)
+    # No entity was cut in half
+    assert not re.search(r"&[^;]*…", truncated)
+
+
+def test_html_truncation_of_nested_tags():
+    line = "<b><i>" + "word " * 100 + "</i></b>"
+    truncated = main.truncate_html(line, 50)
+
+    assert len(truncated) <= 50
+    assert truncated.endswith("…</i></b>")
+    assert_balanced(truncated)
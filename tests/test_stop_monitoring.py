@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+
+import main
+
+
+class blocked_scheduler:
+    # The in-flight checks end when finish is set
+    def __init__(self):
+        self.finish = threading.Event()
+        self.waiting = threading.Event()
+        self.removed = []
+
+    def remove(self, asin):
+        self.removed.append(asin)
+
+    def wait_until_idle(self, asins, timeout=None):
+        self.waiting.set()
+        self.finish.wait(timeout)
+        return set() if self.finish.is_set() else set(asins)
+
+
+@pytest.fixture
+def monitors(monkeypatch):
+    scheduler = blocked_scheduler()
+    monkeypatch.setattr(main, "scheduler", scheduler)
+    monkeypatch.setattr(main, "active_monitors", {})
+    monkeypatch.setattr(main, "cluster", None)
+    for asin in ["B000TEST01", "B000TEST02"]:
+        main.active_monitors[asin] = {"monitor": None, "stop_event": threading.Event(), "product_data": {"asin": asin}}
+    yield scheduler
+    scheduler.finish.set()
+
+
+def test_lock_is_not_held_while_the_checks_are_awaited(monitors):
+    stop_events = [monitor_info["stop_event"] for monitor_info in main.active_monitors.values()]
+    stopping = threading.Thread(target=main.stop_monitoring_products, args=(["B000TEST01", "B000TEST02"],), kwargs={"timeout": 30})
+    stopping.start()
+    assert monitors.waiting.wait(5)
+
+    # The commands can still use the monitors, which are already signalled and gone
+    assert main.monitors_lock.acquire(timeout=1)
+    try:
+        assert main.active_monitors == {}
+        assert all(stop_event.is_set() for stop_event in stop_events)
+        assert monitors.removed == ["B000TEST01", "B000TEST02"]
+    finally:
+        main.monitors_lock.release()
+
+    monitors.finish.set()
+    stopping.join(5)
+    assert not stopping.is_alive()
+
+
+def test_stopping_an_unknown_product_does_not_wait(monitors):
+    main.stop_monitoring_product("B000UNKNWN")
+    main.stop_monitoring_products(["B000UNKNWN"])
+    assert not monitors.waiting.is_set()
+    assert len(main.active_monitors) == 2
@@ -0,0 +1,150 @@
+import http.server
+import json
+import threading
+import time
+
+import pytest
+
+import main
+
+
+class stub_bot_api:
+    """
+    Local stub of the Telegram Bot API: records the texts it receives and replies with the queued responses, then 200.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.responses = []
+        self.received = [] # (time, text)
+        self.gate = threading.Event() # Cleared to hold the replies
+        self.gate.set()
+        self.request_received = threading.Event()
+        stub = self
+
+        class handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                with stub.lock:
+                    stub.received.append((time.time(), payload["text"]))
+                    status, body = stub.responses.pop(0) if stub.responses else (200, {"ok": True, "result": {}})
+                stub.request_received.set()
+                stub.gate.wait()
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def texts(self):
+        with self.lock:
+            return [text for _, text in self.received]
+
+    def close(self):
+        self.gate.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub():
+    stub = stub_bot_api()
+    yield stub
+    stub.close()
+
+
+def create_notifier(stub, **kwargs):
+    return main.telegram_notifier("test-token", "test-chat", api_url=stub.url, log_sent=False, **kwargs)
+
+
+def test_notifications_are_sent_in_order(stub):
+    notifier = create_notifier(stub)
+    for i in range(20):
+        assert notifier.send(f"Notification #{i}")
+    notifier.flush()
+    notifier.close()
+
+    assert stub.texts() == [f"Notification #{i}" for i in range(20)]
+    stats = notifier.stats()
+    assert (stats["sent"], stats["failed"], stats["retries"]) == (20, 0, 0)
+
+
+def test_rate_limit_waits_for_retry_after(stub):
+    stub.responses = [(429, {"ok": False, "error_code": 429, "parameters": {"retry_after": 0.5}})]
+    notifier = create_notifier(stub)
+    notifier.send("First")
+    notifier.send("Second")
+    notifier.flush()
+    notifier.close()
+
+    # The rate limited notification is sent again before the next one
+    assert stub.texts() == ["First", "First", "Second"]
+    assert stub.received[1][0] - stub.received[0][0] >= 0.5
+    stats = notifier.stats()
+    assert (stats["sent"], stats["failed"], stats["retries"]) == (2, 0, 1)
+
+
+def test_server_errors_are_retried_with_backoff(stub):
+    stub.responses = [(500, {"ok": False}), (502, {"ok": False})]
+    notifier = create_notifier(stub, max_retries=2)
+    notifier.send("Retried")
+    notifier.flush()
+    notifier.close()
+
+    assert stub.texts() == ["Retried"] * 3
+    # 1s then 2s, plus up to 50% of jitter
+    assert stub.received[1][0] - stub.received[0][0] >= 1.0
+    assert stub.received[2][0] - stub.received[1][0] >= 2.0
+    stats = notifier.stats()
+    assert (stats["sent"], stats["failed"], stats["retries"]) == (1, 0, 2)
+
+
+def test_gives_up_after_max_retries(stub):
+    stub.responses = [(500, {"ok": False})] * 2
+    notifier = create_notifier(stub, max_retries=1)
+    notifier.send("Lost")
+    notifier.flush()
+    notifier.close()
+
+    assert stub.texts() == ["Lost"] * 2
+    stats = notifier.stats()
+    assert (stats["sent"], stats["failed"], stats["retries"]) == (0, 1, 1)
+
+
+def test_client_errors_are_not_retried(stub):
+    stub.responses = [(400, {"ok": False, "description": "Bad Request"})]
+    notifier = create_notifier(stub)
+    notifier.send("Rejected")
+    notifier.send("Accepted")
+    notifier.flush()
+    notifier.close()
+
+    assert stub.texts() == ["Rejected", "Accepted"]
+    stats = notifier.stats()
+    assert (stats["sent"], stats["failed"], stats["retries"]) == (1, 1, 0)
+
+
+def test_full_queue_drops_new_notifications(stub):
+    stub.gate.clear()
+    notifier = create_notifier(stub, max_queue_size=2)
+    assert notifier.send("In flight")
+    assert stub.request_received.wait(5)
+    assert notifier.send("Queued #1")
+    assert notifier.send("Queued #2")
+    assert not notifier.send("Dropped")
+    stub.gate.set()
+    notifier.flush()
+    notifier.close()
+
+    assert stub.texts() == ["In flight", "Queued #1", "Queued #2"]
+    stats = notifier.stats()
+    assert (stats["sent"], stats["dropped"]) == (3, 1)